@@ -0,0 +1,165 @@
+import collections
+import os
+import time
+
+BASE_ADAPTER = "__base__"  # PEFT's name for "no adapter" in a mixed batch
+WEIGHT_FILES = ("adapter_model.safetensors", "adapter_model.bin")
+
+
+def adapter_version(path):
+    """Identifies what is saved in an adapter directory now: weights file mtime and size; None if there is none."""
+    for name in WEIGHT_FILES:
+        try:
+            st = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            continue
+        return f"{st.st_mtime_ns}-{st.st_size}"
+    return None
+
+
+class AdapterNotFound(KeyError):
+    pass
+
+
+class AdapterRegistry:
+    """Many LoRA adapters over one resident base model.
+
+    Adapters are loaded from <adapter_root>/<name> (the directories that
+    save_pretrained writes) the first time a request names them, and evicted
+    least-recently-used once their combined size exceeds memory_budget_bytes.
+    Adapters used by the batch being prepared are never evicted. An adapter
+    whose directory was written again (a training job saving over it) is
+    reloaded on its next use; version() tells the caches which weights they
+    hold results of. Only the model thread changes the registry, so there is no
+    locking.
+    """
+
+    def __init__(self, base_model, adapter_root, memory_budget_bytes, extra_paths=None, default_adapter=None):
+        self.model = base_model        # becomes a PeftModel once the first adapter is loaded
+        self.adapter_root = adapter_root
+        self.memory_budget_bytes = memory_budget_bytes
+        self.extra_paths = dict(extra_paths or {})  # name -> directory outside adapter_root
+        self.default_adapter = default_adapter      # used for requests that don't name one
+        self.resident = collections.OrderedDict()  # name -> bytes, least recently used first
+        self.versions = {}  # name -> adapter_version of the resident weights
+        self.metrics = {"loads": 0, "hits": 0, "reloads": 0, "evictions": 0, "load_seconds_total": 0.0,
+                        "last_load_seconds": 0.0}
+
+    def path_for(self, name):
+        if name in self.extra_paths:
+            return self.extra_paths[name]
+        # Adapter names come from requests; never let them walk out of adapter_root.
+        if os.path.basename(name) != name or name in ("", ".", ".."):
+            raise AdapterNotFound(name)
+        return os.path.join(self.adapter_root, name)
+
+    def exists(self, name):
+        name = self.resolve(name)
+        if name == BASE_ADAPTER or name in self.resident:
+            return True
+        try:
+            return os.path.exists(os.path.join(self.path_for(name), "adapter_config.json"))
+        except AdapterNotFound:
+            return False
+
+    def resolve(self, name):
+        """Maps a request's adapter field to a PEFT adapter name."""
+        if name is None:
+            name = self.default_adapter
+        return BASE_ADAPTER if name in (None, "base", BASE_ADAPTER) else name
+
+    def version(self, name):
+        """Version of the weights on disk for a request's adapter field; None for the base model or unknown names."""
+        name = self.resolve(name)
+        if name == BASE_ADAPTER:
+            return None
+        try:
+            return adapter_version(self.path_for(name))
+        except AdapterNotFound:
+            return None
+
+    def cache_key(self, name):
+        """What caches key a resolved adapter name's results by: the name and the resident version."""
+        return name if name == BASE_ADAPTER else f"{name}@{self.versions.get(name)}"
+
+    def available(self):
+        names = set(self.extra_paths)
+        if os.path.isdir(self.adapter_root):
+            names.update(d for d in os.listdir(self.adapter_root)
+                         if os.path.exists(os.path.join(self.adapter_root, d, "adapter_config.json")))
+        return sorted(names)
+
+    def _adapter_bytes(self, name):
+        marker = f".{name}."
+        return sum(p.numel() * p.element_size() for n, p in self.model.named_parameters()
+                   if marker in n and ".lora_" in n)
+
+    def _load(self, name):
+        path = self.path_for(name)
+        if not os.path.exists(os.path.join(path, "adapter_config.json")):
+            raise AdapterNotFound(name)
+        start = time.perf_counter()
+        version = adapter_version(path)  # before reading: a save during the load shows up as a new version
+        if hasattr(self.model, "load_adapter") and hasattr(self.model, "peft_config"):
+            self.model.load_adapter(path, adapter_name=name)
+        else:
+            from peft import PeftModel
+
+            self.model = PeftModel.from_pretrained(self.model, path, adapter_name=name)
+        self.model.eval()
+        seconds = time.perf_counter() - start
+        self.resident[name] = self._adapter_bytes(name)
+        self.versions[name] = version
+        self.metrics["loads"] += 1
+        self.metrics["load_seconds_total"] += seconds
+        self.metrics["last_load_seconds"] = seconds
+        print(f"Loaded adapter '{name}' in {seconds * 1000:.1f}ms ({self.resident[name] / 1e6:.1f} MB)")
+
+    def _evict(self, keep):
+        for name in list(self.resident):
+            if self.resident_bytes() <= self.memory_budget_bytes:
+                return
+            if name in keep:
+                continue
+            self._unload(name)
+            self.metrics["evictions"] += 1
+            print(f"Evicted adapter '{name}'")
+
+    def _unload(self, name):
+        self.model.delete_adapter(name)
+        del self.resident[name]
+        del self.versions[name]
+
+    def resident_bytes(self):
+        return sum(self.resident.values())
+
+    def prepare(self, names):
+        """Makes every named adapter resident; returns the per-row adapter_names list for PEFT.
+
+        None means the default adapter, "base" the plain base model. Raises
+        AdapterNotFound for names that don't exist on disk.
+        """
+        names = [self.resolve(n) for n in names]
+        wanted = {n for n in names if n != BASE_ADAPTER}
+        for name in wanted:
+            if name in self.resident and self.versions[name] != adapter_version(self.path_for(name)):
+                print(f"Adapter '{name}' changed on disk; reloading")
+                self._unload(name)
+                self.metrics["reloads"] += 1
+            if name in self.resident:
+                self.resident.move_to_end(name)
+                self.metrics["hits"] += 1
+            else:
+                self._load(name)
+        self._evict(keep=wanted)
+        return names
+
+    def stats(self):
+        loads = self.metrics["loads"]
+        return {
+            "resident": list(self.resident),
+            "resident_bytes": self.resident_bytes(),
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "avg_load_seconds": self.metrics["load_seconds_total"] / loads if loads else 0.0,
+            **self.metrics,
+        }
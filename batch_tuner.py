@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from packing import TokenBudgetBatchSampler
+
+# Probed batch sizes are cached per hardware/model/LoRA/length/budget signature, so
+# only the first run on a new setup pays for the probe.
+TUNING_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", ".cache", "batch_tuning.json")
+SAFETY_MARGIN = 0.9     # use at most this share of the budget; allocator fragmentation and stray buffers need room
+MAX_PROBE_ROWS = 1024
+# Budgets are rounded down to this before probing and hashing. The default GPU budget
+# comes from the free memory, which differs by a few MB from run to run.
+BUDGET_BUCKET = 256 * 2**20
+
+
+def hardware_signature():
+    if torch.cuda.is_available():
+        props = torch.cuda.get_device_properties(0)
+        return f"cuda:{props.name}:{props.total_memory}"
+    return "cpu"
+
+
+def tuning_signature(model, lora_config, sequence_length, memory_budget, dtype):
+    """Everything the probed size depends on, hashed."""
+    base = getattr(model, "get_base_model", lambda: model)()
+    parts = {
+        "hardware": hardware_signature(),
+        "model": base.config.to_json_string(use_diff=False),
+        "lora": {"r": lora_config.r, "alpha": lora_config.lora_alpha, "dropout": lora_config.lora_dropout,
+                 "targets": sorted(lora_config.target_modules)},
+        "sequence_length": int(sequence_length),
+        "memory_budget": int(memory_budget),
+        "dtype": str(dtype),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:24]
+
+
+def default_memory_budget():
+    """90% of the GPU's currently free memory; None on CPU, where the budget has to be given.
+
+    tune_batch_tokens rounds it down to BUDGET_BUCKET, so runs on the same GPU share a cache entry.
+    """
+    if not torch.cuda.is_available():
+        return None
+    free, _ = torch.cuda.mem_get_info()
+    return int(free * 0.9)
+
+
+def _static_training_bytes(model):
+    """Memory the step needs besides activations: weights, trainable grads and Adam's two fp32 moments."""
+    weights = sum(p.numel() * p.element_size() for p in model.parameters())
+    trainable = [p for p in model.parameters() if p.requires_grad]
+    grads = sum(p.numel() * p.element_size() for p in trainable)
+    adam = sum(p.numel() * 4 * 2 for p in trainable)
+    return weights, grads + adam
+
+
+def measure_step_bytes(model, rows, sequence_length, vocab_size, packed=True, autocast_dtype=None):
+    """Peak memory of one forward + backward on a (rows, sequence_length) batch.
+
+    On GPU this is the allocator's peak, plus the optimizer state that doesn't
+    exist yet at probe time. On CPU the allocator keeps no peak. So it is
+    weights, grads and optimizer state, plus every tensor autograd saves for
+    backward. That is where activation memory goes, and it is what grows with
+    the batch. Raises torch.cuda.OutOfMemoryError when the batch doesn't fit.
+    """
+    device = next(model.parameters()).device
+    input_ids = torch.randint(0, vocab_size, (rows, sequence_length), device=device)
+    batch = {"input_ids": input_ids, "labels": input_ids.clone()}
+    if packed:
+        batch["position_ids"] = torch.arange(sequence_length, device=device).repeat(rows, 1)
+        batch["use_cache"] = False
+    else:
+        batch["attention_mask"] = torch.ones_like(input_ids)
+    weights, training_state = _static_training_bytes(model)
+    param_storages = {p.untyped_storage().data_ptr() for p in model.parameters()}
+    saved = {}
+
+    def pack(tensor):
+        ptr = tensor.untyped_storage().data_ptr()
+        if tensor.device.type == "cpu" and ptr not in param_storages:  # weights are already counted
+            saved[ptr] = tensor.untyped_storage().nbytes()
+        return tensor
+
+    model.train()
+    model.zero_grad(set_to_none=True)
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+    try:
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t), \
+                torch.autocast(device.type, dtype=autocast_dtype, enabled=autocast_dtype is not None):
+            loss = model(**batch).loss
+        loss.backward()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            grads = sum(p.numel() * p.element_size() for p in model.parameters() if p.requires_grad)
+            # The peak already holds the weights and the grads; the Adam moments don't exist yet.
+            return torch.cuda.max_memory_allocated(device) + training_state - grads
+        return weights + training_state + sum(saved.values())
+    finally:
+        model.zero_grad(set_to_none=True)
+        del batch, input_ids
+
+
+def probe_max_batch_tokens(model, sequence_length, memory_budget, vocab_size, packed=True, autocast_dtype=None,
+                           max_rows=MAX_PROBE_ROWS):
+    """Largest token budget (a multiple of sequence_length) whose step fits SAFETY_MARGIN * memory_budget.
+
+    Doubles the rows until a step doesn't fit, then bisects. Returns
+    (max_batch_tokens, probes) where probes lists every (rows, bytes or None
+    for OOM) tried.
+    """
+    limit = memory_budget * SAFETY_MARGIN
+    probes = []
+
+    def fits(rows):
+        try:
+            used = measure_step_bytes(model, rows, sequence_length, vocab_size, packed, autocast_dtype)
+        except torch.cuda.OutOfMemoryError:
+            torch.cuda.empty_cache()
+            probes.append((rows, None))
+            return False
+        probes.append((rows, used))
+        return used <= limit
+
+    if not fits(1):
+        raise ValueError(f"One sequence of {sequence_length} tokens doesn't fit in {memory_budget / 2**20:.0f} MiB "
+                         f"(needs {probes[-1][1] / 2**20:.0f} MiB)" if probes[-1][1] else
+                         f"One sequence of {sequence_length} tokens doesn't fit in GPU memory")
+    good, bad = 1, None
+    while bad is None and good < max_rows:
+        rows = min(good * 2, max_rows)
+        if fits(rows):
+            good = rows
+        else:
+            bad = rows
+    while bad is not None and bad - good > 1:
+        mid = (good + bad) // 2
+        if fits(mid):
+            good = mid
+        else:
+            bad = mid
+    return good * sequence_length, probes
+
+
+def gradient_accumulation_for(lengths, max_batch_tokens, target_tokens_per_step, seed=0):
+    """Accumulation steps that make an optimizer step see about target_tokens_per_step real tokens.
+
+    Uses the average real tokens of the batches TokenBudgetBatchSampler will
+    actually build. Those are less than max_batch_tokens because batches are
+    cut greedily by length.
+    """
+    if not target_tokens_per_step:
+        return 1
+    lengths = np.asarray(lengths)
+    batches = TokenBudgetBatchSampler(lengths, max_batch_tokens, seed=seed)._batches()
+    avg_tokens = float(np.mean([lengths[b].sum() for b in batches])) if batches else max_batch_tokens
+    return max(1, int(round(target_tokens_per_step / avg_tokens)))
+
+
+def _load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def tune_batch_tokens(model, lora_config, sequence_length, memory_budget, vocab_size, packed=True,
+                      autocast_dtype=None, cache_file=None):
+    """Cached probe_max_batch_tokens. Returns {"max_batch_tokens", "signature", "cached", "probe_seconds", ...}."""
+    cache_file = cache_file or TUNING_CACHE_FILE
+    if memory_budget >= BUDGET_BUCKET:
+        memory_budget = memory_budget // BUDGET_BUCKET * BUDGET_BUCKET
+    dtype = autocast_dtype or next(model.parameters()).dtype
+    signature = tuning_signature(model, lora_config, sequence_length, memory_budget, dtype)
+    cache = _load_cache(cache_file)
+    if signature in cache:
+        return {**cache[signature], "signature": signature, "cached": True}
+    start = time.perf_counter()
+    max_batch_tokens, probes = probe_max_batch_tokens(model, sequence_length, memory_budget, vocab_size, packed,
+                                                      autocast_dtype)
+    entry = {"max_batch_tokens": max_batch_tokens, "sequence_length": int(sequence_length),
+             "memory_budget": int(memory_budget), "hardware": hardware_signature(),
+             "probes": probes, "probe_seconds": time.perf_counter() - start, "tuned_at": time.time()}
+    cache = _load_cache(cache_file)  # another job may have written meanwhile
+    cache[signature] = entry
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, cache_file)
+    return {**entry, "signature": signature, "cached": False}
@@ -0,0 +1,246 @@
+"""Versioned environment bundles and the on-start script that restores them on a new instance.
+
+Two artifacts are built locally into BUNDLE_DIR, each named by a hash of its content:
+
+  akasha-env-<hash>.tar     wheelhouse/ plus requirements.lock pinning every wheel in it
+  akasha-src-<hash>.tar.gz  snapshot of the deployable files (what deploy.py would send), no git history
+
+The generated on-start script checks for each artifact in the order below and
+stops at the first that works. It skips apt-get and pip completely when the
+hashes show nothing changed:
+
+  1. Already installed: the project or site-packages holds the same hash.
+  2. Cached on the instance disk, e.g. a restarted instance or a persistent volume.
+  3. Downloaded from AKASHA_BUNDLE_URL. Upload BUNDLE_DIR's files there.
+  4. Fallback: shallow git clone and a pinned online install.
+
+Each phase is timed. The timings go to /workspace/bootstrap_timings.json, which
+the health check server also serves.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import shlex
+import tarfile
+
+from deploy import (REMOTE_DIR, REPO_ROOT, REQUIREMENTS_FILE, TRAIN_REQUIREMENTS, WHEELHOUSE_DIR, build_manifest,
+                    build_wheelhouse, file_sha256)
+
+BUNDLE_DIR = os.path.join(REPO_ROOT, "data", ".cache", "bundles")
+BUNDLE_URL = os.environ.get("AKASHA_BUNDLE_URL", "")  # base URL the bundle files are published under
+INSTANCE_CACHE_DIR = "/workspace/.akasha-cache"
+TIMINGS_FILE = "/workspace/bootstrap_timings.json"
+LOCK_FILE = "requirements.lock"
+KEEP_BUNDLES = 3
+
+
+def lock_from_wheelhouse(wheelhouse):
+    """'name==version' for every wheel in the directory, sorted: the exact set pip will install."""
+    pins = set()
+    for name in os.listdir(wheelhouse):
+        if name.endswith(".whl"):
+            project, version = name.split("-")[:2]
+            pins.add(f"{project.replace('_', '-').lower()}=={version}")
+    return "".join(f"{pin}\n" for pin in sorted(pins))
+
+
+def _content_hash(manifest, paths):
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        h.update(f"{path}\0{manifest[path]['sha256']}\0{manifest[path]['mode']}\n".encode())
+    return h.hexdigest()
+
+
+def _reset_tarinfo(info):
+    """Same content, same tar bytes: no timestamps or owners, so a rebuild gets the same sha256."""
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info
+
+
+def _write_tar(path, root, files, extra=None, compress=False):
+    with open(path + ".tmp", "wb") as raw:
+        fileobj = gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) if compress else raw
+        with tarfile.open(fileobj=fileobj, mode="w", format=tarfile.PAX_FORMAT) as tar:
+            for rel in sorted(files):
+                tar.add(os.path.join(root, rel), arcname=rel, recursive=False, filter=_reset_tarinfo)
+            for rel, data in sorted((extra or {}).items()):
+                info = _reset_tarinfo(tarfile.TarInfo(rel))
+                info.size, info.mode = len(data), 0o644
+                tar.addfile(info, io.BytesIO(data))
+        if compress:
+            fileobj.close()
+    os.replace(path + ".tmp", path)
+
+
+def build_bundle(root=REPO_ROOT, out_dir=BUNDLE_DIR, wheelhouse=True):
+    """Builds (or finds already built) the env and source bundles for the current tree.
+
+    Returns {"env": {...}, "src": {...}, "lock": str}, each artifact described by
+    "file", "path", "sha256", "hash" (content hash, also in the file name) and
+    "bytes". "env" is None when wheelhouse=False or the wheelhouse can't be
+    built, e.g. offline. Instances then install the lock (or, with no lock,
+    the plain requirements) from PyPI.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if wheelhouse:
+        try:
+            build_wheelhouse(root)
+        except Exception as e:
+            print(f"  WARNING: could not build the wheelhouse ({e}); instances will install from PyPI.")
+            wheelhouse = False
+    manifest = build_manifest(root)
+    wheel_files = [p for p in manifest if p.startswith(WHEELHOUSE_DIR + "/") and p.endswith(".whl")]
+    src_files = [p for p in manifest if not p.startswith(WHEELHOUSE_DIR + "/")]
+    bundle = {"env": None, "src": None}
+
+    if wheelhouse and wheel_files:
+        lock = lock_from_wheelhouse(os.path.join(root, WHEELHOUSE_DIR))
+        env_hash = hashlib.sha256((_content_hash(manifest, wheel_files) + lock).encode()).hexdigest()
+        bundle["env"] = _build_artifact(out_dir, f"akasha-env-{env_hash[:16]}.tar", env_hash, root, wheel_files,
+                                        extra={f"{WHEELHOUSE_DIR}/{LOCK_FILE}": lock.encode()})
+    else:
+        with open(os.path.join(root, REQUIREMENTS_FILE), "r") as f:
+            requirements = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        lock = "".join(f"{r}\n" for r in requirements + [r for r in TRAIN_REQUIREMENTS if r not in requirements])
+    bundle["lock"] = lock
+
+    src_hash = _content_hash(manifest, src_files)
+    bundle["src"] = _build_artifact(out_dir, f"akasha-src-{src_hash[:16]}.tar.gz", src_hash, root, src_files,
+                                    compress=True)
+    _prune(out_dir, keep={bundle["src"]["file"], (bundle["env"] or {}).get("file")})
+    return bundle
+
+
+def _build_artifact(out_dir, file_name, content_hash, root, files, extra=None, compress=False):
+    path = os.path.join(out_dir, file_name)
+    if not os.path.exists(path):
+        _write_tar(path, root, files, extra=extra, compress=compress)
+    return {"file": file_name, "path": path, "hash": content_hash, "sha256": file_sha256(path),
+            "bytes": os.path.getsize(path)}
+
+
+def _prune(out_dir, keep):
+    """Keeps the newest KEEP_BUNDLES bundles of each kind (and whatever is in use)."""
+    for prefix in ("akasha-env-", "akasha-src-"):
+        files = sorted((f for f in os.listdir(out_dir) if f.startswith(prefix) and not f.endswith(".tmp")),
+                       key=lambda f: os.path.getmtime(os.path.join(out_dir, f)), reverse=True)
+        for name in files[KEEP_BUNDLES:]:
+            if name not in keep:
+                os.remove(os.path.join(out_dir, name))
+
+
+def render_on_start_script(bundle, git_repo_url, health_port, project_dir=REMOTE_DIR, bundle_url=BUNDLE_URL):
+    """The instance's on-start script for this bundle (see the module docstring for what it does)."""
+    env, src = bundle["env"] or {}, bundle["src"]
+    env_hash = env.get("hash") or hashlib.sha256(bundle["lock"].encode()).hexdigest()
+    q = shlex.quote
+    return f"""#!/bin/bash
+# Generated by bootstrap.py: restores environment {env_hash[:16]} and source {src['hash'][:16]}.
+CACHE={q(INSTANCE_CACHE_DIR)}; PROJECT={q(project_dir)}; TIMINGS={q(TIMINGS_FILE)}
+BUNDLE_URL={q(bundle_url.rstrip('/'))}
+ENV_BUNDLE={q(env.get('file', ''))}; ENV_SHA256={q(env.get('sha256', ''))}; ENV_HASH={env_hash}
+SRC_BUNDLE={q(src['file'])}; SRC_SHA256={src['sha256']}; SRC_HASH={src['hash']}
+LOCK=$CACHE/requirements-$ENV_HASH.lock
+mkdir -p $CACHE
+echo "--- Bootstrap: env $ENV_HASH, source $SRC_HASH ---"
+
+T_START=$(date +%s%3N); T_LAST=$T_START; PHASES=""
+mark() {{  # mark <phase> <what happened>: records the time since the previous mark
+    local now=$(date +%s%3N)
+    PHASES="$PHASES\\"$1\\": {{\\"seconds\\": $(( now - T_LAST ))e-3, \\"result\\": \\"$2\\"}}, "
+    echo "[bootstrap] $1: $2 ($(( now - T_LAST )) ms)"
+    T_LAST=$now
+}}
+write_timings() {{
+    echo "{{\\"env\\": \\"$ENV_HASH\\", \\"src\\": \\"$SRC_HASH\\", \\"ok\\": $1, \\"total_seconds\\": $(( $(date +%s%3N) - T_START ))e-3, \\"phases\\": {{${{PHASES%, }}}}}}" > $TIMINGS
+}}
+fail() {{ mark "$1" "FAILED: $2"; write_timings false; echo "ERROR: $2"; exit 1; }}
+fetch() {{  # fetch <file> <sha256>: makes sure $CACHE/<file> is present and intact
+    [ -n "$1" ] || {{ echo "no bundle"; return 1; }}
+    if [ -f "$CACHE/$1" ] && echo "$2  $CACHE/$1" | sha256sum -c --status; then echo "cached"; return 0; fi
+    [ -n "$BUNDLE_URL" ] || {{ echo "not cached, no AKASHA_BUNDLE_URL"; return 1; }}
+    if python3 -c 'import sys, urllib.request; urllib.request.urlretrieve(sys.argv[1], sys.argv[2])' \\
+            "$BUNDLE_URL/$1" "$CACHE/$1.part" 2>/dev/null && echo "$2  $CACHE/$1.part" | sha256sum -c --status; then
+        mv "$CACHE/$1.part" "$CACHE/$1"; echo "downloaded"; return 0
+    fi
+    rm -f "$CACHE/$1.part"; echo "download failed"; return 1
+}}
+
+cat > $LOCK << 'AKASHA_LOCK_EOF'
+{bundle['lock']}AKASHA_LOCK_EOF
+
+# Source: same snapshot already there > bundle > shallow clone.
+if [ "$(cat $PROJECT/.bootstrap_src 2>/dev/null)" = "$SRC_HASH" ]; then
+    mark source "unchanged"
+else
+    R=$(fetch "$SRC_BUNDLE" "$SRC_SHA256"); OK=$?; mark fetch_source "$R"
+    if [ $OK -eq 0 ]; then
+        mkdir -p $PROJECT && tar -xzf "$CACHE/$SRC_BUNDLE" -C $PROJECT || fail source "could not extract $SRC_BUNDLE"
+        echo $SRC_HASH > $PROJECT/.bootstrap_src
+        mark source "extracted"
+    else
+        if ! command -v git > /dev/null; then
+            apt-get update && apt-get install -y git || fail apt "could not install git"
+            mark apt "installed git"
+        fi
+        if [ -d $PROJECT/.git ]; then
+            mark source "existing clone"
+        else
+            git clone --depth 1 {q(git_repo_url)} $PROJECT || fail source "could not clone {git_repo_url}"
+            mark source "shallow clone"
+        fi
+    fi
+fi
+
+# Dependencies: same environment already installed > offline from the env bundle > pinned online install.
+SITE=$(python3 -c 'import sysconfig; print(sysconfig.get_paths()["purelib"])')
+if [ -f "$SITE/.akasha-env-$ENV_HASH" ]; then
+    mark deps "unchanged"
+else
+    R=$(fetch "$ENV_BUNDLE" "$ENV_SHA256"); OK=$?; mark fetch_env "$R"
+    if [ $OK -eq 0 ]; then
+        rm -rf $CACHE/wheelhouse && tar -xf "$CACHE/$ENV_BUNDLE" -C $CACHE || fail deps "could not extract $ENV_BUNDLE"
+        python3 -m pip install --no-index --no-deps --find-links $CACHE/wheelhouse -r $LOCK || fail deps "offline pip install failed"
+        mark deps "installed offline"
+    else
+        python3 -m pip install -r $LOCK || fail deps "pip install failed"
+        mark deps "installed from PyPI"
+    fi
+    touch "$SITE/.akasha-env-$ENV_HASH"
+fi
+
+write_timings true
+echo "--- Setup Complete ---"
+# Health check server from /workspace (so it also serves bootstrap_timings.json); logs in /workspace/health_server.log
+cd /workspace
+nohup python3 -m http.server {health_port} > /workspace/health_server.log 2>&1 &
+echo "Health check server started on port {health_port} (PID $!)."
+
+# Keep container running so server stays up
+sleep infinity
+"""
+
+
+def describe(bundle):
+    lines = []
+    for kind in ("env", "src"):
+        artifact = bundle[kind]
+        if artifact:
+            lines.append(f"  {kind}: {artifact['file']} ({artifact['bytes'] / 1e6:.1f} MB)")
+        else:
+            lines.append(f"  {kind}: none, instances install from PyPI")
+    if BUNDLE_URL:
+        lines.append(f"  Instances download missing bundles from {BUNDLE_URL}: upload the files in {BUNDLE_DIR} there.")
+    else:
+        lines.append("  AKASHA_BUNDLE_URL not set: new instances fall back to a shallow clone + pip install.")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    b = build_bundle()
+    print(describe(b))
+    print(json.dumps({k: v for k, v in b.items() if k != "lock"}, indent=2))
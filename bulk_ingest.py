@@ -0,0 +1,374 @@
+"""Bulk ingest of training data: archives and multi-file uploads into JSONL shards.
+
+Accepts tar archives (plain, .gz, .bz2, .xz), .zip, zstd-compressed files
+(.zst, including .tar.zst; needs the zstandard package), gzipped single files
+and plain .json/.jsonl files, in any mix. Every .json/.jsonl member is read as
+a stream:
+- .jsonl is read line by line;
+- a .json list is decoded one item at a time.
+No member and no archive is ever held in memory whole.
+
+Every record is checked against the instruction/input/output schema and
+normalized (dedup.normalize_record). Valid records are written to
+<out_dir>/<prefix>-00000.jsonl, -00001.jsonl, ... of about SHARD_BYTES each.
+Records that fail the check are counted and reported, not written.
+
+One thread reads and decompresses. It hands the lines, in batches of about
+UNIT_BYTES, to a pool of worker processes, which parse, validate and
+serialize them. The pool is started by the first ingest in a process and
+reused by every later one. At most two batches per worker are in flight, so
+memory is bounded however big the archive is.
+
+    python bulk_ingest.py uploads.tar.zst more/*.json --out data/ --prefix batch-7 --workers 4
+"""
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import fcntl
+import gzip
+import io
+import json
+import lzma
+import multiprocessing
+import os
+import re
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+
+from dedup import normalize_record
+from records import iter_json_list
+
+SHARD_BYTES = 64 * 1024 * 1024
+UNIT_BYTES = 1024 * 1024            # lines per batch handed to a worker (and the read size of .json lists)
+SMALL_JSON_BYTES = 4 * 1024 * 1024  # .json members up to this size are sent to a worker whole
+MAX_ERRORS = 20                     # invalid records listed in the report; all of them are counted
+ENCODER = json.JSONEncoder(ensure_ascii=False)  # json.dumps with any option builds a new encoder per call
+# One process reads; on a single CPU extra processes only add pickling, so 0 (no pool) there.
+DEFAULT_WORKERS = int(os.environ.get("AKASHA_INGEST_WORKERS", min(4, (os.cpu_count() or 1) - 1)))
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ARCHIVE_SUFFIXES = TAR_SUFFIXES + (".zip", ".zst", ".zstd", ".gz")
+DATA_SUFFIXES = (".json", ".jsonl")
+
+
+def is_supported(name):
+    return name.lower().endswith(DATA_SUFFIXES + ARCHIVE_SUFFIXES)
+
+
+def record_error(item):
+    """Why item isn't an instruction/input/output training record; None if it is one."""
+    if not isinstance(item, dict):
+        return f"expected an object, got {type(item).__name__}"
+    for field in ("instruction", "output"):
+        if not isinstance(item.get(field), str) or not item[field].strip():
+            return f"missing or empty {field!r}"
+    if not isinstance(item.get("input", ""), str):
+        return "'input' must be a string"
+    return None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd archives need the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def iter_members(f, name, size=None):
+    """Yields (member name, binary stream, size or None) for every data file in f, a binary file object named name.
+
+    Compressed members (data.jsonl.gz inside a tar) are opened in turn; files that are
+    neither data nor archives are yielded with a None stream, so they can be reported.
+    A .zip needs a seekable f; everything else is read front to back.
+    """
+    lower = name.lower()
+    if lower.endswith(DATA_SUFFIXES):
+        yield name, f, size
+    elif lower.endswith(TAR_SUFFIXES):
+        with tarfile.open(fileobj=f, mode="r|*") as tar:
+            for info in tar:
+                if info.isfile():
+                    yield from iter_members(tar.extractfile(info), info.name, info.size)
+    elif lower.endswith(".zip"):
+        if not f.seekable():
+            yield name, None, size  # a zip inside a tar stream: its index is at the end
+            return
+        with zipfile.ZipFile(f) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as member:
+                        yield from iter_members(member, info.filename, info.file_size)
+    elif lower.endswith((".zst", ".zstd")):
+        zstandard = _zstandard()
+        reader = zstandard.ZstdDecompressor().stream_reader(f, closefd=False)
+        try:
+            yield from iter_members(io.BufferedReader(reader, UNIT_BYTES), name[:lower.rindex(".")])
+        except zstandard.ZstdError as e:
+            raise OSError(f"invalid zstd data: {e}")
+    elif lower.endswith(".gz"):
+        with gzip.GzipFile(fileobj=f, mode="rb") as g:
+            yield from iter_members(g, name[:-3])
+    else:
+        yield name, None, size
+
+
+def _units(member, stream, size):
+    """Splits one data member into the batches sent to workers: (member, first index, kind, payload)."""
+    if member.lower().endswith(".jsonl"):
+        lines, batch_bytes, first = [], 0, 0
+        for line in stream:
+            lines.append(line)
+            batch_bytes += len(line)
+            if batch_bytes >= UNIT_BYTES:
+                yield member, first, "lines", lines
+                first += len(lines)
+                lines, batch_bytes = [], 0
+        if lines:
+            yield member, first, "lines", lines
+    elif size is not None and size <= SMALL_JSON_BYTES:
+        yield member, 0, "json", stream.read()
+    else:  # a big .json list is decoded here, item by item; workers only validate and serialize
+        items, first = [], 0
+        for item in iter_json_list(stream):
+            items.append(item)
+            if len(items) >= 1000:
+                yield member, first, "items", items
+                first += len(items)
+                items = []
+        if items:
+            yield member, first, "items", items
+
+
+def convert(unit):
+    """Runs in a worker: parses, validates and normalizes one batch. Returns the JSONL lines and the counts."""
+    member, first, kind, payload = unit
+    result = {"lines": [], "records_in": 0, "invalid": 0, "errors": []}
+
+    def invalid(index, reason):
+        result["invalid"] += 1
+        if len(result["errors"]) < MAX_ERRORS:
+            result["errors"].append({"member": member, "index": index, "error": reason})
+
+    if kind == "json":
+        try:
+            payload = json.loads(payload)
+        except ValueError as e:  # JSONDecodeError, UnicodeDecodeError
+            result["records_in"] += 1
+            invalid(None, f"invalid JSON: {e}")
+            return result
+        payload = payload if isinstance(payload, list) else [payload]
+    for index, item in enumerate(payload, first):
+        result["records_in"] += 1
+        if kind == "lines":
+            if not item.strip():
+                result["records_in"] -= 1
+                continue
+            try:
+                item = json.loads(item)
+            except ValueError as e:
+                invalid(index, f"invalid JSON: {e}")
+                continue
+        error = record_error(item)
+        if error:
+            invalid(index, error)
+            continue
+        result["lines"].append((ENCODER.encode(normalize_record(item)) + "\n").encode())
+    return result
+
+
+_pools = {}  # workers -> ProcessPoolExecutor, shared by every ingest in this process
+_pools_lock = threading.Lock()
+
+
+def get_pool(workers):
+    """The process's pool of `workers` converter processes, started on first use and then reused."""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = concurrent.futures.ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("forkserver"))
+        return pool
+
+
+def _drop_pool(workers, pool):
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@contextlib.contextmanager
+def prefix_lock(out_dir, prefix):
+    """Holds <out_dir>/.<prefix>.lock, so two ingests under one prefix run one after the other.
+
+    The lock file is removed on release; a waiter that then gets the lock on the
+    removed file tries again on the current one.
+    """
+    path = os.path.join(out_dir, f".{prefix}.lock")
+    while True:
+        f = open(path, "a")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    try:
+        yield
+    finally:
+        os.remove(path)
+        f.close()
+
+
+class ShardWriter:
+    """Writes lines to <out_dir>/<prefix>-00000.jsonl, -00001.jsonl, ... of about shard_bytes each.
+
+    Shards are written as .part files and renamed when the ingest finishes, so training
+    never picks up half an upload. A last shard under half of shard_bytes is appended
+    to the one before it, so every shard is between 0.5x and 1.5x shard_bytes. Shards
+    left by an earlier upload under the same prefix are removed.
+    """
+
+    def __init__(self, out_dir, prefix, shard_bytes=SHARD_BYTES):
+        self.out_dir, self.prefix, self.shard_bytes = out_dir, prefix, shard_bytes
+        self.shards = []  # [path, records, bytes]
+        self.f = None
+
+    def _path(self, index):
+        return os.path.join(self.out_dir, f"{self.prefix}-{index:05d}.jsonl")
+
+    def write(self, lines):
+        for line in lines:
+            if self.f is None or self.shards[-1][2] >= self.shard_bytes:
+                if self.f is not None:
+                    self.f.close()
+                self.shards.append([self._path(len(self.shards)), 0, 0])
+                self.f = open(self.shards[-1][0] + ".part", "wb")
+            self.f.write(line)
+            self.shards[-1][1] += 1
+            self.shards[-1][2] += len(line)
+
+    def close(self):
+        """Finishes the shards and returns [{"file", "records", "bytes"}, ...]."""
+        if self.f is not None:
+            self.f.close()
+        if len(self.shards) > 1 and self.shards[-1][2] < self.shard_bytes // 2:
+            path, records, size = self.shards.pop()
+            with open(path + ".part", "rb") as src, open(self.shards[-1][0] + ".part", "ab") as dst:
+                while chunk := src.read(UNIT_BYTES):
+                    dst.write(chunk)
+            os.remove(path + ".part")
+            self.shards[-1][1] += records
+            self.shards[-1][2] += size
+        pattern = re.compile(re.escape(self.prefix) + r"-\d{5}\.jsonl")
+        new = {os.path.basename(path) for path, _, _ in self.shards}
+        for name in os.listdir(self.out_dir):
+            if pattern.fullmatch(name) and name not in new:
+                os.remove(os.path.join(self.out_dir, name))
+        for path, _, _ in self.shards:
+            os.replace(path + ".part", path)
+        return [{"file": os.path.basename(path), "records": records, "bytes": size}
+                for path, records, size in self.shards]
+
+    def abort(self):
+        if self.f is not None:
+            self.f.close()
+        for path, _, _ in self.shards:
+            if os.path.exists(path + ".part"):
+                os.remove(path + ".part")
+
+
+def ingest(sources, out_dir, prefix, workers=DEFAULT_WORKERS, shard_bytes=SHARD_BYTES):
+    """Ingests sources, (name, binary file object) pairs, into JSONL shards in out_dir. Returns a report.
+
+    Invalid records and unreadable .json members are counted and listed (up to
+    MAX_ERRORS) without stopping the ingest; an archive that can't be read at all
+    raises ValueError and leaves no shards behind. Ingests under the same prefix
+    wait for each other (prefix_lock): the later one replaces the earlier one's shards.
+    """
+    with prefix_lock(out_dir, prefix):
+        return _ingest(sources, out_dir, prefix, workers, shard_bytes)
+
+
+def _ingest(sources, out_dir, prefix, workers, shard_bytes):
+    report = {"prefix": prefix, "sources": len(sources), "members": 0, "skipped_members": [],
+              "records_in": 0, "records_out": 0, "invalid": 0, "errors": []}
+    start = time.perf_counter()
+    writer = ShardWriter(out_dir, prefix, shard_bytes)
+    pool = get_pool(workers) if workers > 0 else None
+
+    def collect(result):
+        writer.write(result["lines"])
+        report["records_in"] += result["records_in"]
+        report["records_out"] += len(result["lines"])
+        report["invalid"] += result["invalid"]
+        report["errors"].extend(result["errors"][:MAX_ERRORS - len(report["errors"])])
+
+    pending = collections.deque()
+    try:
+        for name, f in sources:
+            try:
+                size = os.fstat(f.fileno()).st_size if isinstance(f, io.FileIO | io.BufferedReader) else None
+                for member, stream, size in iter_members(f, name, size):
+                    if stream is None:
+                        report["skipped_members"].append(member)
+                        continue
+                    report["members"] += 1
+                    try:
+                        for unit in _units(member, stream, size):
+                            if pool is None:
+                                collect(convert(unit))
+                                continue
+                            pending.append(pool.submit(convert, unit))
+                            if len(pending) >= 2 * workers:
+                                collect(pending.popleft().result())
+                    except ValueError as e:  # a .json list that isn't valid JSON past some point
+                        report["records_in"] += 1
+                        report["invalid"] += 1
+                        if len(report["errors"]) < MAX_ERRORS:
+                            report["errors"].append({"member": member, "index": None, "error": f"invalid JSON: {e}"})
+            except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError, zlib.error, lzma.LZMAError) as e:
+                raise ValueError(f"Can't read {name}: {e}")
+        while pending:
+            collect(pending.popleft().result())
+        report["shards"] = writer.close()
+    except BaseException as e:
+        writer.abort()
+        for future in pending:  # the pool is shared: cancel only this ingest's work
+            future.cancel()
+        if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+            _drop_pool(workers, pool)  # a worker died; the next ingest starts a new pool
+        raise
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    report["records_per_second"] = round(report["records_in"] / max(report["seconds"], 1e-9))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert archives and JSON files into validated JSONL shards.")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--out", default="data")
+    parser.add_argument("--prefix", help="shard name prefix (default: the first file's name)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--shard-mb", type=int, default=SHARD_BYTES // 2**20)
+    args = parser.parse_args()
+
+    prefix = args.prefix or os.path.basename(args.paths[0]).split(".")[0]
+    files = [open(path, "rb") for path in args.paths]
+    try:
+        report = ingest([(os.path.basename(p), f) for p, f in zip(args.paths, files)], args.out, prefix,
+                        args.workers, args.shard_mb * 2**20)
+    finally:
+        for f in files:
+            f.close()
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import concurrent.futures
+import copy
+import json
+import os
+import random
+import re
+import shutil
+import time
+
+import numpy as np
+import torch
+from safetensors.torch import load_file, save_file
+
+# A checkpoint directory is only valid once this file exists; it is written
+# last, after every other file, so a preempted write is never resumed from.
+MANIFEST_NAME = "checkpoint.json"
+ADAPTER_WEIGHTS = "adapter_model.safetensors"
+OPTIMIZER_WEIGHTS = "optimizer.safetensors"
+RNG_WEIGHTS = "rng_state.safetensors"
+CHECKPOINT_RE = re.compile(r"^checkpoint-(\d+)$")
+
+
+def _to_host(tensor):
+    """Copy of a tensor in host memory that later training steps can't modify."""
+    return tensor.detach().to("cpu", copy=True).contiguous()
+
+
+def flatten_optimizer_state(state_dict):
+    """Splits an optimizer state_dict into (tensors for safetensors, JSON-able metadata)."""
+    tensors, scalars = {}, {}
+    for param_id, param_state in state_dict["state"].items():
+        for name, value in param_state.items():
+            if torch.is_tensor(value):
+                tensors[f"state.{param_id}.{name}"] = _to_host(value)
+            else:
+                scalars[f"state.{param_id}.{name}"] = value
+    return tensors, {"param_groups": state_dict["param_groups"], "scalars": scalars}
+
+
+def unflatten_optimizer_state(tensors, meta):
+    state = {}
+    for key, value in list(tensors.items()) + list(meta["scalars"].items()):
+        _, param_id, name = key.split(".", 2)
+        state.setdefault(int(param_id), {})[name] = value
+    return {"state": state, "param_groups": meta["param_groups"]}
+
+
+def capture_rng_state():
+    """(tensors, metadata) for the python, numpy, torch and CUDA generators."""
+    np_state = np.random.get_state()
+    tensors = {"cpu": torch.get_rng_state(), "numpy": torch.from_numpy(np_state[1].astype(np.int64))}
+    if torch.cuda.is_available():
+        for i, s in enumerate(torch.cuda.get_rng_state_all()):
+            tensors[f"cuda.{i}"] = s
+    return tensors, {"python": random.getstate(), "numpy": [np_state[0], *np_state[2:]]}
+
+
+def restore_rng_state(tensors, meta):
+    version, state, gauss = meta["python"]
+    random.setstate((version, tuple(state), gauss))
+    name, pos, has_gauss, cached = meta["numpy"]
+    np.random.set_state((name, tensors["numpy"].numpy().astype(np.uint32), pos, has_gauss, cached))
+    torch.set_rng_state(tensors["cpu"])
+    cuda_states = [tensors[k] for k in sorted(k for k in tensors if k.startswith("cuda."))]
+    if cuda_states and torch.cuda.is_available() and len(cuda_states) == torch.cuda.device_count():
+        torch.cuda.set_rng_state_all(cuda_states)
+
+
+def is_valid_checkpoint(path):
+    manifest = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest):
+        return False
+    try:
+        with open(manifest, "r") as f:
+            files = json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return False
+    return all(os.path.exists(os.path.join(path, name)) and os.path.getsize(os.path.join(path, name)) == size
+               for name, size in files.items())
+
+
+def list_checkpoints(output_dir):
+    """Valid checkpoint directories in output_dir, oldest step first."""
+    if not os.path.isdir(output_dir):
+        return []
+    found = []
+    for name in os.listdir(output_dir):
+        match = CHECKPOINT_RE.match(name)
+        if match and is_valid_checkpoint(os.path.join(output_dir, name)):
+            found.append((int(match.group(1)), os.path.join(output_dir, name)))
+    return [path for _, path in sorted(found)]
+
+
+def find_latest_checkpoint(output_dir):
+    """Newest complete checkpoint in output_dir, or None. Half-written ones are skipped."""
+    checkpoints = list_checkpoints(output_dir)
+    return checkpoints[-1] if checkpoints else None
+
+
+def load_checkpoint_file(checkpoint_dir, name):
+    with open(os.path.join(checkpoint_dir, name), "r") as f:
+        return json.load(f)
+
+
+class AsyncCheckpointer:
+    """Adapter-only checkpoints written by a background thread.
+
+    save() copies the trainable state (LoRA weights, optimizer state, RNG) to
+    host memory on the training thread and returns; a single writer thread then
+    saves it as safetensors + JSON into checkpoint-N.tmp, writes the manifest
+    and renames the directory into place. At most one write is in flight: if
+    the previous one hasn't finished, save() waits for it first (reported as
+    wait_seconds). stall_seconds is the total time training was paused.
+    """
+
+    def __init__(self, save_total_limit=None):
+        self.save_total_limit = save_total_limit
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self.pending = None
+        self.stats = {"saves": 0, "stall_seconds": 0.0, "last_stall_seconds": 0.0, "wait_seconds": 0.0,
+                      "write_seconds": 0.0, "last_write_seconds": 0.0}
+
+    def save(self, checkpoint_dir, adapter_state, adapter_config, optimizer=None, json_files=None):
+        """adapter_state: PEFT state dict (get_peft_model_state_dict); json_files: name -> JSON-able object.
+
+        json_files must be fresh objects (state_dict() / asdict() results) that
+        training won't mutate, since they are serialized by the writer thread.
+        """
+        start = time.perf_counter()
+        self.wait()
+        waited = time.perf_counter() - start
+        tensors = {name: _to_host(t) for name, t in adapter_state.items()}
+        config = copy.deepcopy(adapter_config)
+        config.inference_mode = True  # as PeftModel.save_pretrained does, so the checkpoint can be served
+        json_files = dict(json_files or {})
+        optimizer_tensors = None
+        if optimizer is not None:
+            optimizer_tensors, json_files["optimizer.json"] = flatten_optimizer_state(optimizer.state_dict())
+        rng_tensors, json_files["rng_state.json"] = capture_rng_state()
+        self.pending = self.executor.submit(self._write, checkpoint_dir, tensors, config, optimizer_tensors,
+                                            rng_tensors, json_files)
+        stall = time.perf_counter() - start
+        self.stats["saves"] += 1
+        self.stats["wait_seconds"] += waited
+        self.stats["stall_seconds"] += stall
+        self.stats["last_stall_seconds"] = stall
+
+    def _write(self, checkpoint_dir, tensors, config, optimizer_tensors, rng_tensors, json_files):
+        start = time.perf_counter()
+        tmp_dir = checkpoint_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        save_file(tensors, os.path.join(tmp_dir, ADAPTER_WEIGHTS), metadata={"format": "pt"})
+        config.save_pretrained(tmp_dir)
+        if optimizer_tensors is not None:
+            save_file(optimizer_tensors, os.path.join(tmp_dir, OPTIMIZER_WEIGHTS))
+        save_file(rng_tensors, os.path.join(tmp_dir, RNG_WEIGHTS))
+        for name, value in json_files.items():
+            with open(os.path.join(tmp_dir, name), "w") as f:
+                json.dump(value, f, indent=2)
+        files = {name: os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir)}
+        with open(os.path.join(tmp_dir, MANIFEST_NAME), "w") as f:
+            json.dump({"files": files, "saved_at": time.time()}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        os.replace(tmp_dir, checkpoint_dir)
+        self._rotate(os.path.dirname(checkpoint_dir))
+        seconds = time.perf_counter() - start
+        self.stats["write_seconds"] += seconds
+        self.stats["last_write_seconds"] = seconds
+
+    def _rotate(self, output_dir):
+        if not self.save_total_limit:
+            return
+        for path in list_checkpoints(output_dir)[:-self.save_total_limit]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def wait(self):
+        """Blocks until the in-flight write is on disk; re-raises its error, if any."""
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def report(self):
+        saves = self.stats["saves"]
+        return {"avg_stall_seconds": self.stats["stall_seconds"] / saves if saves else 0.0, **self.stats}
@@ -0,0 +1,272 @@
+"""CPU serving export: the LoRA adapter merged into the base weights, quantized to int8.
+
+    python cpu_export.py --adapter ./lora_adapter --out ./cpu_model --eval-file data/heldout.jsonl
+    AKASHA_CPU_MODEL_DIR=./cpu_model uvicorn main:app
+
+merge_adapter folds W + (alpha/r) * B @ A into each adapted projection (q_proj,
+v_proj), so serving has no adapter layers left. quantize_state_dict then stores
+every Linear weight as int8 with one fp32 scale per output channel. Embeddings,
+norms and lm_head stay fp32. The export is a single model.safetensors that
+load_int8_model memory-maps, using every tensor in place. The int8 weights
+become Int8Linear layers, which run the matmuls as int8 GEMMs with
+torch._int_mm; serving later swaps in fbgemm's packed kernels.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import torch
+
+from dataset_shards import format_prompt, iter_records
+
+EXPORT_FORMAT = "akasha-int8-v1"
+MANIFEST_FILE = "akasha_int8.json"
+WEIGHTS_FILE = "model.safetensors"
+KEEP_FP32 = ("lm_head",)  # the output projection feeds the logits directly; int8 there moves them most
+
+
+def merge_adapter(base_model, adapter_dir):
+    """fp32 CPU model with the adapter's deltas merged into the base weights."""
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM
+
+    model = AutoModelForCausalLM.from_pretrained(base_model, dtype=torch.float32, trust_remote_code=True)
+    model = PeftModel.from_pretrained(model, adapter_dir)
+    return model.merge_and_unload().eval()
+
+
+def quantize_weight(weight):
+    """Symmetric per-output-channel int8: weight ~= q * scale[:, None]."""
+    weight = weight.detach().float()
+    scale = (weight.abs().amax(dim=1) / 127).clamp(min=1e-12)
+    q = torch.clamp(torch.round(weight / scale[:, None]), -127, 127).to(torch.int8)
+    return q, scale
+
+
+def quantize_state_dict(model, keep_fp32=KEEP_FP32):
+    """(tensors, quantized module names): Linear weights as <name>.weight_int8 + <name>.weight_scale, the rest fp32."""
+    quantized = [name for name, module in model.named_modules()
+                 if isinstance(module, torch.nn.Linear) and name.split(".")[-1] not in keep_fp32]
+    tensors = {}
+    for name in quantized:
+        q, scale = quantize_weight(model.get_submodule(name).weight)
+        tensors[f"{name}.weight_int8"] = q
+        tensors[f"{name}.weight_scale"] = scale
+    skip = {f"{name}.weight" for name in quantized}
+    for key, value in model.state_dict().items():
+        if key not in skip:
+            tensors[key] = value.detach().float().contiguous().clone()  # clone: tied weights can't share storage
+    return tensors, quantized
+
+
+def export(base_model, adapter_dir, out_dir, keep_fp32=KEEP_FP32, eval_prompts=None):
+    """Merges, quantizes and writes out_dir; returns the manifest.
+
+    With eval_prompts, the manifest also records the logit drift from the fp32
+    PEFT model, before and after the int8 layers are packed.
+    """
+    from safetensors.torch import save_file
+    from transformers import AutoTokenizer
+
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(base_model, trust_remote_code=True)
+    model = merge_adapter(base_model, adapter_dir)
+    tensors, quantized = quantize_state_dict(model, keep_fp32)
+    os.makedirs(out_dir, exist_ok=True)
+    save_file(tensors, os.path.join(out_dir, WEIGHTS_FILE), metadata={"format": EXPORT_FORMAT})
+    model.config.save_pretrained(out_dir)
+    tokenizer.save_pretrained(out_dir)
+    manifest = {
+        "format": EXPORT_FORMAT,
+        "base_model": base_model,
+        "adapter_dir": os.path.abspath(adapter_dir),
+        "quantized_modules": quantized,
+        "fp32_bytes": sum(p.numel() * 4 for p in model.parameters()),
+        "export_bytes": os.path.getsize(os.path.join(out_dir, WEIGHTS_FILE)),
+        "export_seconds": round(time.perf_counter() - start, 2),
+    }
+    _write_manifest(out_dir, manifest)
+    if eval_prompts:
+        from peft import PeftModel
+        from transformers import AutoModelForCausalLM
+
+        reference = AutoModelForCausalLM.from_pretrained(base_model, dtype=torch.float32, trust_remote_code=True)
+        reference = PeftModel.from_pretrained(reference, adapter_dir).eval()
+        model = load_int8_model(out_dir)[0]
+        manifest["logit_drift"] = logit_drift(reference, model, tokenizer, eval_prompts)
+        pack_in_background(model).join()
+        manifest["logit_drift_packed"] = logit_drift(reference, model, tokenizer, eval_prompts)
+        _write_manifest(out_dir, manifest)
+    return manifest
+
+
+def _write_manifest(out_dir, manifest):
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+class Int8Linear(torch.nn.Module):
+    """Linear layer over an int8 weight with per-output-channel scales, used in place from the mmap.
+
+    Activations are quantized per row on the fly and multiplied with
+    torch._int_mm (int8 x int8 -> int32). pack() switches to fbgemm's
+    prepacked weights. Those are faster again at small batch sizes, but they
+    are a copy and take about 10 s per GB to build, so serving packs in the
+    background (pack_in_background) rather than at startup.
+    """
+
+    def __init__(self, weight_int8, weight_scale, bias=None):
+        super().__init__()
+        self.out_features, self.in_features = weight_int8.shape
+        self.register_buffer("weight_int8", weight_int8)
+        self.register_buffer("weight_scale", weight_scale)
+        self.register_buffer("bias", bias)
+        self.packed = None
+
+    def pack(self):
+        qweight = torch._make_per_channel_quantized_tensor(
+            self.weight_int8, self.weight_scale.double(), torch.zeros(self.out_features, dtype=torch.long), 0)
+        self.packed = torch.ops.quantized.linear_prepack(qweight, self.bias)
+
+    def forward(self, x):
+        shape = x.shape
+        x = x.reshape(-1, self.in_features).float()
+        packed = self.packed  # may be set by the packing thread at any time
+        if packed is not None:
+            y = torch.ops.quantized.linear_dynamic(x, packed)
+        else:
+            x_scale = (x.abs().amax(dim=1, keepdim=True) / 127).clamp(min=1e-12)
+            x_int8 = torch.round(x / x_scale).to(torch.int8)
+            y = torch._int_mm(x_int8, self.weight_int8.t()).float() * x_scale * self.weight_scale
+            if self.bias is not None:
+                y = y + self.bias
+        return y.reshape(*shape[:-1], self.out_features)
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, packed={self.packed is not None}"
+
+
+def pack_layers(model):
+    """Packs every Int8Linear that isn't packed yet; returns how many it packed."""
+    layers = [m for m in model.modules() if isinstance(m, Int8Linear) and m.packed is None]
+    for layer in layers:
+        layer.pack()
+    return len(layers)
+
+
+def pack_in_background(model):
+    """Packs every Int8Linear on a daemon thread; requests keep being served meanwhile."""
+
+    def run():
+        start = time.perf_counter()
+        n = pack_layers(model)
+        if n:
+            print(f"Packed {n} int8 layers in {time.perf_counter() - start:.1f}s")
+
+    thread = threading.Thread(target=run, name="int8-pack", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_export(path):
+    return bool(path) and os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def load_int8_model(export_dir, timer=None):
+    """(model, tokenizer, seconds) for an export; the weights file is memory-mapped, not read.
+
+    The tokenizer is a LazyTokenizer, loaded on first use; timer (a
+    model_loading.StartupTimer) gets the time of each loading phase.
+    """
+    from model_loading import LazyTokenizer, StartupTimer, empty_model
+
+    timer = timer or StartupTimer()
+    with timer.phase("imports"):
+        from safetensors.torch import load_file
+        from transformers import AutoConfig
+
+    start = time.perf_counter()
+    with timer.phase("config"):
+        with open(os.path.join(export_dir, MANIFEST_FILE), "r") as f:
+            manifest = json.load(f)
+        if manifest["format"] != EXPORT_FORMAT:
+            raise ValueError(f"Unsupported export format {manifest['format']!r} in {export_dir}")
+        config = AutoConfig.from_pretrained(export_dir, trust_remote_code=True)
+    with timer.phase("model"):
+        model = empty_model(config)
+    with timer.phase("weights"):
+        tensors = load_file(os.path.join(export_dir, WEIGHTS_FILE))
+        for name in manifest["quantized_modules"]:
+            qlinear = Int8Linear(tensors.pop(f"{name}.weight_int8"), tensors.pop(f"{name}.weight_scale"),
+                                 tensors.pop(f"{name}.bias", None))
+            parent, _, child = name.rpartition(".")
+            setattr(model.get_submodule(parent), child, qlinear)
+        model.load_state_dict(tensors, strict=False, assign=True)
+        if getattr(config, "tie_word_embeddings", False):
+            model.tie_weights()
+    missing = [n for n, p in model.named_parameters() if p.is_meta]
+    if missing:
+        raise ValueError(f"Export {export_dir} has no weights for {missing[:5]}")
+    timer.notes["weights"] = "mmap, int8 export"
+    return model.eval(), LazyTokenizer(export_dir, timer), time.perf_counter() - start
+
+
+def read_prompts(path, limit=None):
+    """Prompts from a data file: the prompt half of each instruction record, as training formats it."""
+    prompts = []
+    for item in iter_records(path):
+        prompts.append(format_prompt(item) if isinstance(item, dict) else str(item))
+        if limit and len(prompts) >= limit:
+            break
+    return prompts
+
+
+@torch.inference_mode()
+def logit_drift(reference, model, tokenizer, prompts):
+    """How far model's next-token distributions are from reference's over every prompt position.
+
+    Returns the mean/max KL(reference || model), the max absolute logit
+    difference and how often the top-1 token agrees.
+    """
+    kl, max_kl, max_abs, agree, positions = 0.0, 0.0, 0.0, 0, 0
+    for prompt in prompts:
+        input_ids = torch.tensor([tokenizer(prompt)["input_ids"]])
+        ref = reference(input_ids=input_ids).logits[0].float()
+        out = model(input_ids=input_ids).logits[0].float()
+        ref_logp, out_logp = ref.log_softmax(-1), out.log_softmax(-1)
+        per_position = (ref_logp.exp() * (ref_logp - out_logp)).sum(-1)
+        kl += per_position.sum().item()
+        max_kl = max(max_kl, per_position.max().item())
+        max_abs = max(max_abs, (ref - out).abs().max().item())
+        agree += (ref.argmax(-1) == out.argmax(-1)).sum().item()
+        positions += len(per_position)
+    return {"prompts": len(prompts), "positions": positions, "mean_kl": kl / max(positions, 1), "max_kl": max_kl,
+            "max_abs_logit_diff": max_abs, "top1_agreement": agree / max(positions, 1)}
+
+
+def main():
+    from serving import ADAPTER_DIR, BASE_MODEL
+
+    parser = argparse.ArgumentParser(description="Merge a LoRA adapter into its base model and export int8 for CPU.")
+    parser.add_argument("--base-model", default=BASE_MODEL)
+    parser.add_argument("--adapter", default=ADAPTER_DIR)
+    parser.add_argument("--out", default="./cpu_model")
+    parser.add_argument("--keep-fp32", nargs="*", default=list(KEEP_FP32), help="Linear layer names left unquantized")
+    parser.add_argument("--eval-file", help="held-out .json/.jsonl records to measure the logit drift on")
+    parser.add_argument("--eval-limit", type=int, default=64)
+    args = parser.parse_args()
+
+    prompts = read_prompts(args.eval_file, args.eval_limit) if args.eval_file else None
+    manifest = export(args.base_model, args.adapter, args.out, tuple(args.keep_fp32), prompts)
+    print(f"Exported {len(manifest['quantized_modules'])} int8 layers to {args.out}: "
+          f"{manifest['export_bytes'] / 1e6:.1f} MB (fp32: {manifest['fp32_bytes'] / 1e6:.1f} MB) "
+          f"in {manifest['export_seconds']}s")
+    if "logit_drift" in manifest:
+        print(f"Logit drift vs. the fp32 adapter: {json.dumps(manifest['logit_drift'])}")
+        print(f"  with packed int8 layers: {json.dumps(manifest['logit_drift_packed'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import bisect
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+
+# Re-exported: the record helpers live in records.py, which doesn't need torch.
+from records import find_data_files, format_example, format_prompt, iter_records  # noqa: F401
+
+# Bump whenever the on-disk layout or the text formatting changes so old caches
+# are never read back with the wrong meaning.
+FORMAT_VERSION = 2
+TOKEN_DTYPE = np.int32          # DeepSeek/Llama vocabularies don't fit in uint16
+RECORDS_PER_SHARD = 100_000
+TOKENIZE_BATCH_SIZE = 1000
+DEFAULT_CACHE_DIR = os.path.join("data", ".cache", "tokenized")
+
+
+def tokenizer_signature(tokenizer):
+    """Identifies a tokenizer well enough that a different one never reuses a cache."""
+    return f"{type(tokenizer).__name__}:{getattr(tokenizer, 'name_or_path', '')}:{len(tokenizer)}"
+
+
+def cache_key(paths, tokenizer, max_length):
+    """Hash of the data file contents plus everything that affects the token IDs."""
+    h = hashlib.sha256()
+    h.update(f"v{FORMAT_VERSION}|{tokenizer_signature(tokenizer)}|{max_length}".encode())
+    for path in paths:
+        h.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                h.update(chunk)
+    return h.hexdigest()[:32]
+
+
+def _write_shard(out_dir, index, token_chunks, lengths, prompt_lengths):
+    tokens_path = os.path.join(out_dir, f"tokens-{index:05d}.bin")
+    with open(tokens_path, "wb") as f:
+        for chunk in token_chunks:
+            f.write(chunk.tobytes())
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    np.save(os.path.join(out_dir, f"offsets-{index:05d}.npy"), offsets)
+    np.save(os.path.join(out_dir, f"prompt_lengths-{index:05d}.npy"), np.asarray(prompt_lengths, dtype=np.int32))
+    return {"tokens": os.path.basename(tokens_path), "offsets": f"offsets-{index:05d}.npy",
+            "prompt_lengths": f"prompt_lengths-{index:05d}.npy",
+            "num_examples": len(lengths), "num_tokens": int(offsets[-1])}
+
+
+def build_shards(paths, tokenizer, max_length, out_dir, records_per_shard=RECORDS_PER_SHARD):
+    """Tokenizes every record once and writes flat token shards + offset indexes to out_dir."""
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    shards = []
+    token_chunks, lengths, prompt_lengths = [], [], []
+    texts, prompts = [], []
+
+    def flush_texts():
+        if not texts:
+            return
+        # Batched tokenizer calls are far faster than one call per example.
+        encoded = tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+        encoded_prompts = tokenizer(prompts, truncation=True, max_length=max_length)["input_ids"]
+        for ids, prompt_ids in zip(encoded, encoded_prompts):
+            token_chunks.append(np.asarray(ids, dtype=TOKEN_DTYPE))
+            lengths.append(len(ids))
+            prompt_lengths.append(min(len(prompt_ids), len(ids)))
+        texts.clear()
+        prompts.clear()
+
+    def flush_shard():
+        flush_texts()
+        if lengths:
+            shards.append(_write_shard(tmp_dir, len(shards), token_chunks, lengths, prompt_lengths))
+            token_chunks.clear()
+            lengths.clear()
+            prompt_lengths.clear()
+
+    for path in paths:
+        for item in iter_records(path):
+            texts.append(format_example(item))
+            prompts.append(format_prompt(item))
+            if len(texts) >= TOKENIZE_BATCH_SIZE:
+                flush_texts()
+            if len(lengths) + len(texts) >= records_per_shard:
+                flush_shard()
+    flush_shard()
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "max_length": max_length,
+        "tokenizer": tokenizer_signature(tokenizer),
+        "sources": [os.path.basename(p) for p in paths],
+        "num_examples": sum(s["num_examples"] for s in shards),
+        "num_tokens": sum(s["num_tokens"] for s in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    # Rename last: a half-written cache from a killed job is never picked up.
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return manifest
+
+
+def prepare_dataset(paths, tokenizer, max_length, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the shard directory for these files, building it only on a cache miss."""
+    key = cache_key(paths, tokenizer, max_length)
+    out_dir = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(out_dir, "manifest.json")):
+        print(f"Using cached tokenized dataset {out_dir}")
+        return out_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    # Concurrent training jobs on the same data: the first one builds the
+    # shards, the others wait on the lock and then reuse them.
+    with open(out_dir + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(os.path.join(out_dir, "manifest.json")):
+            print(f"Using tokenized dataset {out_dir} built by another job")
+            return out_dir
+        print(f"Tokenizing {len(paths)} file(s) into {out_dir} ...")
+        manifest = build_shards(paths, tokenizer, max_length, out_dir)
+    print(f"  {manifest['num_examples']} examples, {manifest['num_tokens']} tokens in {len(manifest['shards'])} shard(s).")
+    return out_dir
+
+
+class TokenizedShardDataset(torch.utils.data.Dataset):
+    """Reads pre-tokenized shards through np.memmap; no tokenizer calls per item."""
+
+    def __init__(self, shard_dir):
+        with open(os.path.join(shard_dir, "manifest.json"), "r") as f:
+            self.manifest = json.load(f)
+        self.shard_dir = shard_dir
+        self.offsets = [np.load(os.path.join(shard_dir, s["offsets"]), mmap_mode="r") for s in self.manifest["shards"]]
+        self.prompt_lengths = [np.load(os.path.join(shard_dir, s["prompt_lengths"]), mmap_mode="r") for s in self.manifest["shards"]]
+        self.starts = []  # global index of each shard's first example
+        total = 0
+        for s in self.manifest["shards"]:
+            self.starts.append(total)
+            total += s["num_examples"]
+        self.total = total
+        self._tokens = None  # memmaps are opened lazily so DataLoader workers each get their own
+
+    def _token_maps(self):
+        if self._tokens is None:
+            self._tokens = [np.memmap(os.path.join(self.shard_dir, s["tokens"]), dtype=TOKEN_DTYPE, mode="r")
+                            for s in self.manifest["shards"]]
+        return self._tokens
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tokens"] = None
+        return state
+
+    def __len__(self):
+        return self.total
+
+    def lengths(self):
+        """Token count of every example, without touching the token files."""
+        return np.concatenate([np.diff(o) for o in self.offsets]) if self.offsets else np.zeros(0, dtype=np.int64)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.total
+        shard = bisect.bisect_right(self.starts, idx) - 1
+        local = idx - self.starts[shard]
+        offsets = self.offsets[shard]
+        ids = torch.from_numpy(np.array(self._token_maps()[shard][offsets[local]:offsets[local + 1]], dtype=np.int64))
+        return {"input_ids": ids, "attention_mask": torch.ones_like(ids),
+                "prompt_length": int(self.prompt_lengths[shard][local])}
+
+
+def make_pad_collator(pad_token_id, mask_prompt=False):
+    """Pads a batch to its longest example (not to max_length) and builds causal-LM labels.
+
+    With mask_prompt=True the instruction tokens are left out of the loss.
+    """
+
+    def collate(batch):
+        longest = max(len(item["input_ids"]) for item in batch)
+        input_ids = torch.full((len(batch), longest), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), longest), dtype=torch.long)
+        for i, item in enumerate(batch):
+            n = len(item["input_ids"])
+            input_ids[i, :n] = item["input_ids"]
+            attention_mask[i, :n] = 1
+        labels = input_ids.masked_fill(attention_mask == 0, -100)
+        if mask_prompt:
+            for i, item in enumerate(batch):
+                labels[i, :item.get("prompt_length", 0)] = -100
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+    return collate
@@ -0,0 +1,410 @@
+"""Ingest-time deduplication of instruction/input/output training files.
+
+Every file that lands in data/ is normalized and checked against a persistent
+index of everything already there:
+- exact duplicates are found by a hash of the normalized record;
+- near-duplicates by MinHash over word 3-grams, with LSH banding to find
+  candidates, each confirmed by its estimated Jaccard similarity.
+
+The index is a SQLite file, so memory stays at one batch of records no matter
+how big the corpus is. Each upload is checked against it incrementally; files
+already indexed are never read again.
+
+    python dedup.py data/                    # index/clean every file in data/
+    python dedup.py data/ --tokenizer deepseek-ai/deepseek-llm-7b-base
+"""
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from records import find_data_files, format_example, iter_records
+
+DEFAULT_INDEX_PATH = os.path.join("data", ".cache", "dedup_index.sqlite")
+NUM_PERM = 128
+BANDS = 16                  # 16 bands x 8 rows: pairs above ~0.8 Jaccard share a band with ~95% probability
+ROWS = NUM_PERM // BANDS
+NEAR_DUP_THRESHOLD = 0.8    # estimated Jaccard similarity at which a record counts as a near-duplicate
+SHINGLE_WORDS = 3
+BATCH_RECORDS = 2000        # records hashed and checked together; with PERM_GROUP this bounds memory
+PERM_GROUP = 16             # permutations evaluated at once (a PERM_GROUP x shingles uint64 array)
+SQL_CHUNK = 900             # SQLite caps the number of "?" parameters per statement
+
+_rng = np.random.default_rng(0x5EED)  # fixed: signatures are persisted, so the permutations can never change
+PERM_A = _rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+PERM_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+BAND_MIX = _rng.integers(1, 2**63, (BANDS, ROWS), dtype=np.uint64) | np.uint64(1)
+EMPTY = np.iinfo(np.uint32).max     # signature value of a key with no words
+POLY = 0x100000001B3                  # odd, so it has an inverse mod 2**64
+POLY_INV = pow(POLY, -1, 2**64)
+
+
+def normalize_text(text):
+    """NFKC, unix newlines, no trailing spaces on lines, no leading/trailing blank space."""
+    text = unicodedata.normalize("NFKC", str(text)).replace("\r\n", "\n").replace("\r", "\n")
+    if "\n" not in text:  # most fields are one line; same result without the split
+        return text.strip()
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+
+def normalize_record(item):
+    """The record with its instruction/input/output normalized; None if it isn't a training record."""
+    if not isinstance(item, dict) or not isinstance(item.get("instruction"), str) or \
+            not isinstance(item.get("output"), str):
+        return None
+    record = dict(item)
+    for field in ("instruction", "input", "output"):
+        if field in record:
+            record[field] = normalize_text(record[field])
+    return record
+
+
+def dedup_key(record):
+    """What two records must share to be duplicates: case- and whitespace-insensitive fields."""
+    return "\x1f".join(" ".join(record.get(f, "").casefold().split()) for f in ("instruction", "input", "output"))
+
+
+def exact_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little", signed=True)
+
+
+def approx_tokens(text):
+    """About four characters per token; used when no tokenizer is given."""
+    return max(1, len(text) // 4)
+
+
+def _pow_table(base, n):
+    powers = np.full(n, base, dtype=np.uint64)
+    powers[0] = 1
+    return np.cumprod(powers, dtype=np.uint64)  # wraps mod 2**64, which is what the hash wants
+
+
+def shingle_hashes(keys):
+    """64-bit hashes of every word 3-gram of each key, computed for the whole batch at once.
+
+    Returns (hashes, owner) where owner[i] is the key hashes[i] came from. Keys with
+    fewer than three words get one shingle for the whole key; empty keys get none.
+    The hash of bytes[s:e] is (H[e] - H[s]) * POLY^-s with H the prefix polynomial
+    hash, so every shingle costs a few vector operations, not a Python call.
+    """
+    encoded = [k.replace("\x1f", " ").encode() for k in keys]
+    starts = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) + 1 for e in encoded], out=starts[1:])
+    buf = np.frombuffer(b"".join(e + b" " for e in encoded), dtype=np.uint8)
+    with np.errstate(over="ignore"):
+        prefix = np.zeros(len(buf) + 1, dtype=np.uint64)
+        np.cumsum(buf.astype(np.uint64) * _pow_table(POLY, len(buf)), out=prefix[1:])
+        is_word = buf != 32
+        word_start = np.flatnonzero(is_word & ~np.concatenate(([False], is_word[:-1])))
+        word_end = np.flatnonzero(is_word & ~np.concatenate((is_word[1:], [False]))) + 1
+        word_owner = np.searchsorted(starts, word_start, side="right") - 1
+        counts = np.bincount(word_owner, minlength=len(keys))
+        last_word = np.cumsum(counts) - 1                  # global index of each key's last word
+        first_word = last_word - counts + 1
+        owner_last = last_word[word_owner]
+        # A shingle starts at every word with two more words after it in the same key,
+        # and at the first word of keys that are too short for that.
+        full = np.arange(len(word_start)) + SHINGLE_WORDS - 1 <= owner_last
+        short = (counts[word_owner] < SHINGLE_WORDS) & (np.arange(len(word_start)) == first_word[word_owner])
+        first = np.flatnonzero(full | short)
+        last = np.minimum(first + SHINGLE_WORDS - 1, owner_last[first])
+        s, e = word_start[first], word_end[last]
+        hashes = (prefix[e] - prefix[s]) * _pow_table(POLY_INV, len(buf) + 1)[s]
+    return hashes, word_owner[first]
+
+
+def minhash(keys):
+    """(len(keys), NUM_PERM) uint32 MinHash signatures for a batch of keys (all 0xFFFFFFFF for an empty key)."""
+    signatures = np.full((len(keys), NUM_PERM), EMPTY, dtype=np.uint32)
+    if not keys:
+        return signatures
+    hashes, owner = shingle_hashes(keys)
+    if not len(hashes):
+        return signatures
+    present = np.flatnonzero(np.bincount(owner, minlength=len(keys)))
+    boundaries = np.searchsorted(owner, present)     # shingles are grouped by owner, in order
+    # Multiply-shift hashing, (a*x + b) >> 32 per (a, b) pair, a group of permutations at a time.
+    for p in range(0, NUM_PERM, PERM_GROUP):
+        with np.errstate(over="ignore"):
+            permuted = (PERM_A[p:p + PERM_GROUP, None] * hashes[None, :] + PERM_B[p:p + PERM_GROUP, None]) >> np.uint64(32)
+        signatures[present, p:p + PERM_GROUP] = np.minimum.reduceat(permuted, boundaries, axis=1).T
+    return signatures
+
+
+def band_keys(signatures):
+    """(n, BANDS) int64 LSH bucket keys: each band's ROWS values mixed into one number."""
+    with np.errstate(over="ignore"):
+        bands = signatures.astype(np.uint64).reshape(len(signatures), BANDS, ROWS)
+        keys = (bands * BAND_MIX[None]).sum(axis=2, dtype=np.uint64) + np.arange(BANDS, dtype=np.uint64)
+    return keys.view(np.int64)
+
+
+def compact_signature(signature):
+    """Low 16 bits of each value (b-bit MinHash): a quarter of the storage, estimates barely move."""
+    return (signature & 0xFFFF).astype(np.uint16)
+
+
+def _chunks(items, size=SQL_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class DedupIndex:
+    """Persistent exact-hash + MinHash/LSH index over every record in data/.
+
+    Tables:
+    - sources: one row per indexed file (name, size, mtime), so unchanged files are skipped,
+      including ones that failed to ingest (their row keeps the error);
+    - records: exact hash, 16-bit signature and token count of every kept record;
+    - lsh: (band key, record id) buckets used to find near-duplicate candidates.
+    Safe to share between threads; other processes are kept out by a file lock.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, threshold=NEAR_DUP_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,
+                                                records INTEGER, tokens INTEGER);
+            CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY, source TEXT, exact INTEGER,
+                                                signature BLOB, tokens INTEGER);
+            CREATE INDEX IF NOT EXISTS records_exact ON records (exact);
+            CREATE INDEX IF NOT EXISTS records_source ON records (source);
+            CREATE TABLE IF NOT EXISTS lsh (key INTEGER, id INTEGER, PRIMARY KEY (key, id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS lsh_id ON lsh (id);
+        """)
+        if "error" not in [row[1] for row in self.db.execute("PRAGMA table_info(sources)")]:
+            self.db.execute("ALTER TABLE sources ADD COLUMN error TEXT")  # indexes built before the column existed
+        self._thread_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._thread_lock, open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def close(self):
+        self.db.close()
+
+    def stats(self):
+        records, tokens = self.db.execute("SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM records").fetchone()
+        sources = self.db.execute("SELECT COUNT(*) FROM sources WHERE error IS NULL").fetchone()[0]
+        return {"sources": sources, "records": records, "tokens": tokens}
+
+    def remove_source(self, name):
+        """Forgets a file's records, e.g. before it is replaced by a new upload under the same name."""
+        with self._locked():
+            self._remove_source(name)
+
+    def _remove_source(self, name):
+        # Record ids are reused (MAX(id) + 1), so the buckets go with the records.
+        with self.db:
+            self.db.execute("DELETE FROM lsh WHERE id IN (SELECT id FROM records WHERE source = ?)", (name,))
+            self.db.execute("DELETE FROM records WHERE source = ?", (name,))
+            self.db.execute("DELETE FROM sources WHERE name = ?", (name,))
+
+    def _existing_exact(self, hashes):
+        found = set()
+        for chunk in _chunks(set(hashes)):
+            found.update(h for (h,) in self.db.execute(
+                f"SELECT exact FROM records WHERE exact IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def _candidates(self, keys):
+        """{band key: [record ids]} for the keys that hit a bucket, and {id: signature} for those ids."""
+        buckets = {}
+        for chunk in _chunks(set(keys.ravel().tolist())):
+            for key, record_id in self.db.execute(
+                    f"SELECT key, id FROM lsh WHERE key IN ({','.join('?' * len(chunk))})", chunk):
+                buckets.setdefault(key, []).append(record_id)
+        signatures = {}
+        for chunk in _chunks({i for ids in buckets.values() for i in ids}):
+            for record_id, blob in self.db.execute(
+                    f"SELECT id, signature FROM records WHERE id IN ({','.join('?' * len(chunk))})", chunk):
+                signatures[record_id] = np.frombuffer(blob, dtype=np.uint16)
+        return buckets, signatures
+
+    def _check_batch(self, name, records, count_tokens, report):
+        """Drops the batch's duplicates, indexes the rest and returns them."""
+        keys = [dedup_key(r) for r in records]
+        hashes = [exact_hash(k) for k in keys]
+        tokens = [count_tokens(format_example(r)) for r in records]
+        known = self._existing_exact(hashes)
+        unique = []
+        for i, h in enumerate(hashes):
+            if h in known:
+                report["exact_duplicates"] += 1
+                report["tokens_saved"] += tokens[i]
+            else:
+                known.add(h)
+                unique.append(i)
+
+        signatures = minhash([keys[i] for i in unique])
+        lsh_keys = band_keys(signatures)
+        compact = compact_signature(signatures)
+        empty = signatures[:, 0] == EMPTY
+        buckets, stored = self._candidates(lsh_keys[~empty])
+        # Only records with a band key that hits the index, or another record of the
+        # batch, need a closer look; for most records none does.
+        keys_seen, counts = np.unique(lsh_keys[~empty], return_counts=True)
+        shared = np.concatenate((keys_seen[counts > 1], np.fromiter(buckets, dtype=np.int64, count=len(buckets))))
+        suspect = ~empty & np.isin(lsh_keys, shared).any(axis=1)
+        batch_buckets = {}  # band key -> positions in `unique` of suspects kept so far
+        kept = []
+        for j, i in enumerate(unique):
+            if suspect[j]:
+                row = lsh_keys[j].tolist()
+                others = [stored[r] for key in row for r in buckets.get(key, ()) if r in stored]
+                others += [compact[k] for key in row for k in batch_buckets.get(key, ())]
+                if others and (np.stack(others) == compact[j]).mean(axis=1).max() >= self.threshold:
+                    report["near_duplicates"] += 1
+                    report["tokens_saved"] += tokens[i]
+                    continue
+                for key in row:
+                    batch_buckets.setdefault(key, []).append(j)
+            kept.append(j)
+
+        first_id = self.db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM records").fetchone()[0]
+        ids = range(first_id, first_id + len(kept))
+        with self.db:
+            self.db.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?)",
+                                [(record_id, name, hashes[unique[j]], compact[j].tobytes(), tokens[unique[j]])
+                                 for record_id, j in zip(ids, kept)])
+            self.db.executemany("INSERT OR IGNORE INTO lsh VALUES (?, ?)", sorted(
+                (key, record_id) for record_id, j in zip(ids, kept) if not empty[j] for key in lsh_keys[j].tolist()))
+        report["records_out"] += len(kept)
+        report["tokens_out"] += sum(tokens[unique[j]] for j in kept)
+        return [records[unique[j]] for j in kept]
+
+    def ingest(self, path, count_tokens=None):
+        with self._locked():
+            return self._ingest(path, count_tokens)
+
+    def _ingest(self, path, count_tokens=None):
+        """Normalizes the file at path in place and removes records already in the index (or earlier in the file).
+
+        Both .jsonl files and .json lists are streamed (records.iter_records). The
+        rewritten file replaces the original atomically. A file that isn't valid
+        JSON, or has no valid record at all, raises ValueError and is left as it
+        was. Returns a report with the counts and the tokens no longer trained on
+        every epoch.
+        """
+        name = os.path.basename(path)
+        report = {"file": name, "records_in": 0, "records_out": 0, "invalid": 0, "exact_duplicates": 0,
+                  "near_duplicates": 0, "tokens_in": 0, "tokens_out": 0, "tokens_saved": 0}
+        start = time.perf_counter()
+        tmp_path = path + ".dedup.tmp"
+        self._remove_source(name)  # a re-upload replaces the file, so its old records don't count against it
+        try:
+            self._rewrite(path, tmp_path, count_tokens or approx_tokens, report)
+            if report["records_in"] and report["invalid"] == report["records_in"]:
+                raise ValueError(f"No instruction/output records in {name}")
+        except BaseException:
+            self._remove_source(name)  # batches indexed before the error
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        report["tokens_in"] = report["tokens_out"] + report["tokens_saved"]
+        st = os.stat(path)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, NULL)",
+                            (name, st.st_size, st.st_mtime_ns, report["records_out"], report["tokens_out"]))
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        return report
+
+    def _rewrite(self, path, out_path, count_tokens, report):
+        name = os.path.basename(path)
+        jsonl = path.endswith(".jsonl")
+        with open(out_path, "w") as out:
+            out.write("" if jsonl else "[")
+            written = 0
+            batch = []
+
+            def flush():
+                nonlocal written
+                for record in self._check_batch(name, batch, count_tokens, report):
+                    text = json.dumps(record, ensure_ascii=False)
+                    out.write(text + "\n" if jsonl else ("," if written else "") + "\n  " + text)
+                    written += 1
+                batch.clear()
+
+            for item in iter_records(path):
+                report["records_in"] += 1
+                record = normalize_record(item)
+                if record is None:
+                    report["invalid"] += 1
+                    continue
+                batch.append(record)
+                if len(batch) >= BATCH_RECORDS:
+                    flush()
+            flush()
+            out.write("" if jsonl else "\n]\n")
+
+    def sync(self, data_dir, count_tokens=None):
+        """Brings the index in line with data_dir: ingests new or changed files, forgets deleted ones.
+
+        Files are ingested oldest first, so when two files overlap the older one
+        keeps the records. Returns a report per file ingested (with an "error" for
+        files that aren't valid JSON); unchanged files cost one stat(). A file that
+        failed is remembered with its error and not read again until it changes.
+        """
+        with self._locked():
+            present = {os.path.basename(p): p for p in find_data_files(data_dir)}
+            known = {name: (size, mtime) for name, size, mtime in
+                     self.db.execute("SELECT name, size, mtime_ns FROM sources")}
+            for name in set(known) - set(present):
+                self._remove_source(name)
+            changed = []
+            for name, path in present.items():
+                st = os.stat(path)
+                if known.get(name) != (st.st_size, st.st_mtime_ns):
+                    changed.append((st.st_mtime_ns, name, path))
+            reports = []
+            for _, name, path in sorted(changed):
+                try:
+                    reports.append(self._ingest(path, count_tokens))
+                except ValueError as e:  # not JSON, or no valid records: left as uploaded
+                    reports.append({"file": name, "error": str(e)})
+                    st = os.stat(path)
+                    with self.db:
+                        self.db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, 0, 0, ?)",
+                                        (name, st.st_size, st.st_mtime_ns, str(e)))
+            return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate the training files in a data directory.")
+    parser.add_argument("data_dir", nargs="?", default="data")
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH)
+    parser.add_argument("--threshold", type=float, default=NEAR_DUP_THRESHOLD)
+    parser.add_argument("--tokenizer", help="count saved tokens with this tokenizer instead of estimating them")
+    args = parser.parse_args()
+
+    count_tokens = None
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+        count_tokens = lambda text: len(tokenizer(text)["input_ids"])
+    index = DedupIndex(args.index, args.threshold)
+    for report in index.sync(args.data_dir, count_tokens):
+        print(json.dumps(report))
+    print(json.dumps(index.stats()))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""Delta deploy of this project to a GPU box (or any directory) over one SSH connection.
+
+Every deployable file is hashed (sha256) into a manifest. The target keeps the
+manifest of what it last received in <remote-dir>/.deploy/manifest.json. Each
+deploy compares the two and sends only blobs whose content the target doesn't
+already have. Changed blobs go out as a few parallel tar streams, all over one
+multiplexed SSH connection (ControlMaster). The target then checks every blob's
+hash, moves it into place, removes files this tool deployed earlier that are
+gone locally, and writes the new manifest last. Files created on the box
+(checkpoints, adapters, logs) are never touched.
+
+Dependencies come from a local wheelhouse/ that is synced like any other file,
+so the box installs them offline with one pip call. The install is skipped when
+nothing in the wheelhouse changed.
+
+Training runs on the box record their tokens/sec in its gpu_throughput.json,
+which is never deployed. Each deploy moves that file off the box and merges it
+into the local one, which the launcher ranks offers with (see gpu_throughput.py).
+So each run is counted once. Run with --pull-throughput after a job, before the
+instance is destroyed, to do only that.
+
+    python deploy.py --host root@82.141.118.2 --port 7601 --key my_key
+    python deploy.py --host root@82.141.118.2 --port 7601 --key my_key --pull-throughput
+    python deploy.py --local /tmp/akasha-target --no-install    # same pipeline, through sh instead of ssh
+"""
+import argparse
+import concurrent.futures
+import fnmatch
+import hashlib
+import inspect
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+from gpu_throughput import merge_throughput
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+REMOTE_DIR = os.environ.get("AKASHA_REMOTE_DIR", "/workspace/akasha-llm-project")
+WHEELHOUSE_DIR = "wheelhouse"
+REQUIREMENTS_FILE = "reqirements.txt"
+# Training needs these on top of the API's requirements; torch comes with the pytorch/pytorch image.
+TRAIN_REQUIREMENTS = ["peft", "accelerate", "transformers", "datasets", "safetensors"]
+# Wheels the image already provides; pruned from the wheelhouse (they are gigabytes and pip
+# is satisfied by the installed copies).
+IMAGE_PROVIDED = ["torch-*", "triton-*", "nvidia_*", "nvidia-*"]
+WHEEL_PLATFORM = os.environ.get("AKASHA_WHEEL_PLATFORM", "manylinux_2_28_x86_64")
+WHEEL_PYTHON_VERSION = os.environ.get("AKASHA_WHEEL_PYTHON_VERSION", "3.11")
+HASH_CACHE_FILE = os.path.join("data", ".cache", "deploy_hashes.json")
+THROUGHPUT_NAME = "gpu_throughput.json"  # written on the box by training runs; pulled back, never sent
+
+# Matched against every path component; anything matching isn't deployed.
+DEPLOY_IGNORE = [
+    ".git", ".deploy", "__pycache__", "*.pyc", ".venv", "venv", ".pythonlibs", ".cache", ".uploads", ".jobs",
+    "my_key", "my_key.pub", "gpu_backup", "adapters", "lora_adapter", THROUGHPUT_NAME, THROUGHPUT_NAME + ".pulled", "*.deploy-tmp",
+]
+
+
+def is_ignored(rel_path, ignore=DEPLOY_IGNORE):
+    return any(fnmatch.fnmatch(part, pattern) for part in rel_path.split("/") for pattern in ignore)
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_manifest(root=REPO_ROOT, ignore=DEPLOY_IGNORE, cache_file=HASH_CACHE_FILE):
+    """{relative path: {"sha256", "size", "mode"}} for every deployable file under root.
+
+    Hashes are cached by (size, mtime) in cache_file, so only files that changed
+    since the last deploy are read again.
+    """
+    cache_path = os.path.join(root, cache_file) if cache_file else None
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+    manifest, new_cache = {}, {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        rel_dir = "" if rel_dir == "." else rel_dir + "/"
+        dirnames[:] = sorted(d for d in dirnames if not is_ignored(rel_dir + d, ignore))
+        for name in sorted(filenames):
+            rel = rel_dir + name
+            path = os.path.join(dirpath, name)
+            if is_ignored(rel, ignore) or os.path.islink(path):
+                continue
+            st = os.stat(path)
+            cached = cache.get(rel)
+            if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                sha = cached[2]
+            else:
+                sha = file_sha256(path)
+            new_cache[rel] = [st.st_size, st.st_mtime_ns, sha]
+            manifest[rel] = {"sha256": sha, "size": st.st_size, "mode": 0o755 if st.st_mode & 0o111 else 0o644}
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path + ".tmp", "w") as f:
+            json.dump(new_cache, f)
+        os.replace(cache_path + ".tmp", cache_path)
+    return manifest
+
+
+def plan_deploy(local, remote):
+    """What the target needs to match `local`, given the manifest it reported.
+
+    Returns (plan, send): plan is what apply_plan() receives on the target and
+    send maps each blob hash the target lacks to one local path holding it.
+    Content the target already has under another path is copied there instead
+    of being sent again.
+    """
+    remote_by_hash = {e["sha256"]: p for p, e in remote.items()}
+    place = {p: e for p, e in local.items()
+             if remote.get(p, {}).get("sha256") != e["sha256"] or remote[p].get("mode") != e["mode"]}
+    send, reuse = {}, {}
+    for path, entry in place.items():
+        sha = entry["sha256"]
+        if sha in remote_by_hash:
+            reuse[sha] = remote_by_hash[sha]
+        else:
+            send.setdefault(sha, path)
+    plan = {"place": place, "reuse": reuse, "delete": sorted(p for p in remote if p not in local), "manifest": local}
+    return plan, send
+
+
+def apply_plan(root, plan):
+    """Runs ON THE TARGET (its source is sent over ssh), so: stdlib only, no other helpers from this file.
+
+    Expects every blob the plan places to be in <root>/.deploy/incoming/<sha256>
+    or, for "reuse", at an existing path under root. Verifies every blob, moves
+    files into place atomically, deletes removed files and writes the manifest
+    last, so an interrupted deploy is simply redone on the next run.
+    """
+    import hashlib
+    import json
+    import os
+    import shutil
+
+    incoming = os.path.join(root, ".deploy", "incoming")
+    os.makedirs(incoming, exist_ok=True)
+    for sha, path in plan["reuse"].items():
+        shutil.copyfile(os.path.join(root, path), os.path.join(incoming, sha))
+    uses = {}
+    for entry in plan["place"].values():
+        uses[entry["sha256"]] = uses.get(entry["sha256"], 0) + 1
+    for sha in uses:
+        h = hashlib.sha256()
+        with open(os.path.join(incoming, sha), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        if h.hexdigest() != sha:
+            raise SystemExit(f"deploy: blob {sha} is corrupt on the target (files changed there by hand? "
+                             f"redeploy with --full)")
+    for path, entry in sorted(plan["place"].items()):
+        dst = os.path.join(root, path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        blob = os.path.join(incoming, entry["sha256"])
+        uses[entry["sha256"]] -= 1
+        if uses[entry["sha256"]]:
+            shutil.copyfile(blob, dst + ".deploy-tmp")
+        else:
+            os.replace(blob, dst + ".deploy-tmp")
+        os.chmod(dst + ".deploy-tmp", entry["mode"])
+        os.replace(dst + ".deploy-tmp", dst)
+    for path in plan["delete"]:
+        dst = os.path.join(root, path)
+        if os.path.exists(dst):
+            os.remove(dst)
+            try:
+                os.removedirs(os.path.dirname(dst))  # prunes now-empty parents; root keeps .deploy
+            except OSError:
+                pass
+    manifest_path = os.path.join(root, ".deploy", "manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(plan["manifest"], f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest_path + ".tmp", manifest_path)
+    shutil.rmtree(incoming, ignore_errors=True)
+    print(f"deploy: placed {len(plan['place'])} file(s), deleted {len(plan['delete'])} on the target")
+
+
+def _remote_apply_command(root):
+    source = "import json, sys\n" + inspect.getsource(apply_plan) + "\napply_plan(sys.argv[1], json.load(sys.stdin))\n"
+    return f"python3 -c {shlex.quote(source)} {shlex.quote(root)}"
+
+
+class Target:
+    """Where a deploy goes: commands run through ssh (one multiplexed connection) or, for a local directory, sh."""
+
+    def __init__(self, root, host=None, port=22, key=None, compress=False):
+        self.root = root
+        self.host = host
+        self.ssh = None
+        if host:
+            self.control_path = os.path.join(tempfile.gettempdir(), "akasha-ssh-%C")
+            self.ssh = ["ssh", "-p", str(port), "-o", "ControlMaster=auto", "-o", f"ControlPath={self.control_path}",
+                        "-o", "ControlPersist=120", "-o", "StrictHostKeyChecking=accept-new", "-o", "BatchMode=yes"]
+            if key:
+                self.ssh += ["-i", key]
+            if compress:
+                self.ssh += ["-o", "Compression=yes"]
+
+    def command(self, shell_command):
+        if self.ssh:
+            return self.ssh + [self.host, shell_command]
+        return ["sh", "-c", shell_command]
+
+    def run(self, shell_command, input=None, check=True):
+        result = subprocess.run(self.command(shell_command), input=input, capture_output=True, text=True)
+        if check and result.returncode != 0:
+            raise RuntimeError(f"deploy: `{shell_command.split()[0]} ...` failed ({result.returncode}): {result.stderr.strip()}")
+        return result
+
+    def read_manifest(self):
+        """The target's manifest, {} on a fresh target. Over ssh this call also opens the shared connection."""
+        path = shlex.quote(f"{self.root}/.deploy/manifest.json")
+        out = self.run(f"cat {path} 2>/dev/null || true").stdout
+        return json.loads(out) if out.strip() else {}
+
+    def take_throughput(self):
+        """Moves the box's throughput table aside and returns it ({} if no run recorded one since the last pull)."""
+        path = shlex.quote(f"{self.root}/{THROUGHPUT_NAME}")
+        pulled = shlex.quote(f"{self.root}/{THROUGHPUT_NAME}.pulled")
+        out = self.run(f"if [ -e {path} ]; then mv {path} {pulled}; fi; cat {pulled} 2>/dev/null || true").stdout
+        return json.loads(out) if out.strip() else {}
+
+    def drop_pulled_throughput(self):
+        self.run(f"rm -f {shlex.quote(f'{self.root}/{THROUGHPUT_NAME}.pulled')}")
+
+    def send_blobs(self, send, local_root, streams=4):
+        """Streams the blobs as `streams` parallel tar archives into .deploy/incoming; returns bytes sent."""
+        incoming = shlex.quote(f"{self.root}/.deploy/incoming")
+        sizes = {sha: os.path.getsize(os.path.join(local_root, path)) for sha, path in send.items()}
+        groups = [[] for _ in range(max(1, min(streams, len(send))))]
+        loads = [0] * len(groups)
+        for sha in sorted(send, key=sizes.get, reverse=True):  # biggest first onto the lightest stream
+            i = loads.index(min(loads))
+            groups[i].append(sha)
+            loads[i] += sizes[sha]
+
+        def stream(group):
+            process = subprocess.Popen(self.command(f"mkdir -p {incoming} && tar -xf - -C {incoming}"),
+                                       stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                with tarfile.open(fileobj=process.stdin, mode="w|") as tar:
+                    for sha in group:
+                        tar.add(os.path.join(local_root, send[sha]), arcname=sha, recursive=False)
+            finally:
+                process.stdin.close()
+            stderr = process.stderr.read().decode(errors="replace")
+            if process.wait() != 0:
+                raise RuntimeError(f"deploy: blob stream failed ({process.returncode}): {stderr.strip()}")
+
+        with concurrent.futures.ThreadPoolExecutor(len(groups)) as pool:
+            list(pool.map(stream, [g for g in groups if g]))
+        return sum(sizes.values())
+
+    def apply(self, plan):
+        return self.run(_remote_apply_command(self.root), input=json.dumps(plan)).stdout.strip()
+
+    def install(self):
+        """Offline install from the synced wheelhouse: one pip call, no index."""
+        root = shlex.quote(self.root)
+        return self.run(f"cd {root} && python3 -m pip install --no-index --find-links {WHEELHOUSE_DIR} "
+                        f"-r {WHEELHOUSE_DIR}/requirements.txt").stdout
+
+    def close(self):
+        if self.ssh:
+            subprocess.run(self.ssh + ["-O", "exit", self.host], capture_output=True)
+
+
+def build_wheelhouse(root=REPO_ROOT, requirements_file=REQUIREMENTS_FILE, extra=TRAIN_REQUIREMENTS,
+                     platform=WHEEL_PLATFORM, python_version=WHEEL_PYTHON_VERSION):
+    """Downloads wheels for the target's platform into wheelhouse/ unless it already matches the requirements.
+
+    wheelhouse/requirements.txt records what the wheels were resolved for and is
+    what the target installs from. Returns True if wheels were (re)downloaded.
+    """
+    wheelhouse = os.path.join(root, WHEELHOUSE_DIR)
+    with open(os.path.join(root, requirements_file), "r") as f:
+        requirements = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    wanted = "\n".join(requirements + [r for r in extra if r not in requirements]) + "\n"
+    req_path = os.path.join(wheelhouse, "requirements.txt")
+    if os.path.exists(req_path):
+        with open(req_path, "r") as f:
+            if f.read() == wanted:
+                return False
+    os.makedirs(wheelhouse, exist_ok=True)
+    with open(req_path + ".tmp", "w") as f:
+        f.write(wanted)
+    print(f"Building wheelhouse for {platform} / Python {python_version}...", flush=True)
+    subprocess.run([sys.executable, "-m", "pip", "download", "--dest", wheelhouse, "--only-binary=:all:",
+                    "--platform", platform, "--python-version", python_version, "-r", req_path + ".tmp"], check=True)
+    for name in os.listdir(wheelhouse):
+        if any(fnmatch.fnmatch(name.lower(), p) for p in IMAGE_PROVIDED):
+            os.remove(os.path.join(wheelhouse, name))
+    os.replace(req_path + ".tmp", req_path)
+    return True
+
+
+def pull_throughput(target, local_root=REPO_ROOT):
+    """Merges the runs the box recorded into local_root's gpu_throughput.json; returns how many there were."""
+    table = target.take_throughput()
+    if table:
+        merge_throughput(table, os.path.join(local_root, THROUGHPUT_NAME))
+    target.drop_pulled_throughput()  # only once the runs are safely merged here
+    return sum(e["runs"] for e in table.values())
+
+
+def deploy(target, local_root=REPO_ROOT, streams=4, full=False, install=True, dry_run=False):
+    """Brings target up to date with local_root; returns a dict of counts, bytes and per-phase seconds."""
+    timings = {}
+    t = time.perf_counter()
+    local = build_manifest(local_root)
+    timings["manifest"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    remote = {} if full else target.read_manifest()
+    plan, send = plan_deploy(local, remote)
+    timings["compare"] = time.perf_counter() - t
+    report = {"files": len(local), "bytes_total": sum(e["size"] for e in local.values()),
+              "changed": len(plan["place"]), "deleted": len(plan["delete"]), "blobs_sent": len(send),
+              "bytes_sent": sum(local[path]["size"] for path in send.values())}
+    if dry_run:
+        return {**report, "seconds": timings}
+    report["throughput_runs_pulled"] = pull_throughput(target, local_root)
+
+    if plan["place"] or plan["delete"] or not remote:
+        t = time.perf_counter()
+        if send:
+            target.send_blobs(send, local_root, streams)
+        timings["transfer"] = time.perf_counter() - t
+        t = time.perf_counter()
+        target.apply(plan)
+        timings["apply"] = time.perf_counter() - t
+
+    wheels_changed = any(p.startswith(WHEELHOUSE_DIR + "/") for p in plan["place"])
+    if install and wheels_changed:
+        t = time.perf_counter()
+        target.install()
+        timings["install"] = time.perf_counter() - t
+    report["installed"] = install and wheels_changed
+    return {**report, "seconds": timings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync this project to a GPU box, sending only what changed.")
+    parser.add_argument("--host", help="ssh destination, e.g. root@82.141.118.2")
+    parser.add_argument("--port", type=int, default=22)
+    parser.add_argument("--key", help="ssh private key file")
+    parser.add_argument("--remote-dir", default=REMOTE_DIR)
+    parser.add_argument("--local", metavar="DIR", help="deploy into a local directory instead of over ssh")
+    parser.add_argument("--streams", type=int, default=4, help="parallel blob streams over the one connection")
+    parser.add_argument("--full", action="store_true", help="ignore the target's manifest and resend everything")
+    parser.add_argument("--no-install", action="store_true", help="don't pip install from the wheelhouse")
+    parser.add_argument("--no-wheelhouse", action="store_true", help="don't build/refresh wheelhouse/ first")
+    parser.add_argument("--compress", action="store_true", help="ssh compression (helps on slow links with text data)")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be sent")
+    parser.add_argument("--pull-throughput", action="store_true",
+                        help="only bring back the box's recorded GPU throughput (run after a job)")
+    args = parser.parse_args()
+    if not args.host and not args.local:
+        parser.error("give --host (ssh) or --local DIR")
+
+    start = time.perf_counter()
+    target = Target(os.path.abspath(args.local), compress=args.compress) if args.local else \
+        Target(args.remote_dir, host=args.host, port=args.port, key=args.key, compress=args.compress)
+    if args.pull_throughput:
+        try:
+            runs = pull_throughput(target)
+        finally:
+            target.close()
+        print(f"Merged {runs} run(s) of GPU throughput into {THROUGHPUT_NAME}")
+        return
+    if not args.no_wheelhouse and not args.no_install:
+        build_wheelhouse()
+    try:
+        report = deploy(target, streams=args.streams, full=args.full, install=not args.no_install,
+                        dry_run=args.dry_run)
+    finally:
+        target.close()
+    phases = ", ".join(f"{k} {v:.2f}s" for k, v in report["seconds"].items())
+    print(f"{'Would send' if args.dry_run else 'Sent'} {report['blobs_sent']} blob(s), "
+          f"{report['bytes_sent'] / 1e6:.1f} MB of {report['bytes_total'] / 1e6:.1f} MB "
+          f"({report['changed']} changed, {report['deleted']} deleted of {report['files']} files"
+          f"{', dependencies installed' if report.get('installed') else ''}"
+          f"{f', {runs} throughput run(s) pulled' if (runs := report.get('throughput_runs_pulled')) else ''}) in {time.perf_counter() - start:.2f}s: {phases}")
+
+
+if __name__ == "__main__":
+    main()
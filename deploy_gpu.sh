@@ -9,16 +9,10 @@ VAST_PORT="7601"
 GPU_HOST="root@82.141.118.2"
 GPU_PORT="7601"
 SSH_KEY="my_key"               # Your private SSH key file
-REMOTE_DIR="/workspace"        # Where to send the backup on the GPU
+REMOTE_DIR="/workspace"        # Where to send the project on the GPU
 
-echo "📤 Syncing files to Vast.ai GPU instance..."
-scp -P $VAST_PORT -i $SSH_KEY -r gpu_backup/akasha-llm root@$VAST_IP:$REMOTE_DIR
-
-echo "🔧 Installing dependencies on GPU..."
-ssh -i $SSH_KEY -p $VAST_PORT root@$VAST_IP << 'EOF'
-  cd /workspace/akasha-llm/DeepSeek-LLM
-  pip install -r requirements.txt
-  pip3 install -r requirements.txt
-  pip3 install peft accelerate transformers datasets
-  echo "✅ GPU is ready. DeepSeek + your training files are installed."
-EOF
\ No newline at end of file
+echo "📤 Syncing changed files to Vast.ai GPU instance..."
+# Sends only what changed since the last deploy (see deploy.py), then installs the
+# dependencies offline from wheelhouse/ if they changed.
+python3 deploy.py --host root@$VAST_IP --port $VAST_PORT --key $SSH_KEY --remote-dir $REMOTE_DIR/akasha-llm-project || exit 1
+echo "✅ GPU is ready. Project, data and dependencies are in $REMOTE_DIR/akasha-llm-project."
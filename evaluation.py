@@ -0,0 +1,342 @@
+"""Held-out evaluation of a LoRA run while it trains: perplexity and exact match per checkpoint.
+
+    python evaluation.py --base-model deepseek-ai/DeepSeek-V3-Base --output-dir ./lora_adapter \
+        --eval-file data/heldout.jsonl
+
+train_lora.py starts this as a separate, low-priority process when eval_files is
+set (eval_mode="process"). The process loads its own copy of the base model,
+waits for each new checkpoint and scores the adapter in it. eval_mode="inline"
+instead scores the live training model right after a checkpoint save. Use it when
+a second copy of the model doesn't fit. Both modes stay under eval_duty_cycle, the
+share of wall time spent evaluating, by skipping or delaying evaluations.
+
+Only the response tokens are scored, with the held-out set tokenized once into
+the same cached shards as training data. Each checkpoint's result is one line of
+eval.jsonl, which /metrics exports. The EarlyStoppingCallback in the training
+process also reads it and stops a run whose eval loss has stopped improving.
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import torch
+from transformers import TrainerCallback
+
+from checkpointing import ADAPTER_WEIGHTS, CHECKPOINT_RE, list_checkpoints
+from dataset_shards import TokenizedShardDataset, make_pad_collator, prepare_dataset
+from metrics import read_last_record
+from packing import TokenBudgetBatchSampler
+
+EVAL_RESULTS_NAME = "eval.jsonl"
+EVAL_SCRIPT = os.path.abspath(__file__)
+# Logits are only computed for scored positions, this many bytes of them at a time:
+# a full (batch, length, vocab) tensor is several GB with DeepSeek's ~129k vocabulary.
+LOGITS_CHUNK_BYTES = 256 * 1024 * 1024
+
+
+def load_eval_dataset(eval_files, tokenizer, max_length, cache_dir):
+    """The held-out files as tokenized shards, cached like the training data."""
+    return TokenizedShardDataset(prepare_dataset(eval_files, tokenizer, max_length, cache_dir=cache_dir))
+
+
+@torch.inference_mode()
+def evaluate(model, dataset, max_batch_tokens, pad_token_id):
+    """Scores model on every response token of dataset (what comes after the prompt).
+
+    Batches are the examples sorted by length and cut at max_batch_tokens, so
+    there is little padding. exact_match is the share of examples whose every
+    response token is the model's top-1 prediction given the reference prefix,
+    which is exactly when greedy decoding reproduces the reference output.
+    The vocabulary projection runs on the decoder's hidden states at the scored
+    positions only, LOGITS_CHUNK_BYTES of logits at a time.
+    """
+    was_training = model.training
+    model.eval()
+    device = next(model.parameters()).device
+    decoder, head = model.get_decoder(), model.get_output_embeddings()  # through a PeftModel too; LoRA layers sit inside
+    chunk = max(1, LOGITS_CHUNK_BYTES // (head.weight.shape[0] * 4))
+    collate = make_pad_collator(pad_token_id)
+    batches = TokenBudgetBatchSampler(dataset.lengths(), max_batch_tokens, shuffle=False, window=max(1, len(dataset)))
+    nll, tokens, correct, exact, scored, start = 0.0, 0, 0, 0, 0, time.perf_counter()
+    for indices in batches:
+        items = [dataset[i] for i in indices]
+        batch = collate(items)
+        input_ids = batch["input_ids"].to(device)
+        hidden = decoder(input_ids=input_ids, attention_mask=batch["attention_mask"].to(device), use_cache=False)[0]
+        # Position t predicts token t + 1; score the positions whose target is a response token.
+        position = torch.arange(1, input_ids.shape[1], device=device)
+        lengths = torch.tensor([len(item["input_ids"]) for item in items], device=device)
+        prompts = torch.tensor([item["prompt_length"] for item in items], device=device)
+        mask = (position[None, :] >= prompts[:, None]) & (position[None, :] < lengths[:, None])
+        rows = mask.nonzero()[:, 0]
+        targets = input_ids[:, 1:][mask]
+        losses, hits = [], []
+        for states, chunk_targets in zip(hidden[:, :-1][mask].split(chunk), targets.split(chunk)):
+            logits = head(states).float()
+            losses.append(torch.nn.functional.cross_entropy(logits, chunk_targets, reduction="sum"))
+            hits.append(logits.argmax(-1) == chunk_targets)
+        hits = torch.cat(hits) if hits else targets.new_zeros(0, dtype=torch.bool)
+        per_row = torch.bincount(rows, minlength=len(items))
+        misses = torch.bincount(rows, weights=(~hits).float(), minlength=len(items))
+        nll += sum(loss.item() for loss in losses)
+        tokens += len(targets)
+        correct += hits.sum().item()
+        scored += (per_row > 0).sum().item()
+        exact += ((per_row > 0) & (misses == 0)).sum().item()
+    if was_training:
+        model.train()
+    seconds = time.perf_counter() - start
+    loss = nll / max(tokens, 1)
+    return {"examples": scored, "tokens": tokens, "loss": loss, "perplexity": float(torch.tensor(loss).exp()),
+            "exact_match": exact / max(scored, 1), "token_accuracy": correct / max(tokens, 1),
+            "seconds": seconds, "tokens_per_second": tokens / seconds if seconds > 0 else 0.0}
+
+
+class EvalLog:
+    """eval.jsonl: one record per evaluated step, with the best loss so far and the evals since it improved."""
+
+    def __init__(self, path, min_delta=0.0):
+        self.path = path
+        self.min_delta = min_delta
+        self.records = []
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.records = [json.loads(line) for line in f if line.strip()]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def evaluated_steps(self):
+        return {r["step"] for r in self.records}
+
+    def append(self, step, result, **fields):
+        best = self.records[-1] if self.records else None
+        if best is None or result["loss"] < best["best_loss"] - self.min_delta:
+            best_step, best_loss, without = step, result["loss"], 0
+        else:
+            best_step, best_loss, without = best["best_step"], best["best_loss"], best["evals_without_improvement"] + 1
+        record = {"time": time.time(), "step": step, **result, **fields, "best_step": best_step,
+                  "best_loss": best_loss, "evals_without_improvement": without}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self.records.append(record)
+        return record
+
+
+def _print_record(record):
+    print(f"Eval step {record['step']}: loss {record['loss']:.4f}, perplexity {record['perplexity']:.2f}, "
+          f"exact match {record['exact_match']:.1%} on {record['examples']} examples in {record['seconds']:.1f}s "
+          f"(best: step {record['best_step']})", flush=True)
+
+
+class InlineEvalCallback(TrainerCallback):
+    """eval_mode="inline": scores the training model after a checkpoint save, within the duty cycle."""
+
+    def __init__(self, dataset, log, max_batch_tokens, pad_token_id, duty_cycle=0.1):
+        self.dataset = dataset
+        self.log = log
+        self.max_batch_tokens = max_batch_tokens
+        self.pad_token_id = pad_token_id
+        self.duty_cycle = duty_cycle
+        self.eval_seconds = 0.0
+        self.start = time.perf_counter()
+
+    def on_save(self, args, state, control, model=None, **kwargs):
+        if state.global_step in self.log.evaluated_steps():
+            return
+        # Skip this checkpoint if evaluating now would push evaluation over its share of the run.
+        last = self.log.records[-1]["seconds"] if self.log.records else 0.0
+        if self.eval_seconds + last > self.duty_cycle * (time.perf_counter() - self.start):
+            return
+        result = evaluate(model, self.dataset, self.max_batch_tokens, self.pad_token_id)
+        self.eval_seconds += result["seconds"]
+        _print_record(self.log.append(state.global_step, result, mode="inline"))
+
+
+class EarlyStoppingCallback(TrainerCallback):
+    """Stops training once the eval log shows `patience` evaluations in a row without a better loss.
+
+    The log is written by the evaluator process (or InlineEvalCallback); this
+    only stats the file on each step and reads its last line when it changed.
+    """
+
+    def __init__(self, results_file, patience):
+        self.results_file = results_file
+        self.patience = patience
+        self.seen_size = None
+
+    def on_step_end(self, args, state, control, **kwargs):
+        try:
+            size = os.path.getsize(self.results_file)
+        except OSError:
+            return
+        if size == self.seen_size:
+            return
+        self.seen_size = size
+        record = read_last_record(self.results_file)
+        if record and record["evals_without_improvement"] >= self.patience:
+            print(f"Early stopping at step {state.global_step}: eval loss hasn't improved on step "
+                  f"{record['best_step']} ({record['best_loss']:.4f}) in {self.patience} evaluations", flush=True)
+            control.should_training_stop = True
+            control.should_save = True
+
+
+class CheckpointEvaluator:
+    """Scores the checkpoints of one run as they appear, on a copy of the base model.
+
+    The base model (memory-mapped on CPU) and the tokenized eval set are loaded
+    once. Each checkpoint only swaps the LoRA weights in. When it falls behind,
+    the evaluator skips to the newest checkpoint. After each evaluation it
+    waits long enough to keep evaluation at duty_cycle of the wall time.
+    """
+
+    def __init__(self, base_model, output_dir, eval_files, results_file=None, max_length=1024, cache_dir=None,
+                 max_batch_tokens=16384, duty_cycle=0.1, min_delta=0.0):
+        from model_loading import StartupTimer, load_causal_lm
+        from transformers import AutoTokenizer
+
+        self.output_dir = output_dir
+        self.max_batch_tokens = max_batch_tokens
+        self.duty_cycle = duty_cycle
+        self.log = EvalLog(results_file or os.path.join(output_dir, EVAL_RESULTS_NAME), min_delta)
+        timer = StartupTimer()
+        with timer.phase("tokenizer"):
+            tokenizer = AutoTokenizer.from_pretrained(base_model, trust_remote_code=True)
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        with timer.phase("eval data"):
+            self.dataset = load_eval_dataset(eval_files, tokenizer, max_length, cache_dir)
+        self.base = load_causal_lm(base_model, device_map="auto", timer=timer)
+        self.model = None  # PEFT wrapper, built from the first checkpoint's adapter config
+        print(f"Evaluator ready in {timer.summary()}: {len(self.dataset)} held-out examples", flush=True)
+
+    def evaluate_adapter(self, adapter_dir, step):
+        from peft import PeftConfig, get_peft_model, set_peft_model_state_dict
+        from safetensors.torch import load_file
+
+        if self.model is None:
+            config = PeftConfig.from_pretrained(adapter_dir)
+            config.inference_mode = True
+            self.model = get_peft_model(self.base, config)
+        set_peft_model_state_dict(self.model, load_file(os.path.join(adapter_dir, ADAPTER_WEIGHTS)))
+        result = evaluate(self.model, self.dataset, self.max_batch_tokens, self.pad_token_id)
+        record = self.log.append(step, result, checkpoint=os.path.basename(os.path.normpath(adapter_dir)))
+        _print_record(record)
+        return record
+
+    def evaluate_base(self):
+        """Step 0: the base model without the adapter, as the reference point."""
+        with self.model.disable_adapter() if self.model is not None else contextlib.nullcontext():
+            result = evaluate(self.model or self.base, self.dataset, self.max_batch_tokens, self.pad_token_id)
+        record = self.log.append(0, result, checkpoint="base")
+        _print_record(record)
+        return record
+
+    def pending(self):
+        """(step, path) of the newest checkpoint not evaluated yet, or None."""
+        done = self.log.evaluated_steps()
+        for path in reversed(list_checkpoints(self.output_dir)):
+            step = int(CHECKPOINT_RE.match(os.path.basename(path)).group(1))
+            return None if step in done else (step, path)
+        return None
+
+    def watch(self, stop, poll_seconds=5.0):
+        """Evaluates new checkpoints until stop (a threading.Event) is set; returns the final {"final_step"} message."""
+        if not self.log.records:
+            self.evaluate_base()
+        while not stop.is_set():
+            found = self.pending()
+            if found is None:
+                stop.wait(poll_seconds)
+                continue
+            try:
+                record = self.evaluate_adapter(found[1], found[0])
+            except (FileNotFoundError, OSError) as e:  # rotated away while it was being read
+                print(f"Skipping {found[1]}: {e}", flush=True)
+                continue
+            stop.wait(record["seconds"] * (1 - self.duty_cycle) / self.duty_cycle)
+
+
+def watch_stdin(stop, message):
+    """Sets stop when the training process closes our stdin; keeps the last JSON line it sent in message."""
+    for line in sys.stdin:
+        if line.strip():
+            message.update(json.loads(line))
+    stop.set()
+
+
+def start_eval_process(config, results_file):
+    """Starts `evaluation.py --watch` on a train_lora.py run; its output goes to the training log."""
+    command = [sys.executable, "-u", EVAL_SCRIPT, "--watch", "--base-model", config["model_name_or_path"],
+               "--output-dir", config["output_dir"], "--eval-file", *config["eval_files"],
+               "--results-file", results_file, "--max-length", str(config["max_length"]),
+               "--cache-dir", config["cache_dir"], "--max-batch-tokens", str(config["eval_max_batch_tokens"]),
+               "--duty-cycle", str(config["eval_duty_cycle"]), "--min-delta", str(config["early_stopping_min_delta"])]
+    return subprocess.Popen(command, stdin=subprocess.PIPE, text=True)
+
+
+def stop_eval_process(process, final_step=None):
+    """Has the evaluator score the final adapter (saved at final_step in output_dir) and waits for it to exit.
+
+    If training fails instead, train_lora.py calls kill_eval_process.
+    """
+    if final_step is not None:
+        process.stdin.write(json.dumps({"final_step": final_step}) + "\n")
+    process.stdin.close()
+    return process.wait()
+
+
+def kill_eval_process(process, timeout=30):
+    """Stops the evaluator without scoring anything more; does nothing if it already exited."""
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    process.stdin.close()
+    return process.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the checkpoints of a LoRA run on held-out data.")
+    parser.add_argument("--base-model", required=True)
+    parser.add_argument("--output-dir", required=True, help="the run's output_dir, with its checkpoint-N directories")
+    parser.add_argument("--eval-file", nargs="+", required=True)
+    parser.add_argument("--results-file", help=f"default: {EVAL_RESULTS_NAME} in --output-dir")
+    parser.add_argument("--max-length", type=int, default=1024)
+    parser.add_argument("--cache-dir", default=os.path.join("data", ".cache", "tokenized"))
+    parser.add_argument("--max-batch-tokens", type=int, default=16384)
+    parser.add_argument("--duty-cycle", type=float, default=0.1, help="share of wall time spent evaluating")
+    parser.add_argument("--min-delta", type=float, default=0.0, help="smallest loss decrease that counts as better")
+    parser.add_argument("--threads", type=int, default=1, help="CPU threads (the training process keeps the rest)")
+    parser.add_argument("--watch", action="store_true",
+                        help="follow the run until stdin closes (how train_lora.py runs it), then score the final adapter")
+    args = parser.parse_args()
+    os.nice(10)  # training comes first
+    torch.set_num_threads(args.threads)
+
+    evaluator = CheckpointEvaluator(args.base_model, args.output_dir, args.eval_file, args.results_file,
+                                    args.max_length, args.cache_dir, args.max_batch_tokens, args.duty_cycle,
+                                    args.min_delta)
+    if args.watch:
+        stop, message = threading.Event(), {}
+        threading.Thread(target=watch_stdin, args=(stop, message), daemon=True).start()
+        evaluator.watch(stop)
+        final_step = message.get("final_step")
+        if final_step is not None and final_step not in evaluator.log.evaluated_steps():
+            evaluator.evaluate_adapter(args.output_dir, final_step)
+        return
+    if not evaluator.log.records:
+        evaluator.evaluate_base()
+    for path in list_checkpoints(args.output_dir):
+        step = int(CHECKPOINT_RE.match(os.path.basename(path)).group(1))
+        if step not in evaluator.log.evaluated_steps():
+            evaluator.evaluate_adapter(path, step)
+
+
+if __name__ == "__main__":
+    main()
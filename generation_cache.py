@@ -0,0 +1,151 @@
+import collections
+import hashlib
+import os
+import time
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("AKASHA_RESPONSE_CACHE_SIZE", 10_000))
+RESPONSE_CACHE_TTL = float(os.environ.get("AKASHA_RESPONSE_CACHE_TTL", 3600))
+PREFIX_CACHE_MB = float(os.environ.get("AKASHA_PREFIX_CACHE_MB", 512))
+PREFIX_BLOCK_TOKENS = int(os.environ.get("AKASHA_PREFIX_BLOCK_TOKENS", 16))
+
+
+class ResponseCache:
+    """Exact-match completions keyed by (adapter and its version, prompt, sampling params), with TTL and LRU size bound.
+
+    Only greedy (temperature 0) requests are cached: for sampled requests,
+    replaying one stored sample would change what the caller asked for.
+    Used from the event loop thread only.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = collections.OrderedDict()  # key -> (expires_at, result, generation_seconds)
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "seconds_saved": 0.0}
+
+    @staticmethod
+    def key(adapter, prompt, max_new_tokens, temperature, top_p, version=None):
+        """None for requests that aren't cached; version is AdapterRegistry.version, so retrained adapters miss."""
+        if temperature > 0:
+            return None
+        return (adapter, version, prompt, max_new_tokens, top_p)
+
+    def get(self, key):
+        if key is None:
+            return None
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, result, generation_seconds = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        self.stats["seconds_saved"] += generation_seconds
+        return result
+
+    def put(self, key, result, generation_seconds):
+        if key is None or self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, result, generation_seconds)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def report(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {"entries": len(self.entries), "hit_rate": self.stats["hits"] / lookups if lookups else 0.0, **self.stats}
+
+
+def cache_layers(cache):
+    """[(keys, values)] per layer, for both the transformers 4.x and 5.x DynamicCache layouts."""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+class PrefixKVCache:
+    """Reuses the prompt KV states of shared prompt prefixes (system prompts, templates).
+
+    Prompts are cut into blocks of block_tokens tokens. Each block is stored
+    under a hash chained from the adapter (AdapterRegistry.cache_key: name and
+    version, so retrained weights never reuse old blocks) and every preceding block, so a
+    lookup walks the chain and stops at the first miss. Entries hold the K/V
+    slices of one block for every layer and are evicted LRU by total bytes.
+    Used from the model thread only.
+    """
+
+    def __init__(self, max_bytes=int(PREFIX_CACHE_MB * 1024 * 1024), block_tokens=PREFIX_BLOCK_TOKENS):
+        self.max_bytes = max_bytes
+        self.block_tokens = block_tokens
+        self.blocks = collections.OrderedDict()  # chain hash -> (layers, bytes)
+        self.bytes = 0
+        self.stats = {"lookups": 0, "hits": 0, "tokens_reused": 0, "tokens_computed": 0, "evictions": 0,
+                      "prefill_seconds": 0.0}
+
+    def _chain(self, adapter, prompt_ids, n_blocks):
+        h = hashlib.sha256(str(adapter).encode()).digest()
+        for b in range(n_blocks):
+            block = prompt_ids[b * self.block_tokens:(b + 1) * self.block_tokens]
+            h = hashlib.sha256(h + ",".join(map(str, block)).encode()).digest()
+            yield h
+
+    def _usable_blocks(self, prompt_ids):
+        # Always leave at least one prompt token to run, so the forward pass yields next-token logits.
+        return (len(prompt_ids) - 1) // self.block_tokens
+
+    def lookup(self, adapter, prompt_ids):
+        """Returns (cached_length, [(keys, values)] per layer) for the longest cached prefix."""
+        self.stats["lookups"] += 1
+        found = []
+        for h in self._chain(adapter, prompt_ids, self._usable_blocks(prompt_ids)):
+            entry = self.blocks.get(h)
+            if entry is None:
+                break
+            self.blocks.move_to_end(h)
+            found.append(entry[0])
+        if not found:
+            return 0, None
+        import torch
+
+        self.stats["hits"] += 1
+        length = len(found) * self.block_tokens
+        self.stats["tokens_reused"] += length
+        layers = [(torch.cat([blk[i][0] for blk in found], dim=-2), torch.cat([blk[i][1] for blk in found], dim=-2))
+                  for i in range(len(found[0]))]
+        return length, layers
+
+    def insert(self, adapter, prompt_ids, layers):
+        """Stores the full blocks of a prompt from its per-layer (1, heads, seq, dim) K/V tensors."""
+        for b, h in enumerate(self._chain(adapter, prompt_ids, self._usable_blocks(prompt_ids))):
+            if h in self.blocks:
+                self.blocks.move_to_end(h)
+                continue
+            start, end = b * self.block_tokens, (b + 1) * self.block_tokens
+            block = [(k[..., start:end, :].clone(), v[..., start:end, :].clone()) for k, v in layers]
+            size = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in block)
+            self.blocks[h] = (block, size)
+            self.bytes += size
+        while self.bytes > self.max_bytes and self.blocks:
+            _, (_, size) = self.blocks.popitem(last=False)
+            self.bytes -= size
+            self.stats["evictions"] += 1
+
+    def report(self):
+        total = self.stats["tokens_reused"] + self.stats["tokens_computed"]
+        computed = self.stats["tokens_computed"]
+        # Estimate: reused tokens would have cost the same per-token prefill time we measured.
+        seconds_per_token = self.stats["prefill_seconds"] / computed if computed else 0.0
+        return {
+            "blocks": len(self.blocks),
+            "bytes": self.bytes,
+            "hit_rate": self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0,
+            "prefill_tokens_saved_ratio": self.stats["tokens_reused"] / total if total else 0.0,
+            "estimated_seconds_saved": self.stats["tokens_reused"] * seconds_per_token,
+            **self.stats,
+        }
@@ -0,0 +1,61 @@
+import json
+import os
+import re
+import time
+
+# Training throughput measured on our own runs, per GPU model. Written by
+# scripts/train_lora.py at the end of every GPU run, on the GPU box. deploy.py
+# brings it home (every deploy, or `deploy.py --pull-throughput` after a run)
+# and merges it into the local file, which the launcher reads to rank Vast
+# offers by cost per training token.
+THROUGHPUT_FILE = os.environ.get("AKASHA_THROUGHPUT_FILE",
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), "gpu_throughput.json"))
+
+
+def normalize_gpu_name(name):
+    """'NVIDIA RTX 6000 Ada Generation' (torch) and 'RTX 6000Ada' (Vast) both become 'rtx6000ada'."""
+    name = re.sub(r"\b(nvidia|geforce|generation|pcie|sxm\d?|hbm\d?e?|\d+\s?gb)\b", "", (name or "").lower())
+    return re.sub(r"[^a-z0-9]", "", name)
+
+
+def load_throughput(path=THROUGHPUT_FILE):
+    """{normalized gpu name: {"gpu_name", "tokens_per_sec", "runs", "updated_at"}}; empty if nothing recorded."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def record_throughput(gpu_name, tokens_per_sec, path=THROUGHPUT_FILE):
+    """Folds one run's per-GPU training tokens/sec into the running mean for that GPU model."""
+    table = load_throughput(path)
+    key = normalize_gpu_name(gpu_name)
+    entry = table.get(key, {"gpu_name": gpu_name, "tokens_per_sec": 0.0, "runs": 0})
+    entry["tokens_per_sec"] = (entry["tokens_per_sec"] * entry["runs"] + tokens_per_sec) / (entry["runs"] + 1)
+    entry["runs"] += 1
+    entry["updated_at"] = time.time()
+    table[key] = entry
+    _save(table, path)
+    return entry
+
+
+def merge_throughput(other, path=THROUGHPUT_FILE):
+    """Folds another machine's table (pulled from a GPU box) into the one at path, weighting means by runs."""
+    table = load_throughput(path)
+    for key, theirs in other.items():
+        entry = table.get(key, {"gpu_name": theirs["gpu_name"], "tokens_per_sec": 0.0, "runs": 0})
+        runs = entry["runs"] + theirs["runs"]
+        if not runs:
+            continue
+        entry["tokens_per_sec"] = (entry["tokens_per_sec"] * entry["runs"] + theirs["tokens_per_sec"] * theirs["runs"]) / runs
+        entry["runs"] = runs
+        entry["updated_at"] = max(entry.get("updated_at", 0), theirs.get("updated_at", 0))
+        table[key] = entry
+    _save(table, path)
+    return table
+
+
+def _save(table, path):
+    with open(path + ".tmp", "w") as f:
+        json.dump(table, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,310 @@
+import asyncio
+import contextlib
+import fcntl
+import json
+import os
+import signal
+import sys
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+from serving import ADAPTER_ROOT
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+TRAIN_SCRIPT = os.path.join(REPO_ROOT, "scripts", "train_lora.py")
+JOBS_DIR = os.environ.get("AKASHA_JOBS_DIR", os.path.join("data", ".jobs"))
+MAX_TRAINING_JOBS = int(os.environ.get("AKASHA_MAX_TRAINING_JOBS", 1))
+
+DATA_DIR = "data"
+# Config keys a POST /jobs caller may set. The rest stays server-side: the base model
+# (loaded with trust_remote_code), the tokenization cache and where results go.
+USER_CONFIG_KEYS = (
+    "data_files", "output_dir", "eval_files",
+    "lora_r", "lora_alpha", "target_modules", "lora_dropout",
+    "max_length", "pack_sequences", "pack_length", "mask_prompt",
+    "max_batch_tokens", "memory_budget_mb", "target_tokens_per_step",
+    "streaming", "streaming_batch_size", "streaming_max_steps", "shuffle_buffer", "num_workers",
+    "async_checkpoints", "profile_every",
+    "eval_mode", "eval_max_batch_tokens", "eval_duty_cycle", "early_stopping_patience", "early_stopping_min_delta",
+    "num_train_epochs", "learning_rate", "logging_steps", "save_steps", "save_total_limit", "fp16", "seed",
+)
+FINISHED = ("succeeded", "failed", "cancelled", "interrupted")
+QUEUE_POLL_SECONDS = 1.0
+
+
+class TrainingJobs:
+    """Queue of scripts/train_lora.py runs, each in its own Python process.
+
+    At most max_concurrent jobs run at once on the host; the rest wait in submission order.
+    Every job gets a directory under jobs_dir holding job.json (its state),
+    config.json (what train() receives), train.log (stdout + stderr) and
+    profile.jsonl (the step profile).
+    The API process only waits on the child processes, so training never
+    blocks the event loop. Used from the event loop thread only.
+
+    The server may run several workers (serve.py), each with its own TrainingJobs,
+    so all state is on disk and read from there on every request:
+    - the worker that queued a job runs it and holds an flock on its owner.lock
+      until it is done; an unfinished job nobody owns was cut off by a restart
+      and becomes 'interrupted';
+    - job.json only changes under an flock on state.lock, so a cancel from any
+      worker and the owner's own updates never overwrite each other;
+    - queued jobs wait in jobs_dir/.queue, oldest first, for one of the
+      max_concurrent slot locks in jobs_dir/.slots.
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR, max_concurrent=MAX_TRAINING_JOBS, adapter_root=ADAPTER_ROOT, data_dir=DATA_DIR):
+        self.jobs_dir = jobs_dir
+        self.adapter_root = adapter_root
+        self.data_dir = data_dir
+        self.max_concurrent = max_concurrent
+        self.queue_dir = os.path.join(jobs_dir, ".queue")
+        self.slot_dir = os.path.join(jobs_dir, ".slots")
+        self.processes = {}
+        self.tasks = set()
+        os.makedirs(self.queue_dir, exist_ok=True)
+        os.makedirs(self.slot_dir, exist_ok=True)
+
+    def _dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _read(self, job_id):
+        # Job ids are hex; anything else can't be a job of ours.
+        if not job_id.isalnum():
+            raise KeyError(job_id)
+        try:
+            with open(os.path.join(self._dir(job_id), "job.json"), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(job_id)
+
+    def _save(self, job):
+        path = os.path.join(self._dir(job["id"]), "job.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(job, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    @contextlib.contextmanager
+    def _state_lock(self, job_id):
+        """Held around every read-modify-write of job.json; never across an await."""
+        with open(os.path.join(self._dir(job_id), "state.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _update(self, job_id, **fields):
+        with self._state_lock(job_id):
+            job = self._read(job_id)
+            job.update(fields)
+            self._save(job)
+        return job
+
+    def _owner_lock(self, job_id):
+        return os.open(os.path.join(self._dir(job_id), "owner.lock"), os.O_RDONLY | os.O_CREAT, 0o644)
+
+    def _has_owner(self, job_id):
+        fd = self._owner_lock(job_id)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    def _take_slot(self):
+        """An flock on one of the host's max_concurrent slots (its fd), or None if all are taken."""
+        for i in range(self.max_concurrent):
+            fd = os.open(os.path.join(self.slot_dir, f"{i}.lock"), os.O_RDONLY | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def _next_queued(self):
+        """Id of the oldest job still waiting on the host; drops queue entries of jobs that aren't."""
+        for entry in sorted(os.listdir(self.queue_dir)):
+            job_id = entry.split("-", 1)[-1]
+            try:
+                if self.get(job_id)["status"] == "queued":
+                    return job_id
+            except KeyError:
+                pass
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.queue_dir, entry))
+        return None
+
+    def check_config(self, config):
+        """The overrides of a job submitted through the API, with paths made absolute.
+
+        Raises ValueError for keys outside USER_CONFIG_KEYS, for data or eval
+        files outside data_dir (relative paths are taken from there) and for an
+        output_dir outside adapter_root.
+        """
+        config = dict(config or {})
+        unknown = sorted(set(config) - set(USER_CONFIG_KEYS))
+        if unknown:
+            raise ValueError(f"Config keys not allowed: {', '.join(unknown)}")
+        for key in ("data_files", "eval_files"):
+            if config.get(key) is not None:
+                files = config[key]
+                if not isinstance(files, list) or not all(isinstance(f, str) for f in files):
+                    raise ValueError(f"{key} must be a list of file names")
+                config[key] = [_inside(self.data_dir, f, key) for f in files]
+        if config.get("output_dir") is not None:
+            if not isinstance(config["output_dir"], str):
+                raise ValueError("output_dir must be a directory name")
+            config["output_dir"] = _inside(self.adapter_root, config["output_dir"], "output_dir")
+        return config
+
+    def submit(self, config=None):
+        """Queues a training run; config overrides train_lora.DEFAULT_CONFIG (see check_config). Returns the job."""
+        job_id = uuid.uuid4().hex[:12]
+        config = self.check_config(config)
+        # By default each job writes its own adapter, which /generate can then serve by job id.
+        config.setdefault("output_dir", os.path.abspath(os.path.join(self.adapter_root, job_id)))
+        # Step profile next to the log, where /metrics reads it.
+        config.setdefault("profile_file", os.path.abspath(os.path.join(self._dir(job_id), "profile.jsonl")))
+        # Likewise the held-out evaluation results, when the config has eval_files.
+        config.setdefault("eval_results_file", os.path.abspath(os.path.join(self._dir(job_id), "eval.jsonl")))
+        os.makedirs(self._dir(job_id))
+        owner = self._owner_lock(job_id)  # before job.json exists, so no one sees the job unowned
+        fcntl.flock(owner, fcntl.LOCK_EX)
+        with open(os.path.join(self._dir(job_id), "config.json"), "w") as f:
+            json.dump(config, f, indent=2)
+        job = {"id": job_id, "status": "queued", "config": config, "submitted_at": time.time(),
+               "started_at": None, "finished_at": None, "pid": None, "returncode": None}
+        self._save(job)
+        entry = os.path.join(self.queue_dir, f"{time.time_ns():020d}-{job_id}")
+        open(entry, "w").close()
+        task = asyncio.get_running_loop().create_task(self._run(job_id, entry, owner))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        print(f"Queued training job {job_id}")
+        return job
+
+    async def _run(self, job_id, entry, owner):
+        slot = None
+        try:
+            while self._read(job_id)["status"] == "queued":
+                if self._next_queued() == job_id:
+                    slot = self._take_slot()
+                    if slot is not None:
+                        break
+                await asyncio.sleep(QUEUE_POLL_SECONDS)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry)
+            if slot is not None:
+                await self._train(job_id)
+        finally:
+            if slot is not None:
+                os.close(slot)
+            os.close(owner)  # last: the job's final state is on disk by now
+
+    async def _train(self, job_id):
+        log = await run_in_threadpool(open, os.path.join(self._dir(job_id), "train.log"), "ab")
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-u", TRAIN_SCRIPT, os.path.join(self._dir(job_id), "config.json"),
+                stdout=log, stderr=asyncio.subprocess.STDOUT, cwd=REPO_ROOT,
+                start_new_session=True,  # so cancel can stop DataLoader workers too
+            )
+        except OSError as e:
+            await run_in_threadpool(log.close)
+            self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+            return
+        self.processes[job_id] = process
+        with self._state_lock(job_id):
+            job = self._read(job_id)
+            cancelled = job["status"] != "queued"  # by another worker, while this one was starting it
+            if not cancelled:
+                job.update(status="running", pid=process.pid, started_at=time.time())
+                self._save(job)
+        if cancelled:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGTERM)
+        else:
+            print(f"Started training job {job_id} (pid {process.pid})")
+        returncode = await process.wait()
+        await run_in_threadpool(log.close)
+        del self.processes[job_id]
+        with self._state_lock(job_id):
+            job = self._read(job_id)
+            if job["status"] != "cancelled":
+                job["status"] = "succeeded" if returncode == 0 else "failed"
+            job.update(returncode=returncode, finished_at=time.time())
+            self._save(job)
+        print(f"Training job {job_id} {job['status']} (exit code {returncode})")
+
+    def get(self, job_id):
+        job = self._read(job_id)
+        if job["status"] not in FINISHED and not self._has_owner(job_id):
+            # Its worker is gone (a restart), so nothing will ever finish it. The owner
+            # saves the final state before letting go, so re-read it under the lock.
+            with self._state_lock(job_id):
+                job = self._read(job_id)
+                if job["status"] not in FINISHED:
+                    job["status"] = "interrupted"
+                    self._save(job)
+        return job
+
+    def list(self):
+        jobs = []
+        for job_id in os.listdir(self.jobs_dir):
+            try:
+                jobs.append(self.get(job_id))
+            except KeyError:
+                pass  # .queue, .slots, or a job still being created
+        return sorted(jobs, key=lambda j: j["submitted_at"], reverse=True)
+
+    def cancel(self, job_id):
+        self.get(job_id)
+        with self._state_lock(job_id):
+            job = self._read(job_id)
+            if job["status"] in FINISHED:
+                return job
+            running = job["status"] == "running"
+            job["status"] = "cancelled"
+            if not running:
+                job["finished_at"] = time.time()
+            self._save(job)
+        if running:  # the owner records the exit code when the process is gone
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(job["pid"], signal.SIGTERM)
+        return job
+
+    async def logs(self, job_id, follow=False, poll_seconds=0.5):
+        """Yields the job's log as byte chunks; with follow, keeps tailing until the job finishes."""
+        self.get(job_id)
+        path = os.path.join(self._dir(job_id), "train.log")
+        offset = 0
+        while True:
+            finished = self.get(job_id)["status"] in FINISHED
+            chunk = await run_in_threadpool(_read_from, path, offset)
+            if chunk:
+                offset += len(chunk)
+                yield chunk
+                continue
+            if not follow or finished:
+                return
+            await asyncio.sleep(poll_seconds)
+
+def _inside(root, path, key):
+    """path resolved against root (symlinks too); ValueError unless it is strictly inside root, outside dot-directories."""
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    relative = os.path.relpath(resolved, root)
+    if relative == "." or any(part.startswith(".") for part in relative.split(os.sep)):  # .. included
+        raise ValueError(f"{key} must be inside {root}: {path!r}")
+    return resolved
+
+
+def _read_from(path, offset, size=64 * 1024):
+    if not os.path.exists(path):
+        return b""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
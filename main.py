@@ -1,19 +1,262 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from starlette.datastructures import UploadFile as FormFile
+from prometheus_client import REGISTRY
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 import os
+import uuid
+
+from adapter_registry import AdapterNotFound
+from bulk_ingest import ingest, is_supported
+from dedup import DedupIndex
+from generation_cache import ResponseCache
+from jobs import TrainingJobs
+from metrics import MetricsMiddleware, TrainingJobCollector, render_metrics
+from model_loading import memory_usage
+from serving import BackendUnavailable, BatchScheduler, collect, load_backend, sse_stream
+from uploads import ResumableUploads, OffsetMismatch, safe_filename, stream_upload_to_disk
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)  # request latency histograms, served on /metrics
 
 UPLOAD_DIR = "data"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+resumable_uploads = ResumableUploads(UPLOAD_DIR)
+# Uploaded training files are normalized and deduplicated against everything in data/.
+dedup_index = DedupIndex(os.path.join(UPLOAD_DIR, ".cache", "dedup_index.sqlite"))
+# The model is loaded on the first /generate call, not at startup.
+scheduler = BatchScheduler(load_backend, response_cache=ResponseCache())
+training_jobs = TrainingJobs(data_dir=UPLOAD_DIR)
+REGISTRY.register(TrainingJobCollector(training_jobs))
+
+def submit_training(*filenames):
+    """Queues a training job on uploaded files (for ?train=true uploads)."""
+    return training_jobs.submit({"data_files": [os.path.abspath(os.path.join(UPLOAD_DIR, f)) for f in filenames]})
+
+async def dedup_upload(filename):
+    """Indexes data/ (new files first time only) and returns the report for the uploaded file."""
+    return (await dedup_uploads([filename]))[0]
+
+async def dedup_uploads(filenames):
+    reports = {r["file"]: r for r in await run_in_threadpool(dedup_index.sync, UPLOAD_DIR)}
+    return [reports.get(f) for f in filenames]
+
+def unique_prefix(filename):
+    """Shard prefix for an upload without ?name=: its name plus a random suffix, so it replaces nobody's shards."""
+    return f"{filename.split('.')[0]}-{uuid.uuid4().hex[:8]}"
+
+async def ingest_upload(sources, prefix, train):
+    """Converts archives / JSON files into validated data/<prefix>-NNNNN.jsonl shards, then deduplicates them."""
+    try:
+        report = await run_in_threadpool(ingest, sources, UPLOAD_DIR, prefix)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    shards = [s["file"] for s in report["shards"]]
+    report["dedup"] = await dedup_uploads(shards)
+    if train and shards:
+        report["job"] = submit_training(*shards)
+    return report
+
 @app.get("/")
 def home():
     return {"message": "Akasha-LLM is alive."}
 
 @app.post("/upload-training-data")
-async def upload_training_file(file: UploadFile = File(...)):
-    file_location = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_location, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    return {"message": f"Uploaded {file.filename} successfully."}
\ No newline at end of file
+async def upload_training_file(file: UploadFile = File(...), train: bool = False):
+    try:
+        filename = safe_filename(file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    file_location = os.path.join(UPLOAD_DIR, filename)
+    size, sha256 = await stream_upload_to_disk(file, file_location)
+    response = {"message": f"Uploaded {filename} successfully.", "size": size, "sha256": sha256}
+    response["dedup"] = await dedup_upload(filename)
+    if train:
+        response["job"] = submit_training(filename)
+    return response
+
+# --- Bulk uploads: tar/zip/zstd archives or many .json/.jsonl files in one multipart request ---
+# Fields named "files"; records are validated and written to data/<name>-00000.jsonl, ...
+# (see bulk_ingest.py). Uploading again under the same name replaces those shards; without
+# ?name=, the prefix is the first file's name plus a random suffix.
+
+MAX_BULK_FILES = 100_000  # starlette's default of 1000 files per form is too few for a folder of small files
+
+@app.post("/upload-training-archive")
+async def upload_training_archive(request: Request, name: str | None = None, train: bool = False):
+    async with request.form(max_files=MAX_BULK_FILES) as form:
+        uploads = [f for f in form.getlist("files") if isinstance(f, FormFile)]
+        try:
+            names = [safe_filename(f.filename) for f in uploads]
+            prefix = safe_filename(name) if name else unique_prefix(safe_filename(names[0] if names else ""))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        unsupported = [n for n in names if not is_supported(n)]
+        if unsupported:
+            raise HTTPException(status_code=400, detail=f"Unsupported file types: {unsupported[:10]}")
+        return await ingest_upload([(n, f.file) for n, f in zip(names, uploads)], prefix, train)
+
+# --- Resumable chunked uploads ---
+# 1. POST /uploads                      -> upload_id
+# 2. PUT  /uploads/{id}?offset=N        (raw request body = bytes starting at N)
+# 3. GET  /uploads/{id}                 -> current offset, to resume after a drop
+# 4. POST /uploads/{id}/complete        -> verifies size/sha256, moves into data/, deduplicates
+#    (?extract=true for an archive: converted into data/<name>-<random>-NNNNN.jsonl shards like a bulk upload)
+
+class UploadSession(BaseModel):
+    filename: str
+    total_size: int | None = None
+
+class UploadComplete(BaseModel):
+    sha256: str | None = None
+
+@app.post("/uploads")
+def create_upload(session: UploadSession):
+    try:
+        return resumable_uploads.create(session.filename, session.total_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+def upload_status(upload_id: str):
+    try:
+        return resumable_uploads.status(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown upload id")
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    try:
+        new_offset = await resumable_uploads.write_chunks(upload_id, offset, request.stream())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown upload id")
+    except OffsetMismatch as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "offset": e.expected})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"upload_id": upload_id, "offset": new_offset}
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, body: UploadComplete | None = None, train: bool = False,
+                          extract: bool = False):
+    dest_dir = None
+    if extract:  # the archive itself never lands in data/
+        dest_dir = os.path.join(resumable_uploads.session_dir, "extract-" + upload_id)
+        os.makedirs(dest_dir, exist_ok=True)
+    try:
+        result = await resumable_uploads.complete(upload_id, body.sha256 if body else None, dest_dir)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown upload id")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        if extract and not os.listdir(dest_dir):
+            os.rmdir(dest_dir)
+    if extract:
+        path = os.path.join(dest_dir, result["filename"])
+        try:
+            with open(path, "rb") as f:
+                report = await ingest_upload([(result["filename"], f)], unique_prefix(result["filename"]), train)
+        finally:
+            os.remove(path)
+            os.rmdir(dest_dir)
+        return {"message": f"Extracted {result['filename']} successfully.", **result, **report}
+    response = {"message": f"Uploaded {result['filename']} successfully.", **result}
+    response["dedup"] = await dedup_upload(result["filename"])
+    if train:
+        response["job"] = submit_training(result["filename"])
+    return response
+
+# --- Training jobs (each runs scripts/train_lora.py in its own process) ---
+# Add ?train=true to an upload to queue a job on that file right away.
+
+class TrainingJobRequest(BaseModel):
+    config: dict = {}  # overrides for DEFAULT_CONFIG in scripts/train_lora.py (jobs.USER_CONFIG_KEYS only)
+
+@app.post("/jobs")
+async def submit_job(body: TrainingJobRequest):
+    try:
+        return training_jobs.submit(body.config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/jobs")
+def list_jobs():
+    return training_jobs.list()
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    try:
+        return training_jobs.get(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    try:
+        return training_jobs.cancel(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+
+@app.get("/jobs/{job_id}/logs")
+def job_logs(job_id: str, follow: bool = False):
+    try:
+        training_jobs.get(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return StreamingResponse(training_jobs.logs(job_id, follow), media_type="text/plain")
+
+# --- Generation (serves the LoRA adapter saved by scripts/train_lora.py) ---
+
+class GenerateRequest(BaseModel):
+    prompt: str
+    max_new_tokens: int = Field(128, ge=1, le=4096)
+    temperature: float = Field(0.0, ge=0.0)
+    top_p: float = Field(1.0, gt=0.0, le=1.0)
+    adapter: str | None = None  # LoRA adapter name; None = default adapter, "base" = no adapter
+    stream: bool = False
+
+@app.post("/generate")
+async def generate(body: GenerateRequest):
+    try:
+        request = await scheduler.submit(body.prompt, body.max_new_tokens, body.temperature, body.top_p, body.adapter)
+        if body.stream:
+            return StreamingResponse(sse_stream(request), media_type="text/event-stream")
+        return await collect(request)
+    except AdapterNotFound:
+        raise HTTPException(status_code=404, detail=f"Unknown adapter: {body.adapter}")
+    except BackendUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/adapters")
+def adapters():
+    registry = getattr(scheduler.backend, "registry", None)
+    if registry is None:
+        return {"loaded": False}
+    return {"loaded": True, "available": registry.available(), **registry.stats()}
+
+@app.get("/cache-stats")
+def cache_stats():
+    prefix_cache = getattr(scheduler.backend, "prefix_cache", None)
+    return {
+        "response": scheduler.response_cache.report() if scheduler.response_cache else None,
+        "prefix": prefix_cache.report() if prefix_cache else None,
+    }
+
+@app.get("/startup")
+def startup():  # where this worker's model load spent its time, and its memory
+    timer = getattr(scheduler.backend, "startup", None)
+    if timer is None:
+        return {"loaded": False, "memory_mb": memory_usage()}
+    return {"loaded": True, **timer.report()}
+
+# --- Prometheus metrics: request latency per route + step profiles of running training jobs ---
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
@@ -0,0 +1,139 @@
+import json
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Prometheus metrics for the API: request latency per route, the step profile
+# (profiling.py) of every running training job, read from its profile.jsonl on
+# each scrape, and each job's latest held-out evaluation (evaluation.py). Kept
+# free of torch imports, like the rest of the upload API.
+
+REQUEST_LATENCY = Histogram(
+    "akasha_http_request_duration_seconds",
+    "Time from request start to the last byte of the response (streamed generations included).",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+
+def read_last_record(path, max_line_bytes=8192):
+    """Last complete JSON line of a profile file, without reading the whole file; None if there is none."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - max_line_bytes))
+            lines = f.read().splitlines()
+    except (FileNotFoundError, TypeError):
+        return None
+    for line in reversed(lines):
+        try:
+            return json.loads(line)
+        except ValueError:
+            continue  # a line cut in half by the seek, or one still being written
+    return None
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording REQUEST_LATENCY. Labels use the route template (/jobs/{job_id}), not the raw path."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = {"code": 500, "observed": False}
+
+        def observe():
+            if not status["observed"]:
+                status["observed"] = True
+                route = getattr(scope.get("route"), "path", "unmatched")
+                REQUEST_LATENCY.labels(scope["method"], route, str(status["code"])).observe(time.perf_counter() - start)
+
+        async def send_and_time(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                observe()
+
+        try:
+            await self.app(scope, receive, send_and_time)
+        finally:
+            observe()  # errors and client disconnects mid-stream
+
+
+class TrainingJobCollector:
+    """Exports the latest step profile of each running training job (see profiling.StepProfiler), and its evaluation."""
+
+    def __init__(self, training_jobs):
+        self.training_jobs = training_jobs
+
+    def collect(self):
+        jobs = GaugeMetricFamily("akasha_training_jobs", "Training jobs by status.", labels=["status"])
+        all_jobs = self.training_jobs.list()  # read from disk: other workers' jobs too
+        counts = {}
+        for job in all_jobs:
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        for status, n in sorted(counts.items()):
+            jobs.add_metric([status], n)
+        yield jobs
+
+        step = GaugeMetricFamily("akasha_train_step", "Last profiled optimizer step.", labels=["job"])
+        step_seconds = GaugeMetricFamily("akasha_train_step_seconds", "Wall time of the last profiled step.", labels=["job"])
+        phase = GaugeMetricFamily("akasha_train_phase_seconds", "Time per phase in the last profiled step.",
+                                  labels=["job", "phase"])
+        tokens = GaugeMetricFamily("akasha_train_tokens_per_second", "Non-padding tokens/sec since the previous record.",
+                                   labels=["job"])
+        padding = GaugeMetricFamily("akasha_train_padding_ratio", "Share of batch positions that were padding.",
+                                    labels=["job"])
+        memory = GaugeMetricFamily("akasha_train_peak_memory_bytes", "Peak GPU memory (CPU: peak RSS) in the window.",
+                                   labels=["job", "device"])
+        for job in all_jobs:
+            if job["status"] != "running":
+                continue
+            record = read_last_record(job["config"].get("profile_file"))
+            if record is None:
+                continue
+            job_id = job["id"]
+            step.add_metric([job_id], record["step"])
+            step_seconds.add_metric([job_id], record["step_seconds"])
+            for name, seconds in record["phases"].items():
+                phase.add_metric([job_id, name], seconds)
+            phase.add_metric([job_id, "other"], record["other_seconds"])
+            tokens.add_metric([job_id], record["tokens_per_second"])
+            padding.add_metric([job_id], record["padding_ratio"])
+            memory.add_metric([job_id, record["device"]], record["peak_memory_bytes"])
+        yield from (step, step_seconds, phase, tokens, padding, memory)
+        yield from self.collect_eval(all_jobs)
+
+    def collect_eval(self, all_jobs):
+        """The latest held-out evaluation of each job that has one (see evaluation.py), running or not."""
+        step = GaugeMetricFamily("akasha_eval_step", "Training step of the last evaluated checkpoint.", labels=["job"])
+        loss = GaugeMetricFamily("akasha_eval_loss", "Held-out loss per response token.", labels=["job"])
+        perplexity = GaugeMetricFamily("akasha_eval_perplexity", "Held-out perplexity.", labels=["job"])
+        exact = GaugeMetricFamily("akasha_eval_exact_match", "Share of held-out examples reproduced exactly by greedy decoding.",
+                                  labels=["job"])
+        best = GaugeMetricFamily("akasha_eval_best_loss", "Lowest held-out loss so far.", labels=["job"])
+        stale = GaugeMetricFamily("akasha_eval_evals_without_improvement",
+                                  "Evaluations since the held-out loss last improved.", labels=["job"])
+        for job in all_jobs:
+            record = read_last_record(job["config"].get("eval_results_file"))
+            if record is None:
+                continue
+            job_id = job["id"]
+            step.add_metric([job_id], record["step"])
+            loss.add_metric([job_id], record["loss"])
+            perplexity.add_metric([job_id], record["perplexity"])
+            exact.add_metric([job_id], record["exact_match"])
+            best.add_metric([job_id], record["best_loss"])
+            stale.add_metric([job_id], record["evals_without_improvement"])
+        yield from (step, loss, perplexity, exact, best, stale)
+
+
+def render_metrics():
+    """(body, content type) for a /metrics response."""
+    return generate_latest(), CONTENT_TYPE_LATEST
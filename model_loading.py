@@ -0,0 +1,160 @@
+"""Model loading for serving and training: weights memory-mapped from safetensors, the
+tokenizer loaded on first use, and a per-phase startup breakdown.
+
+load_causal_lm builds the model on the meta device and then assigns its parameters
+the tensors of the mapped safetensors files (copy-on-write), so nothing is read or
+copied up front. Pages are read in as the weights are used, and every process on the
+host that maps the same files shares them through the page cache. Checkpoints that
+can't be served that way (no safetensors, a quantization config, a GPU device map,
+keys the model doesn't know) go through from_pretrained as before.
+"""
+import contextlib
+import json
+import os
+import time
+
+SAFETENSORS_INDEX = "model.safetensors.index.json"
+SAFETENSORS_WEIGHTS = "model.safetensors"
+
+
+class StartupTimer:
+    """Seconds spent per startup phase: with timer.phase("weights"): ..."""
+
+    def __init__(self):
+        self.phases = {}
+        self.notes = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self):
+        return {"phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                "total_seconds": round(sum(self.phases.values()), 3), **self.notes, "memory_mb": memory_usage()}
+
+    def summary(self):
+        parts = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        return f"{sum(self.phases.values()):.2f}s ({parts})"
+
+
+def memory_usage():
+    """This process's memory in MiB: rss, pss (shared pages split between their users), private and shared."""
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f.read().splitlines()[1:]}
+    except (OSError, ValueError, IndexError):  # not Linux
+        return {}
+    return {"rss": fields["Rss"] // 1024, "pss": fields["Pss"] // 1024,
+            "private": (fields["Private_Clean"] + fields["Private_Dirty"]) // 1024,
+            "shared": (fields["Shared_Clean"] + fields["Shared_Dirty"]) // 1024}
+
+
+class LazyTokenizer:
+    """Stands in for AutoTokenizer.from_pretrained(name_or_path) and loads it on first use."""
+
+    def __init__(self, name_or_path, timer=None, **kwargs):
+        self.name_or_path = name_or_path
+        self.timer = timer or StartupTimer()
+        self.kwargs = {"trust_remote_code": True, **kwargs}
+        self._tokenizer = None
+
+    def load(self):
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+
+            with self.timer.phase("tokenizer"):
+                self._tokenizer = AutoTokenizer.from_pretrained(self.name_or_path, **self.kwargs)
+        return self._tokenizer
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.load())
+
+
+def empty_model(config):
+    """The model for config with every parameter on meta, left uninitialized; buffers stay real."""
+    from accelerate import init_empty_weights
+    from transformers import AutoModelForCausalLM
+    try:
+        from transformers.initialization import no_init_weights
+    except ImportError:  # transformers < 5
+        from transformers.modeling_utils import no_init_weights
+
+    with init_empty_weights(), no_init_weights():
+        return AutoModelForCausalLM.from_config(config, trust_remote_code=True)
+
+
+def safetensors_files(model_dir):
+    """The safetensors shards of a local checkpoint, or [] if it has none."""
+    index = os.path.join(model_dir, SAFETENSORS_INDEX)
+    if os.path.exists(index):
+        with open(index, "r") as f:
+            return [os.path.join(model_dir, name) for name in sorted(set(json.load(f)["weight_map"].values()))]
+    single = os.path.join(model_dir, SAFETENSORS_WEIGHTS)
+    return [single] if os.path.exists(single) else []
+
+
+def local_checkpoint(name_or_path):
+    """A directory with the checkpoint's files: name_or_path itself, or its Hub snapshot."""
+    if os.path.isdir(name_or_path):
+        return name_or_path
+    from huggingface_hub import snapshot_download
+
+    return snapshot_download(name_or_path, allow_patterns=["*.json", "*.safetensors", "*.py"])
+
+
+def _on_cpu(device_map):
+    import torch
+
+    return device_map in (None, "cpu") or (device_map == "auto" and not torch.cuda.is_available())
+
+
+def load_causal_lm(name_or_path, device_map=None, timer=None):
+    """AutoModelForCausalLM for name_or_path, memory-mapped when it runs on CPU from safetensors."""
+    timer = timer or StartupTimer()
+    with timer.phase("imports"):
+        import torch  # noqa: F401
+        from safetensors.torch import load_file
+        from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig
+
+    reason = None if _on_cpu(device_map) else f"device_map={device_map!r} with a GPU"
+    if reason is None:
+        with timer.phase("config"):
+            model_dir = local_checkpoint(name_or_path)
+            config = AutoConfig.from_pretrained(model_dir, trust_remote_code=True)
+            files = safetensors_files(model_dir)
+        reason = "no safetensors weights" if not files else \
+            "a quantized checkpoint" if getattr(config, "quantization_config", None) else None
+    if reason is None:
+        with timer.phase("model"):
+            model = empty_model(config)
+        with timer.phase("weights"):
+            tensors = {}
+            for path in files:
+                tensors.update(load_file(path))
+            result = model.load_state_dict(tensors, strict=False, assign=True)
+            if getattr(config, "tie_word_embeddings", False):
+                model.tie_weights()
+        missing = [n for n, p in model.named_parameters() if p.is_meta]
+        if result.unexpected_keys or missing:
+            reason = f"checkpoint keys don't match the model ({(result.unexpected_keys or missing)[:3]})"
+        else:
+            if os.path.exists(os.path.join(model_dir, "generation_config.json")):
+                model.generation_config = GenerationConfig.from_pretrained(model_dir)
+            timer.notes["weights"] = f"mmap, {len(files)} file(s)"
+            return model.eval()
+
+    print(f"Loading {name_or_path} with from_pretrained: {reason}")
+    with timer.phase("weights"):
+        model = AutoModelForCausalLM.from_pretrained(name_or_path, device_map=device_map, trust_remote_code=True)
+    timer.notes["weights"] = f"from_pretrained ({reason})"
+    return model
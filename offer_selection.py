@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from gpu_throughput import load_throughput, normalize_gpu_name
+from vast_client import VastAPIError
+
+OFFER_CACHE_TTL = float(os.environ.get("AKASHA_OFFER_CACHE_TTL", 60))
+OFFER_CACHE_FILE = os.path.join("data", ".cache", "vast_offers.json")
+
+
+class OfferCache:
+    """Search results keyed by query, kept for ttl_seconds.
+
+    Persisted to a small JSON file so back-to-back launcher runs (a retry after
+    a failed create, say) don't search again; offers go stale fast, hence the
+    short TTL.
+    """
+
+    def __init__(self, path=OFFER_CACHE_FILE, ttl_seconds=OFFER_CACHE_TTL):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry["fetched_at"] > self.ttl_seconds:
+            return None
+        return entry["offers"]
+
+    def put(self, key, offers):
+        now = time.time()
+        self.entries = {k: e for k, e in self.entries.items() if now - e["fetched_at"] <= self.ttl_seconds}
+        self.entries[key] = {"fetched_at": now, "offers": offers}
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.entries, f)
+            os.replace(self.path + ".tmp", self.path)
+
+
+def gpu_query(gpu_name, num_gpus, disk_space, verified=True):
+    return {
+        'gpu_name':   {'eq': gpu_name}, 'num_gpus':   {'eq': num_gpus},
+        'disk_space': {'gte': disk_space}, 'type':       {'eq': 'on-demand'},
+        'rentable':   {'eq': True}, 'verified':   {'eq': verified}
+    }
+
+
+async def search_gpu_types(vast, gpu_types, num_gpus, disk_space, cache=None):
+    """Searches every GPU type concurrently (verified offers first, unverified if none). Deduplicated."""
+
+    async def search(query):
+        key = json.dumps(query, sort_keys=True)
+        offers = cache.get(key) if cache else None
+        if offers is None:
+            offers = await vast.search_offers(query)
+            if cache:
+                cache.put(key, offers)
+        return offers
+
+    for verified in (True, False):
+        results = await asyncio.gather(*(search(gpu_query(g, num_gpus, disk_space, verified)) for g in gpu_types),
+                                       return_exceptions=True)
+        offers, seen = [], set()
+        for gpu, result in zip(gpu_types, results):
+            if isinstance(result, Exception):
+                print(f"  Search for '{gpu}' failed: {result}")
+                continue
+            for offer in result:
+                if offer.get("id") not in seen:
+                    seen.add(offer.get("id"))
+                    offers.append(offer)
+        if offers:
+            return offers
+        if verified:
+            print("No VERIFIED offers found. Trying UNVERIFIED offers...")
+    return []
+
+
+def measured_tokens_per_sec(offer, throughput):
+    """Training tokens/sec for an offer from our measured per-GPU numbers, or None if never trained on."""
+    measured = throughput.get(normalize_gpu_name(offer.get("gpu_name")))
+    return measured["tokens_per_sec"] * (offer.get("num_gpus") or 1) if measured else None
+
+
+def rank_offers(offers, throughput=None):
+    """Sorts offers by estimated dollars per million training tokens, cheapest first.
+
+    GPU models we have never trained on are extrapolated from the offer's
+    total_flops, using the median tokens/sec per TFLOP of the measured offers
+    in the same list. Each offer gets "est_tokens_per_sec" and "usd_per_mtok"
+    fields; offers with no estimate at all go last, by hourly price (the
+    launcher's old order).
+    """
+    throughput = load_throughput() if throughput is None else throughput
+    measured = {o["id"]: measured_tokens_per_sec(o, throughput) for o in offers}
+    per_tflop = [measured[o["id"]] / o["total_flops"] for o in offers if measured[o["id"]] and o.get("total_flops")]
+    for offer in offers:
+        tokens_per_sec = measured[offer["id"]]
+        if tokens_per_sec is None and per_tflop and offer.get("total_flops"):
+            tokens_per_sec = statistics.median(per_tflop) * offer["total_flops"]
+        offer["est_tokens_per_sec"] = tokens_per_sec
+        offer["usd_per_mtok"] = (offer.get("dph_total", float("inf")) / (tokens_per_sec * 3600) * 1e6
+                                 if tokens_per_sec else None)
+    return sorted(offers, key=lambda o: (o["usd_per_mtok"] is None, o["usd_per_mtok"] or 0.0,
+                                         o.get("dph_total", float("inf"))))
+
+
+def _retryable_create_error(e):
+    """GPU conflicts and server-side errors mean 'try another offer'; anything else (auth, bad payload) won't improve."""
+    msg = e.body.get("msg", "") if isinstance(e.body, dict) else str(e.body or "")
+    conflict = e.status_code == 400 and ("GPU conflict" in msg or "already rented" in msg)
+    return conflict or e.status_code is None or e.status_code >= 500
+
+
+async def race_create(vast, ranked_offers, payload, parallel=3, max_attempts=10):
+    """Rents the best offer that accepts, trying up to `parallel` creates at once.
+
+    Creates go out in rank order; each failure starts the next offer. Once one
+    succeeds no new creates start, the in-flight ones are allowed to finish
+    (cancelling a create mid-request could leave an instance we don't know
+    about), the best-ranked success is kept and any other success is destroyed.
+    Returns (offer, instance_id), or (None, None) if nothing could be rented.
+    """
+    queue = list(ranked_offers[:max_attempts])
+    rank = {offer["id"]: i for i, offer in enumerate(queue)}
+    running = {}
+    successes = []
+    stop_launching = False
+
+    def launch_next():
+        while queue and len(running) < parallel and not stop_launching:
+            offer = queue.pop(0)
+            print(f"  Creating instance from offer {offer['id']} ({offer.get('gpu_name')}, ${offer.get('dph_total')}/h)...")
+            running[asyncio.create_task(vast.create_instance(offer["id"], payload))] = offer
+
+    launch_next()
+    try:
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                offer = running.pop(task)
+                try:
+                    successes.append((offer, task.result()))
+                    print(f"  Offer {offer['id']} accepted: instance {successes[-1][1]}")
+                    stop_launching = True
+                except VastAPIError as e:
+                    print(f"  Offer {offer['id']} failed: {e} {e.body or ''}")
+                    if not _retryable_create_error(e):
+                        stop_launching = True
+            launch_next()
+    except asyncio.CancelledError:
+        # Interrupted mid-race: find out which creates still went through and release all of them.
+        stop_launching = True
+        results = await asyncio.gather(*running, return_exceptions=True)
+        successes += [(offer, r) for offer, r in zip(running.values(), results) if not isinstance(r, BaseException)]
+        await _destroy(vast, [i for _, i in successes])
+        raise
+
+    if not successes:
+        return None, None
+    successes.sort(key=lambda s: rank[s[0]["id"]])
+    await _destroy(vast, [i for _, i in successes[1:]])
+    return successes[0]
+
+
+async def _destroy(vast, instance_ids):
+    if not instance_ids:
+        return
+    print(f"  Destroying {len(instance_ids)} extra instance(s) from the race: {instance_ids}")
+    results = await asyncio.gather(*(vast.destroy_instance(i) for i in instance_ids), return_exceptions=True)
+    for instance_id, result in zip(instance_ids, results):
+        if isinstance(result, Exception):
+            print(f"  WARNING: could not destroy instance {instance_id}: {result}. Destroy it by hand!")
@@ -0,0 +1,139 @@
+import heapq
+import random
+
+import numpy as np
+import torch
+
+
+def pack_examples(lengths, pack_length):
+    """Groups example indices into bins of at most pack_length tokens (lengths must already be capped).
+
+    Longest examples are placed first, each into the bin with the most room left
+    (a heap keeps this O(n log n) for millions of examples). Returns a list of
+    index lists.
+    """
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    bins = []
+    free = []  # (-remaining_capacity, bin_index)
+    for idx in order:
+        n = int(lengths[idx])
+        if free and -free[0][0] >= n:
+            remaining, b = heapq.heappop(free)
+            bins[b].append(int(idx))
+            heapq.heappush(free, (remaining + n, b))
+        else:
+            bins.append([int(idx)])
+            heapq.heappush(free, (-(pack_length - n), len(bins) - 1))
+    return bins
+
+
+class PackedDataset(torch.utils.data.Dataset):
+    """Concatenates several tokenized examples into one sequence of at most pack_length tokens.
+
+    position_ids restart at 0 for every example. With no attention_mask and no KV
+    cache, transformers reads those restarts as sequence boundaries, so examples
+    never attend to each other. The first token of every example is dropped from the loss
+    so nothing is trained to predict across a boundary; with mask_prompt=True the
+    instruction tokens are dropped too and only the output is learned.
+    """
+
+    def __init__(self, dataset, pack_length, mask_prompt=False):
+        self.dataset = dataset
+        self.pack_length = pack_length
+        self.mask_prompt = mask_prompt
+        example_lengths = np.minimum(dataset.lengths(), pack_length)
+        self.bins = pack_examples(example_lengths, pack_length)
+        self._lengths = np.array([int(example_lengths[b].sum()) for b in self.bins], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.bins)
+
+    def lengths(self):
+        return self._lengths
+
+    def __getitem__(self, idx):
+        input_ids, position_ids, labels = [], [], []
+        for i in self.bins[idx]:
+            item = self.dataset[i]
+            ids = item["input_ids"][:self.pack_length]
+            n = len(ids)
+            item_labels = ids.clone()
+            masked = item.get("prompt_length", 0) if self.mask_prompt else 0
+            item_labels[:max(1, masked)] = -100
+            input_ids.append(ids)
+            position_ids.append(torch.arange(n))
+            labels.append(item_labels)
+        return {"input_ids": torch.cat(input_ids), "position_ids": torch.cat(position_ids), "labels": torch.cat(labels)}
+
+
+def make_packed_collator(pad_token_id):
+    """Right-pads packed rows to the longest row; padding forms its own ignored segment."""
+
+    def collate(batch):
+        longest = max(len(item["input_ids"]) for item in batch)
+        input_ids = torch.full((len(batch), longest), pad_token_id, dtype=torch.long)
+        labels = torch.full((len(batch), longest), -100, dtype=torch.long)
+        # Padding positions count up from 0 as well, so they are a separate sequence.
+        position_ids = torch.arange(longest).repeat(len(batch), 1)
+        for i, item in enumerate(batch):
+            n = len(item["input_ids"])
+            input_ids[i, :n] = item["input_ids"]
+            labels[i, :n] = item["labels"]
+            position_ids[i, :n] = item["position_ids"]
+            position_ids[i, n:] = torch.arange(longest - n)
+        # A KV cache makes transformers skip the packed-sequence mask, so turn it off.
+        return {"input_ids": input_ids, "position_ids": position_ids, "labels": labels, "use_cache": False}
+
+    return collate
+
+
+class TokenBudgetBatchSampler(torch.utils.data.Sampler):
+    """Yields batches of similar-length examples whose padded size fits max_tokens.
+
+    Indices are shuffled, cut into windows of `window` examples, sorted by length
+    inside each window and then greedily cut into batches where
+    len(batch) * longest_in_batch <= max_tokens. Batch order is shuffled again so
+    long and short batches are interleaved across the epoch.
+    """
+
+    def __init__(self, lengths, max_tokens, shuffle=True, seed=0, window=1000, max_batch_size=None):
+        self.lengths = np.asarray(lengths)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.seed = seed
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _batches(self):
+        rng = random.Random(self.seed + self.epoch)
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indices)
+        batches = []
+        for start in range(0, len(indices), self.window):
+            window = sorted(indices[start:start + self.window], key=lambda i: self.lengths[i])
+            batch, longest = [], 0
+            for i in window:
+                new_longest = max(longest, int(self.lengths[i]))
+                too_big = batch and new_longest * (len(batch) + 1) > self.max_tokens
+                too_many = self.max_batch_size and len(batch) >= self.max_batch_size
+                if too_big or too_many:
+                    batches.append(batch)
+                    batch, new_longest = [], int(self.lengths[i])
+                batch.append(i)
+                longest = new_longest
+            if batch:
+                batches.append(batch)
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        return iter(self._batches())
+
+    def __len__(self):
+        return len(self._batches())
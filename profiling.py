@@ -0,0 +1,172 @@
+import contextlib
+import json
+import os
+import resource
+import time
+
+import torch
+from transformers import TrainerCallback
+
+PHASES = ("data_wait", "forward", "backward", "optimizer", "checkpoint")
+
+
+def _sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def reset_peak_memory():
+    """Starts a new peak: GPU allocator stats, or the kernel's RSS high-water mark on CPU."""
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+        return
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")  # resets VmHWM (Linux 4.0+)
+    except OSError:  # not Linux: peak_memory_bytes falls back to the lifetime peak
+        pass
+
+
+def peak_memory_bytes():
+    """Peak GPU memory allocated, or peak RSS on CPU, since the last reset_peak_memory()."""
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated()
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # lifetime peak, kB on Linux
+
+
+class StepProfiler:
+    """Where training steps spend their time, written as one JSONL record per sampled step.
+
+    Every `every`-th optimizer step is timed phase by phase (data_wait, forward,
+    backward, optimizer, checkpoint). The GPU is synchronized at phase boundaries
+    on that step only. Other steps just add their token counts, kept as device
+    tensors, to the window. So the cost between samples is a few tensor sums, and
+    leaving the profiler on costs about one extra sync every `every` steps.
+
+    Checkpoint saves are rare and slow, so they are timed on every step. Each
+    record holds:
+    - the sampled step's phase seconds and wall seconds;
+    - tokens/sec and padding ratio over the whole window since the last record;
+    - the window's peak memory.
+    """
+
+    def __init__(self, path, every=10, pad_token_id=None):
+        self.path = path
+        self.every = max(1, every)
+        self.pad_token_id = pad_token_id
+        self.step = 0             # optimizer step currently running (global_step + 1)
+        self.sampling = False
+        self.record_step = False  # sampled, or an always-timed phase ran (e.g. a checkpoint)
+        self.phases = {}
+        self.step_start = None
+        self._window_reset()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _window_reset(self):
+        self.window_start = time.perf_counter()
+        self.window_steps = 0
+        self.real_tokens = 0      # tensor once counting starts (summed on device, read when a record is written)
+        self.total_tokens = 0
+        reset_peak_memory()
+
+    def begin_step(self, global_step):
+        """Called when the Trainer starts fetching the batches for step global_step + 1."""
+        self.finish_step()
+        self.step = global_step + 1
+        self.sampling = self.step == 1 or self.step % self.every == 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.record_step = self.sampling
+        if self.sampling:
+            _sync()
+        self.step_start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name, always=False):
+        """Times a block on sampled steps (or on every step with always=True, for rare, slow phases)."""
+        if not (self.sampling or always):
+            yield
+            return
+        self.record_step = True
+        _sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            _sync()
+            self.phases[name] += time.perf_counter() - start
+
+    def count_tokens(self, batch):
+        """Adds a batch's real (non-padding) and total token positions to the window."""
+        input_ids = batch.get("input_ids")
+        if input_ids is None:
+            return
+        if "attention_mask" in batch:
+            real = batch["attention_mask"].sum()
+        elif self.pad_token_id is not None:
+            real = (input_ids != self.pad_token_id).sum()
+        else:
+            real = input_ids.numel()
+        self.real_tokens = self.real_tokens + real
+        self.total_tokens += input_ids.numel()
+
+    def finish_step(self, final=False):
+        """Closes the running step; writes a record if it was timed (or is the last one). Safe to call twice."""
+        if self.step_start is None:
+            return
+        self.window_steps += 1
+        if self.record_step or final:
+            _sync()
+            self.write_record(time.perf_counter() - self.step_start)
+        self.step_start = None
+
+    def write_record(self, step_seconds):
+        window_seconds = time.perf_counter() - self.window_start
+        real = int(self.real_tokens) if torch.is_tensor(self.real_tokens) else self.real_tokens
+        record = {
+            "time": time.time(),
+            "step": self.step,
+            "sampled": self.sampling,
+            "step_seconds": step_seconds,
+            "phases": self.phases,
+            "other_seconds": max(0.0, step_seconds - sum(self.phases.values())),
+            "window_steps": self.window_steps,
+            "window_seconds": window_seconds,
+            "window_tokens": real,
+            "tokens_per_second": real / window_seconds if window_seconds > 0 else 0.0,
+            "padding_ratio": 1 - real / self.total_tokens if self.total_tokens else 0.0,
+            "peak_memory_bytes": peak_memory_bytes(),
+            "device": "cuda" if torch.cuda.is_available() else "cpu",
+        }
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        self._window_reset()
+        return record
+
+
+class ProfilingCallback(TrainerCallback):
+    """Times the optimizer step and closes out the last step; the rest is timed by the Trainer (see train_lora.py)."""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self._optimizer_phase = None
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._optimizer_phase = self.profiler.phase("optimizer")
+        self._optimizer_phase.__enter__()
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        if self._optimizer_phase is not None:
+            self._optimizer_phase.__exit__(None, None, None)
+            self._optimizer_phase = None
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.profiler.finish_step(final=True)
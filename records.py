@@ -0,0 +1,96 @@
+"""Training records on disk: finding, reading and formatting them. Only the standard
+library, so the upload API can use it without importing torch."""
+import codecs
+import glob
+import json
+import os
+
+READ_SIZE = 1024 * 1024  # characters decoded at a time from a .json list
+
+
+def find_data_files(data_dir):
+    """All .json / .jsonl training files directly inside data_dir, in a stable order."""
+    return sorted(glob.glob(os.path.join(data_dir, "*.json")) + glob.glob(os.path.join(data_dir, "*.jsonl")))
+
+
+def iter_records(path):
+    """Yields training records from a .jsonl file (line by line) or a .json list (item by item).
+
+    A .json file holding one object yields that object. Neither format is ever read whole.
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        with open(path, "rb") as f:
+            yield from iter_json_list(f)
+
+
+def iter_json_list(stream, read_size=READ_SIZE):
+    """Yields the items of a top-level JSON list without reading the whole stream.
+
+    A document that is one object (a single record) is yielded as it is. Items are
+    decoded one at a time from a buffer refilled read_size characters at a time, or
+    as many as are buffered already, so one huge item costs linear time, not quadratic.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8-sig")()  # tar stream members can't be wrapped in a TextIOWrapper
+    buf, pos, eof = "", 0, False
+
+    def more():
+        nonlocal buf, pos, eof
+        data = stream.read(max(read_size, len(buf) - pos))
+        eof = not data
+        buf, pos = buf[pos:] + utf8.decode(data, final=eof), 0
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            more()
+
+    skip_space()
+    if pos == len(buf):
+        raise ValueError("empty JSON document")
+    if buf[pos] != "[":
+        yield json.loads(buf[pos:] + utf8.decode(stream.read(), final=True))
+        return
+    pos += 1
+    first = True
+    while True:
+        skip_space()
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        if not first:
+            if pos == len(buf) or buf[pos] != ",":
+                raise ValueError("expected ',' or ']' in JSON list")
+            pos += 1
+            skip_space()
+        first = False
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                if end < len(buf) or eof:  # a number at the end of the buffer may continue in the next read
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            more()
+        pos = end
+        yield item
+
+
+def format_example(item):
+    """Same text the original SimpleDataset trained on: instruction + output."""
+    return item["instruction"] + " " + item["output"]
+
+
+def format_prompt(item):
+    """The part of format_example that is prompt, not response (masked out of the loss on request)."""
+    return item["instruction"] + " "
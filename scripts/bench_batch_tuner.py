@@ -0,0 +1,82 @@
+"""CPU benchmark: training throughput with one sequence per micro-batch (the old
+per_device_train_batch_size=1) vs. the token budget batch_tuner.py probes for a
+memory budget. Both runs accumulate gradients up to the same tokens per optimizer
+step, so they make the same updates; only the micro-batch size differs.
+
+    python scripts/bench_batch_tuner.py --memory-budget-mb 256 --records 400
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import torch
+
+from bench_utils import Timer, synthetic_records, tiny_llama, tiny_tokenizer, write_jsonl
+import batch_tuner
+import train_lora
+
+
+def run(name, config):
+    with Timer() as t:
+        train_lora.train(config)
+    with open(os.path.join(config["output_dir"], "batch_size.json"), "r") as f:
+        sizes = json.load(f)
+    with open(os.path.join(config["output_dir"], "profile.jsonl"), "r") as f:
+        records = [json.loads(line) for line in f]
+    # Records cover consecutive windows; step 1 (warm-up) is its own window and is left out.
+    windows = records[1:]
+    seconds = sum(r["window_seconds"] for r in windows)
+    tokens = sum(r["window_tokens"] for r in windows)
+    return {"mode": name, "total_seconds": round(t.seconds, 2), "max_batch_tokens": sizes["max_batch_tokens"],
+            "gradient_accumulation_steps": sizes["gradient_accumulation_steps"],
+            "tokens_per_second": round(tokens / seconds) if seconds else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=400)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--pack-length", type=int, default=256)
+    parser.add_argument("--memory-budget-mb", type=float, default=256)
+    parser.add_argument("--target-tokens-per-step", type=int, default=4096)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        batch_tuner.TUNING_CACHE_FILE = os.path.join(tmp, "batch_tuning.json")  # keep the repo's cache clean
+        model_dir = os.path.join(tmp, "model")
+        tiny_llama(hidden_size=args.hidden_size, layers=args.layers).save_pretrained(model_dir)
+        tiny_tokenizer().save_pretrained(model_dir)
+        data = write_jsonl(os.path.join(tmp, "data.jsonl"), synthetic_records(args.records, mean_words=30))
+        config = {
+            "model_name_or_path": model_dir, "data_files": [data], "cache_dir": os.path.join(tmp, "cache"),
+            "pack_length": args.pack_length, "max_length": args.pack_length, "num_workers": 0,
+            "memory_budget_mb": args.memory_budget_mb, "target_tokens_per_step": args.target_tokens_per_step,
+            "save_steps": 10**6, "logging_steps": 10**6, "profile_every": 1, "resume_from_checkpoint": None,
+        }
+        run("warmup", {**config, "max_batch_tokens": args.pack_length, "output_dir": os.path.join(tmp, "warmup")})
+        results = [run("batch of 1", {**config, "max_batch_tokens": args.pack_length,
+                                      "output_dir": os.path.join(tmp, "fixed")}),
+                   run("tuned (probe)", {**config, "max_batch_tokens": "auto", "output_dir": os.path.join(tmp, "tuned")}),
+                   run("tuned (cached)", {**config, "max_batch_tokens": "auto",
+                                          "output_dir": os.path.join(tmp, "tuned_cached")})]
+        with open(batch_tuner.TUNING_CACHE_FILE, "r") as f:
+            cache = json.load(f)
+        entry = next(iter(cache.values()))
+
+    for r in results:
+        r["speedup"] = round(r["tokens_per_second"] / results[0]["tokens_per_second"], 2)
+        print(f"{r['mode']:>15}: {r['max_batch_tokens']:6d} tokens/micro-batch x {r['gradient_accumulation_steps']:2d} "
+              f"accumulation, {r['tokens_per_second']:7d} tokens/s ({r['speedup']:.2f}x), "
+              f"{r['total_seconds']:6.2f}s total")
+    print(f"probe: {len(entry['probes'])} steps in {entry['probe_seconds']:.2f}s for a "
+          f"{args.memory_budget_mb:g} MiB budget; rows -> MiB: "
+          + ", ".join(f"{rows}->{used / 2**20:.0f}" for rows, used in entry["probes"]))
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
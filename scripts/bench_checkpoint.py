@@ -0,0 +1,80 @@
+"""CPU benchmark: how long a checkpoint save pauses training, for the Trainer's own
+synchronous save vs. the async adapter-only checkpointer.
+
+    python scripts/bench_checkpoint.py --steps 40 --save-steps 5 --hidden-size 256 --lora-r 64
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import torch
+
+from bench_utils import Timer, synthetic_records, tiny_llama, tiny_tokenizer, write_jsonl
+import train_lora
+
+
+def timed_saves(stalls):
+    original = train_lora.TokenBudgetTrainer._save_checkpoint
+
+    def _save_checkpoint(self, model, trial):
+        with Timer() as t:
+            original(self, model, trial)
+        stalls.append(t.seconds)
+    return original, _save_checkpoint
+
+
+def run(name, config):
+    stalls = []
+    original, wrapped = timed_saves(stalls)
+    train_lora.TokenBudgetTrainer._save_checkpoint = wrapped
+    try:
+        with Timer() as total:
+            train_lora.train(config)
+    finally:
+        train_lora.TokenBudgetTrainer._save_checkpoint = original
+    result = {
+        "mode": name,
+        "saves": len(stalls),
+        "avg_stall_ms": round(sum(stalls) / len(stalls) * 1000, 2),
+        "max_stall_ms": round(max(stalls) * 1000, 2),
+        "total_seconds": round(total.seconds, 2),
+    }
+    print(f"{name:>5}: {result['saves']} saves, avg stall {result['avg_stall_ms']:8.2f}ms, "
+          f"max {result['max_stall_ms']:8.2f}ms, run {result['total_seconds']:.2f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=40)
+    parser.add_argument("--save-steps", type=int, default=5)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--lora-r", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "model")
+        tiny_llama(hidden_size=args.hidden_size, layers=args.layers).save_pretrained(model_dir)
+        tiny_tokenizer().save_pretrained(model_dir)
+        data = write_jsonl(os.path.join(tmp, "data.jsonl"), synthetic_records(args.steps * 4, mean_words=10))
+        config = {
+            "model_name_or_path": model_dir, "data_files": [data], "cache_dir": os.path.join(tmp, "cache"),
+            "lora_r": args.lora_r, "lora_alpha": args.lora_r * 2,
+            "target_modules": ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
+            "pack_length": 256, "max_length": 256, "max_batch_tokens": 256, "num_workers": 0,
+            "save_steps": args.save_steps, "save_total_limit": 2, "logging_steps": 1000, "resume_from_checkpoint": None,
+        }
+        results = [
+            run("sync", {**config, "async_checkpoints": False, "output_dir": os.path.join(tmp, "sync")}),
+            run("async", {**config, "async_checkpoints": True, "output_dir": os.path.join(tmp, "async")}),
+        ]
+    results[1]["stall_reduction"] = round(results[0]["avg_stall_ms"] / results[1]["avg_stall_ms"], 1)
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
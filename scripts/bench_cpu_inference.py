@@ -0,0 +1,123 @@
+"""CPU benchmark: serving the fp32 PEFT model (base + unmerged LoRA) vs. cpu_export.py's
+merged int8 export, on a tiny randomly initialized Llama with a random q_proj/v_proj
+adapter. Reports startup time, single-request latency, batched throughput through
+the /generate scheduler, and the logit drift on held-out prompts. The int8 model
+is measured as loaded (int8 GEMMs on the memory-mapped weights) and again once
+its layers are packed, which serving does in the background.
+
+    python scripts/bench_cpu_inference.py --hidden-size 512 --layers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+
+import torch
+
+from bench_generate import load_test
+from bench_utils import INSTRUCTIONS, Timer, synthetic_records, tiny_llama, tiny_tokenizer, write_jsonl
+from cpu_export import export, load_int8_model, logit_drift, pack_in_background, read_prompts
+from serving import BatchScheduler, HFGenerationBackend, collect
+
+
+def make_adapter(base_dir, adapter_dir, r=8):
+    """A LoRA adapter with non-zero B, so merging actually changes the weights."""
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoModelForCausalLM
+
+    model = get_peft_model(AutoModelForCausalLM.from_pretrained(base_dir),
+                           LoraConfig(r=r, lora_alpha=32, target_modules=["q_proj", "v_proj"], task_type="CAUSAL_LM"))
+    torch.manual_seed(1)
+    for name, param in model.named_parameters():
+        if "lora_B" in name:
+            torch.nn.init.normal_(param, std=0.02)
+    model.save_pretrained(adapter_dir)
+
+
+def load_peft(base_dir, adapter_dir):
+    """(model, tokenizer) the way serving loads the adapter without an export."""
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model = AutoModelForCausalLM.from_pretrained(base_dir, dtype=torch.float32)
+    return PeftModel.from_pretrained(model, adapter_dir).eval(), AutoTokenizer.from_pretrained(base_dir)
+
+
+def measure(name, model, tokenizer, args, prompts):
+    scheduler = BatchScheduler(lambda: HFGenerationBackend(model, tokenizer, None), max_batch_size=args.max_batch_size,
+                               max_wait_ms=5, response_cache=None)
+
+    async def main():
+        await collect(await scheduler.submit("warmup", max_new_tokens=2))
+        single = await load_test(scheduler, prompts[:8], 1, args.max_new_tokens)
+        batched = await load_test(scheduler, prompts, args.concurrency, args.max_new_tokens)
+        return single, batched
+
+    single, batched = asyncio.run(main())
+    scheduler.executor.shutdown()
+    return {"model": name, "latency_p50_ms": single["p50_latency_ms"],
+            "ms_per_token": round(single["p50_latency_ms"] / args.max_new_tokens, 2),
+            "batched_tokens_per_sec": batched["tokens_per_sec"], "batched_p99_ms": batched["p99_latency_ms"]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--heldout", type=int, default=32, help="held-out prompts for the logit drift")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    rng = random.Random(0)
+    prompts = [f"{rng.choice(INSTRUCTIONS)} ({i})" for i in range(args.requests)]
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir, adapter_dir, out_dir = (os.path.join(tmp, d) for d in ("base", "adapter", "int8"))
+        tiny_llama(hidden_size=args.hidden_size, layers=args.layers).save_pretrained(base_dir)
+        tiny_tokenizer().save_pretrained(base_dir)
+        make_adapter(base_dir, adapter_dir)
+        manifest = export(base_dir, adapter_dir, out_dir)
+
+        with Timer() as t:
+            peft_model, tokenizer = load_peft(base_dir, adapter_dir)
+        peft_startup = t.seconds
+        int8_model, int8_tokenizer, int8_startup = load_int8_model(out_dir)
+
+        # Held-out: synthetic records from another seed than any training data.
+        heldout = read_prompts(write_jsonl(os.path.join(tmp, "heldout.jsonl"),
+                                           synthetic_records(args.heldout, seed=12345)))
+        results = [measure("fp32 PEFT (unmerged)", peft_model, tokenizer, args, prompts),
+                   measure("int8 merged", int8_model, int8_tokenizer, args, prompts)]
+        drift = [None, logit_drift(peft_model, int8_model, int8_tokenizer, heldout)]
+        with Timer() as t:
+            pack_in_background(int8_model).join()
+        pack_seconds = t.seconds
+        results.append(measure("int8 merged, packed", int8_model, int8_tokenizer, args, prompts))
+        drift.append(logit_drift(peft_model, int8_model, int8_tokenizer, heldout))
+    for r, startup, size, d in zip(results, (peft_startup, int8_startup, int8_startup + pack_seconds),
+                                   (manifest["fp32_bytes"], manifest["export_bytes"], manifest["export_bytes"]), drift):
+        r["startup_seconds"] = round(startup, 3)
+        r["weights_mb"] = round(size / 1e6, 1)
+        r["drift"] = d
+
+    for r in results:
+        print(f"{r['model']:>22}: {r['ms_per_token']:6.2f} ms/token at batch 1, "
+              f"{r['batched_tokens_per_sec']:8.1f} tok/s batched, ready after {r['startup_seconds']:.3f}s, "
+              f"{r['weights_mb']} MB")
+    for r in results[1:]:
+        d = r["drift"]
+        print(f"{r['model']}: {results[0]['ms_per_token'] / r['ms_per_token']:.2f}x latency, "
+              f"{r['batched_tokens_per_sec'] / results[0]['batched_tokens_per_sec']:.2f}x throughput; "
+              f"logit drift on {d['prompts']} held-out prompts: mean KL {d['mean_kl']:.2e}, "
+              f"max |dlogit| {d['max_abs_logit_diff']:.3f}, top-1 agreement {d['top1_agreement']:.1%}")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Ingest-time dedup on a synthetic corpus: a base file, then an upload that repeats
+part of it. Part of the repeats are exact (only case and whitespace changed), part
+are near-duplicates (one word of the output replaced). Reports what was caught,
+the tokens saved, the cost of checking the upload against the persistent index
+versus re-deduplicating everything, and the peak RSS.
+
+    python scripts/bench_dedup.py --base 1000000 --upload 100000
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+
+from bench_utils import Timer, WORDS, synthetic_records, write_jsonl
+from dataset_shards import iter_records
+from dedup import DedupIndex
+
+
+def make_upload(base_path, base_size, n, seed=1):
+    """n records: 30% exact repeats, 20% near-duplicates, 50% new. Returns (records, exact, near)."""
+    rng = random.Random(seed)
+    picked = set(rng.sample(range(base_size), min(base_size, n)))  # only these base records are held in memory
+    base_records = [r for i, r in enumerate(iter_records(base_path)) if i in picked]
+    long_ones = [r for r in base_records if len(r["output"].split()) >= 30]
+    records, exact, near = [], 0, 0
+    new = synthetic_records(n, seed=seed + 1000, mean_words=40)
+    for i in range(n):
+        roll = rng.random()
+        if roll < 0.3:
+            r = rng.choice(base_records)
+            records.append({**r, "instruction": "  " + r["instruction"].upper(), "output": r["output"].replace(" ", "  ")})
+            exact += 1
+        elif roll < 0.5 and long_ones:
+            r = rng.choice(long_ones)
+            words = r["output"].split()
+            words[rng.randrange(len(words))] = rng.choice(WORDS) + "s"
+            records.append({**r, "output": " ".join(words)})
+            near += 1
+        else:
+            r = next(new)
+            records.append({**r, "instruction": r["instruction"].replace("(", "(new ")})
+    return records, exact, near
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base", type=int, default=200_000)
+    parser.add_argument("--upload", type=int, default=20_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, "data")
+        os.makedirs(data_dir)
+        base_path = write_jsonl(os.path.join(data_dir, "base.jsonl"), synthetic_records(args.base, mean_words=40))
+        upload, exact, near = make_upload(base_path, args.base, args.upload)
+
+        index = DedupIndex(os.path.join(tmp, "index.sqlite"))
+        with Timer() as t_base:
+            index.sync(data_dir)
+        write_jsonl(os.path.join(data_dir, "upload.jsonl"), upload)
+        shutil.copy(os.path.join(data_dir, "upload.jsonl"), os.path.join(tmp, "upload.orig.jsonl"))
+        with Timer() as t_upload:
+            [report] = index.sync(data_dir)
+        with Timer() as t_nothing:
+            index.sync(data_dir)
+        stats = index.stats()
+        index.close()
+
+        # What the same upload costs without a persistent index: dedup everything again.
+        shutil.copy(os.path.join(tmp, "upload.orig.jsonl"), os.path.join(data_dir, "upload.jsonl"))
+        fresh = DedupIndex(os.path.join(tmp, "fresh.sqlite"))
+        with Timer() as t_rebuild:
+            fresh.sync(data_dir)
+        fresh.close()
+
+    result = {
+        "base_records": args.base, "upload_records": args.upload,
+        "planted_exact": exact, "planted_near": near,
+        "found_exact": report["exact_duplicates"], "found_near": report["near_duplicates"],
+        "tokens_in": report["tokens_in"], "tokens_saved": report["tokens_saved"],
+        "index_base_seconds": round(t_base.seconds, 2),
+        "base_records_per_second": round(args.base / t_base.seconds),
+        "incremental_upload_seconds": round(t_upload.seconds, 2),
+        "rebuild_everything_seconds": round(t_rebuild.seconds, 2),
+        "unchanged_sync_seconds": round(t_nothing.seconds, 4),
+        "index_records": stats["records"],
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+    }
+    print(f"upload of {args.upload}: found {result['found_exact']}/{exact} exact and "
+          f"{result['found_near']}/{near} near duplicates; saved {result['tokens_saved']} of "
+          f"{result['tokens_in']} tokens ({result['tokens_saved'] / result['tokens_in']:.0%}) per epoch")
+    print(f"indexing {args.base} base records: {result['index_base_seconds']}s "
+          f"({result['base_records_per_second']} records/s)")
+    print(f"upload against the index: {result['incremental_upload_seconds']}s; "
+          f"re-deduplicating everything: {result['rebuild_everything_seconds']}s; "
+          f"nothing changed: {result['unchanged_sync_seconds']}s; peak RSS {result['peak_rss_mb']} MiB")
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Redeploy cost on a synthetic project (code + dataset + wheelhouse): the old
+`scp -r` of the whole tree vs. deploy.py's delta sync, into a local directory.
+
+Both go through the same kind of pipe (a tar stream into `sh`), so the numbers
+compare what gets sent. --mbps converts the bytes into the transfer time on a real
+link, which is where most of the minutes of the old deploy went.
+
+    python scripts/bench_deploy.py --dataset-mb 200 --wheelhouse-mb 300 --mbps 100
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+
+from bench_utils import Timer, synthetic_records, write_jsonl
+from deploy import Target, deploy
+
+
+def make_project(root, dataset_mb, wheelhouse_mb, code_files=40):
+    os.makedirs(os.path.join(root, "scripts"))
+    os.makedirs(os.path.join(root, "data"))
+    os.makedirs(os.path.join(root, "wheelhouse"))
+    for i in range(code_files):
+        with open(os.path.join(root, "scripts" if i % 4 else "", f"module_{i}.py"), "w") as f:
+            f.write("".join(f"def f{j}(x):\n    return x + {j}\n\n" for j in range(200)))
+    records = synthetic_records(int(dataset_mb * 1e6 / 260), mean_words=30)  # ~260 bytes per record
+    write_jsonl(os.path.join(root, "data", "train.jsonl"), records)
+    for i in range(10):
+        with open(os.path.join(root, "wheelhouse", f"pkg{i}-1.0-py3-none-any.whl"), "wb") as f:
+            f.write(os.urandom(int(wheelhouse_mb * 1e6 / 10)))
+    with open(os.path.join(root, "wheelhouse", "requirements.txt"), "w") as f:
+        f.write("".join(f"pkg{i}\n" for i in range(10)))
+
+
+def tree_bytes(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+def full_copy(src, dst):
+    """What `scp -r` does: every byte, every time."""
+    os.makedirs(dst, exist_ok=True)
+    subprocess.run(f"tar -cf - -C {src} . | sh -c 'tar -xf - -C {dst}'", shell=True, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset-mb", type=float, default=50)
+    parser.add_argument("--wheelhouse-mb", type=float, default=100)
+    parser.add_argument("--mbps", type=float, default=100, help="link speed used for the estimated transfer time")
+    parser.add_argument("--streams", type=int, default=4)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "project")
+        make_project(src, args.dataset_mb, args.wheelhouse_mb)
+        total = tree_bytes(src)
+
+        def record(name, seconds, sent):
+            link = sent * 8 / (args.mbps * 1e6)
+            results.append({"mode": name, "seconds": round(seconds, 3), "bytes_sent": sent,
+                             f"est_seconds_at_{args.mbps:g}mbps": round(seconds + link, 1)})
+
+        with Timer() as t:
+            full_copy(src, os.path.join(tmp, "scp_target"))
+        record("scp -r (every deploy)", t.seconds, total)
+
+        target = Target(os.path.join(tmp, "delta_target"))
+        with Timer() as t:
+            report = deploy(target, src, streams=args.streams, install=False)
+        record("delta, first deploy", t.seconds, report["bytes_sent"])
+
+        with open(os.path.join(src, "scripts", "module_1.py"), "a") as f:
+            f.write("# edited\n")
+        with Timer() as t:
+            report = deploy(target, src, streams=args.streams, install=False)
+        record("delta, one file edited", t.seconds, report["bytes_sent"])
+
+        with Timer() as t:
+            report = deploy(target, src, streams=args.streams, install=False)
+        record("delta, nothing changed", t.seconds, report["bytes_sent"])
+
+    est = f"est_seconds_at_{args.mbps:g}mbps"
+    print(f"project: {total / 1e6:.1f} MB")
+    for r in results:
+        print(f"{r['mode']:>24}: {r['seconds']:7.3f}s locally, {r['bytes_sent'] / 1e6:8.2f} MB sent, "
+              f"~{r[est]}s at {args.mbps:g} Mbit/s")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""CPU benchmark for evaluation.py: held-out evaluation throughput with length-sorted,
+token-budgeted batches vs. one example per forward pass, and what evaluating every
+checkpoint costs a training run with eval_mode "process" and "inline" (at the
+default duty cycle) compared with no evaluation.
+
+    python scripts/bench_eval.py --records 600 --heldout 200
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import torch
+
+from bench_utils import Timer, synthetic_records, tiny_llama, tiny_tokenizer, write_jsonl
+import batch_tuner
+import train_lora
+from evaluation import evaluate, load_eval_dataset
+
+
+def train_run(name, config):
+    with Timer() as t:
+        train_lora.train(config)
+    with open(os.path.join(config["output_dir"], "profile.jsonl"), "r") as f:
+        windows = [json.loads(line) for line in f][1:]  # step 1 (warm-up) is its own window
+    seconds = sum(r["window_seconds"] for r in windows)
+    tokens = sum(r["window_tokens"] for r in windows)
+    evals = []
+    if config.get("eval_files"):
+        with open(os.path.join(config["output_dir"], "eval.jsonl"), "r") as f:
+            evals = [json.loads(line) for line in f]
+    return {"mode": name, "total_seconds": round(t.seconds, 2),
+            "train_tokens_per_second": round(tokens / seconds) if seconds else 0,
+            "evaluations": len(evals), "eval_steps": [r["step"] for r in evals],
+            "final_eval_loss": round(evals[-1]["loss"], 4) if evals else None}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=600)
+    parser.add_argument("--heldout", type=int, default=200)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--eval-batch-tokens", type=int, nargs="+", default=[2048, 8192])
+    parser.add_argument("--save-steps", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        batch_tuner.TUNING_CACHE_FILE = os.path.join(tmp, "batch_tuning.json")
+        model_dir = os.path.join(tmp, "model")
+        model = tiny_llama(hidden_size=args.hidden_size, layers=args.layers)
+        model.save_pretrained(model_dir)
+        tokenizer = tiny_tokenizer()
+        tokenizer.save_pretrained(model_dir)
+        data = write_jsonl(os.path.join(tmp, "train.jsonl"), synthetic_records(args.records, mean_words=30))
+        heldout = write_jsonl(os.path.join(tmp, "heldout.jsonl"), synthetic_records(args.heldout, seed=12345, mean_words=30))
+        cache_dir = os.path.join(tmp, "cache")
+
+        # Evaluation batching on its own.
+        dataset = load_eval_dataset([heldout], tokenizer, 1024, cache_dir)
+        evaluate(model, dataset, args.eval_batch_tokens[0], tokenizer.pad_token_id)  # warm-up
+        one_by_one = evaluate(model, dataset, 1, tokenizer.pad_token_id)  # a budget of 1 token: one example per batch
+        batched = {budget: evaluate(model, dataset, budget, tokenizer.pad_token_id) for budget in args.eval_batch_tokens}
+        for result in batched.values():
+            assert abs(one_by_one["loss"] - result["loss"]) < 1e-3, (one_by_one["loss"], result["loss"])
+
+        config = {
+            "model_name_or_path": model_dir, "data_files": [data], "cache_dir": cache_dir,
+            "pack_length": 512, "max_length": 512, "num_workers": 0, "max_batch_tokens": 2048,
+            "num_train_epochs": 2, "save_steps": args.save_steps, "logging_steps": 10**6, "profile_every": 1,
+            "resume_from_checkpoint": None, "eval_max_batch_tokens": args.eval_batch_tokens[0],
+        }
+        train_run("warmup", {**config, "output_dir": os.path.join(tmp, "warmup")})
+        runs = [train_run("no evaluation", {**config, "output_dir": os.path.join(tmp, "none")})]
+        for mode in ("process", "inline"):
+            runs.append(train_run(f"eval {mode}", {**config, "output_dir": os.path.join(tmp, mode),
+                                                   "eval_files": [heldout], "eval_mode": mode}))
+
+    for r in runs:
+        r["throughput_vs_no_eval"] = round(r["train_tokens_per_second"] / runs[0]["train_tokens_per_second"], 3)
+    print(f"evaluation of {one_by_one['examples']} held-out examples ({one_by_one['tokens']} response tokens): "
+          f"{one_by_one['tokens_per_second']:.0f} tok/s one example per forward; length-sorted batches: "
+          + ", ".join(f"{r['tokens_per_second']:.0f} tok/s at {budget} tokens "
+                      f"({r['tokens_per_second'] / one_by_one['tokens_per_second']:.2f}x)" for budget, r in batched.items()))
+    for r in runs:
+        print(f"{r['mode']:>15}: {r['train_tokens_per_second']:6d} training tokens/s "
+              f"({r['throughput_vs_no_eval']:.3f}x), {r['total_seconds']:6.2f}s total, "
+              f"{r['evaluations']} evaluations at steps {r['eval_steps']}, final eval loss {r['final_eval_loss']}")
+    print(json.dumps({"eval": {"one_by_one": one_by_one, "batched": batched}, "training": runs}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""CPU benchmark: throughput and latency of the /generate batch scheduler under concurrent
+load, on a tiny randomly initialized Llama. Compares max_batch_size=1 (no batching)
+against dynamic batching.
+
+    python scripts/bench_generate.py --concurrency 16 --requests 64
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import torch
+
+from bench_utils import INSTRUCTIONS, Timer, tiny_llama, tiny_tokenizer
+from serving import BatchScheduler, HFGenerationBackend, collect
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+async def load_test(scheduler, prompts, concurrency, max_new_tokens):
+    """Closed loop: `concurrency` clients each send their next prompt as soon as the last one finishes."""
+    latencies, completion_tokens = [], 0
+    queue = list(prompts)
+
+    async def client():
+        nonlocal completion_tokens
+        while queue:
+            prompt = queue.pop()
+            with Timer() as t:
+                result = await collect(await scheduler.submit(prompt, max_new_tokens=max_new_tokens))
+            latencies.append(t.seconds)
+            completion_tokens += result["completion_tokens"]
+
+    with Timer() as total:
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    return {
+        "requests": len(latencies),
+        "seconds": round(total.seconds, 3),
+        "requests_per_sec": round(len(latencies) / total.seconds, 2),
+        "tokens_per_sec": round(completion_tokens / total.seconds, 1),
+        "p50_latency_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_latency_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def run(max_batch_size, args, prompts):
+    tokenizer = tiny_tokenizer()
+    model = tiny_llama(hidden_size=args.hidden_size, layers=args.layers)
+    scheduler = BatchScheduler(lambda: HFGenerationBackend(model, tokenizer), max_batch_size=max_batch_size,
+                               max_wait_ms=args.max_wait_ms)
+
+    async def main():
+        await collect(await scheduler.submit("warmup", max_new_tokens=2))
+        return await load_test(scheduler, prompts, args.concurrency, args.max_new_tokens)
+
+    result = asyncio.run(main())
+    result["max_batch_size"] = max_batch_size
+    scheduler.executor.shutdown()
+    print(f"batch<={max_batch_size:3d}: {result['requests_per_sec']:7.2f} req/s  {result['tokens_per_sec']:8.1f} tok/s  "
+          f"p50 {result['p50_latency_ms']:8.1f}ms  p99 {result['p99_latency_ms']:8.1f}ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--hidden-size", type=int, default=128)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    rng = random.Random(0)
+    prompts = [f"{rng.choice(INSTRUCTIONS)} ({i})" for i in range(args.requests)]
+    results = [run(1, args, prompts), run(args.max_batch_size, args, prompts)]
+    results[1]["throughput_gain"] = round(results[1]["tokens_per_sec"] / results[0]["tokens_per_sec"], 2)
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""CPU benchmark for bulk_ingest.py and the bulk upload endpoint.
+
+1. Many small .json files through the API (dedup included): one
+   /upload-training-data request per file, compared with all of them in one
+   /upload-training-archive request, as a multipart batch or as a .tar.gz.
+2. Ingest throughput in records/s for each archive format, and with 0/1/2 worker
+   processes.
+3. Peak RSS of an ingest run as the archive grows. Each run is its own process,
+   so every peak is measured fresh. A flat line means memory does not depend on
+   archive size, so archives larger than RAM work too.
+
+    python scripts/bench_ingest.py --files 2000 --records 200000
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import zipfile
+
+from bench_utils import REPO_ROOT, Timer, synthetic_records
+
+INGEST = r"""
+import json, sys
+sys.path.insert(0, {repo!r})
+import bulk_ingest
+with open({path!r}, "rb") as f:
+    report = bulk_ingest.ingest([({name!r}, f)], {out!r}, "bench", workers={workers})
+# VmHWM, not ru_maxrss: on Linux ru_maxrss keeps the peak of the forked parent across exec.
+with open("/proc/self/status") as f:
+    peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+print(json.dumps({{"records_in": report["records_in"], "records_out": report["records_out"], "seconds": report["seconds"],
+                  "peak_rss_mb": peak_kb // 1024}}))
+"""
+
+
+def small_files(n):
+    """n small .json files of one to three records, like the ones uploaded through upload_form.html."""
+    records = synthetic_records(n * 2, mean_words=30)
+    return [(f"part-{i:05d}.json", json.dumps([next(records) for _ in range(1 + i % 3 // 2)]).encode()) for i in range(n)]
+
+
+def write_tar(path, members, mode="w:gz"):
+    with tarfile.open(path, mode) as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def jsonl_bytes(n, seed=0):
+    return b"".join(json.dumps(r).encode() + b"\n" for r in synthetic_records(n, seed=seed, mean_words=30))
+
+
+def run_ingest(path, out_dir, workers):
+    """One ingest in a fresh process; returns its report and peak RSS."""
+    code = INGEST.format(repo=REPO_ROOT, path=path, name=os.path.basename(path), out=out_dir, workers=workers)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def api_runs(tmp, files):
+    os.chdir(tmp)  # main.py keeps its uploads, dedup index and jobs under ./data
+    sys.path.insert(0, REPO_ROOT)
+    from fastapi.testclient import TestClient
+    import main
+
+    client = TestClient(main.app)
+    with Timer() as one_by_one:
+        for name, data in files:
+            client.post("/upload-training-data", files={"file": (name, data)}).raise_for_status()
+    with Timer() as multipart:
+        client.post("/upload-training-archive?name=multipart",
+                    files=[("files", (name, data)) for name, data in files]).raise_for_status()
+    archive = write_tar(os.path.join(tmp, "small.tar.gz"), files)
+    with Timer() as tar, open(archive, "rb") as f:
+        report = client.post("/upload-training-archive?name=tar", files=[("files", ("small.tar.gz", f))])
+        report.raise_for_status()
+    return {"files": len(files), "records": report.json()["records_in"], "one_by_one_seconds": round(one_by_one.seconds, 2),
+            "multipart_seconds": round(multipart.seconds, 2), "tar_gz_seconds": round(tar.seconds, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2000, help="small files for the API comparison")
+    parser.add_argument("--records", type=int, default=200_000, help="records for the throughput runs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 400_000, 1_600_000],
+                        help="records per archive for the memory runs")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = os.path.join(tmp, "out")
+        os.makedirs(out_dir)
+        api_dir = os.path.join(tmp, "api")
+        os.makedirs(api_dir)
+        api = api_runs(api_dir, small_files(args.files))
+
+        data = jsonl_bytes(args.records)
+        lines = data.splitlines(keepends=True)
+        members = [(f"shard-{i:03d}.jsonl", b"".join(lines[i::200])) for i in range(200)]
+        archives = {
+            "tar.gz of .jsonl": write_tar(os.path.join(tmp, "data.tar.gz"), members),
+            "plain tar of .jsonl": write_tar(os.path.join(tmp, "data.tar"), members, "w"),
+            "big .json list": os.path.join(tmp, "data.json"),
+        }
+        with open(archives["big .json list"], "w") as f:
+            json.dump([json.loads(line) for line in lines], f)
+        zip_path = os.path.join(tmp, "data.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as z:
+            for name, member in members:
+                z.writestr(name, member)
+        archives["zip of .jsonl"] = zip_path
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        if zstandard is not None:
+            raw = write_tar(os.path.join(tmp, "data.raw.tar"), members, "w")
+            with open(raw, "rb") as src, open(os.path.join(tmp, "data.tar.zst"), "wb") as dst:
+                zstandard.ZstdCompressor().copy_stream(src, dst)
+            archives["tar.zst of .jsonl"] = os.path.join(tmp, "data.tar.zst")
+
+        formats = {label: run_ingest(path, out_dir, 0) for label, path in archives.items()}
+        workers = {w: run_ingest(archives["tar.gz of .jsonl"], out_dir, w) for w in args.workers}
+
+        memory = []
+        for n in args.sizes:
+            path = os.path.join(tmp, f"memory-{n}.tar.gz")
+            size = 0
+            with tarfile.open(path, "w:gz") as tar:  # written in pieces, so the benchmark itself stays small
+                for i in range(0, n, 50_000):
+                    chunk = jsonl_bytes(min(50_000, n - i), seed=i)
+                    info = tarfile.TarInfo(f"part-{i // 50_000:04d}.jsonl")
+                    info.size = len(chunk)
+                    tar.addfile(info, io.BytesIO(chunk))
+                    size += len(chunk)
+            run = run_ingest(path, out_dir, 0)
+            run.update(records=n, uncompressed_mb=round(size / 2**20))
+            memory.append(run)
+            os.remove(path)
+
+    print(f"{api['files']} small files ({api['records']} records) through the API: "
+          f"one request per file {api['one_by_one_seconds']:.2f}s, one multipart request {api['multipart_seconds']:.2f}s "
+          f"({api['one_by_one_seconds'] / api['multipart_seconds']:.1f}x), one .tar.gz {api['tar_gz_seconds']:.2f}s "
+          f"({api['one_by_one_seconds'] / api['tar_gz_seconds']:.1f}x)")
+    for label, r in formats.items():
+        print(f"{label:>20}: {r['records_in'] / r['seconds']:8.0f} records/s ({r['records_in']} records, {r['seconds']:.2f}s)")
+    for w, r in workers.items():
+        print(f"{'tar.gz, ' + str(w) + ' workers':>20}: {r['records_in'] / r['seconds']:8.0f} records/s")
+    for r in memory:
+        print(f"{r['records']:>10} records ({r['uncompressed_mb']} MiB of JSONL): "
+              f"peak RSS {r['peak_rss_mb']} MiB, {r['records_in'] / r['seconds']:.0f} records/s")
+    print(json.dumps({"api": api, "formats": formats, "workers": workers, "memory": memory}))
+
+
+if __name__ == "__main__":
+    main()
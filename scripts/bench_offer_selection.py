@@ -0,0 +1,81 @@
+"""Offer selection against the local Vast stub: the original launcher (one GPU type,
+cheapest $/h first, one create at a time) vs. parallel multi-GPU search, ranking by
+$ per training token and racing creates. The cheapest offers by either measure are
+made to answer "GPU conflict", as popular offers often do.
+
+    python scripts/bench_offer_selection.py --create-latency 1.0 --search-latency 0.3
+"""
+import argparse
+import asyncio
+import json
+
+from bench_utils import Timer
+from offer_selection import OfferCache, gpu_query, rank_offers, race_create, search_gpu_types
+from vast_client import VastAPIError, VastClient
+from vast_stub import VastStub
+
+GPU_TYPES = ["RTX 6000Ada", "RTX 4090", "A100 SXM4", "L40S"]
+PAYLOAD = {"client_id": "me", "image": "pytorch/pytorch:latest", "disk": 50}
+# Per-GPU training tokens/sec as our own runs would have recorded them (L40S never measured).
+THROUGHPUT = {
+    "rtx6000ada": {"gpu_name": "RTX 6000Ada", "tokens_per_sec": 5200.0, "runs": 3},
+    "rtx4090": {"gpu_name": "RTX 4090", "tokens_per_sec": 3900.0, "runs": 2},
+    "a100": {"gpu_name": "A100 SXM4", "tokens_per_sec": 7400.0, "runs": 1},
+}
+
+
+async def legacy(vast):
+    offers = await vast.search_offers(gpu_query(GPU_TYPES[0], 1, 50))
+    offers.sort(key=lambda x: x.get("dph_total", float("inf")))
+    for offer in offers[:5]:
+        try:
+            return offer, await vast.create_instance(offer["id"], PAYLOAD)
+        except VastAPIError:
+            continue
+    return None, None
+
+
+async def selection(vast):
+    offers = await search_gpu_types(vast, GPU_TYPES, 1, 50, cache=OfferCache(path=None))
+    return await race_create(vast, rank_offers(offers, THROUGHPUT), PAYLOAD, parallel=3)
+
+
+def run(name, strategy, args):
+    with VastStub(search_latency=args.search_latency, create_latency=args.create_latency,
+                  conflict_offers=args.conflict_offers) as stub:
+        async def main():
+            async with VastClient("x", base_url=stub.api_url) as vast:
+                with Timer() as t:
+                    offer, instance_id = await strategy(vast)
+                return offer, instance_id, t.seconds
+        offer, instance_id, seconds = asyncio.run(main())
+        rank_offers([offer], THROUGHPUT)
+        result = {
+            "mode": name,
+            "seconds_to_acquire": round(seconds, 2),
+            "offer": offer["id"],
+            "gpu": offer["gpu_name"],
+            "dph_total": offer["dph_total"],
+            "usd_per_mtok": round(offer["usd_per_mtok"], 4),
+            "instances_left": len([i for i in stub.instances.values() if i["offer_id"]]),
+            "create_calls": stub.stats["by_path"].get("PUT /api/v0/asks/<id>/", 0),
+        }
+    print(f"{name:>9}: {result['seconds_to_acquire']:5.2f}s  offer {result['offer']} ({result['gpu']}, "
+          f"${result['dph_total']}/h, ${result['usd_per_mtok']}/Mtok)  {result['create_calls']} creates, "
+          f"{result['instances_left']} instance(s) left running")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--create-latency", type=float, default=1.0)
+    parser.add_argument("--conflict-offers", type=lambda v: [int(x) for x in v.split(",") if x], default=[1004, 1002],
+                        help="offers that are already taken (default: the best by $/token and the best by $/h)")
+    args = parser.parse_args()
+    results = [run("legacy", legacy, args), run("selection", selection, args)]
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""CPU benchmark: effective (non-pad) training tokens/sec for the original pad-to-128,
+batch-size-1 SimpleDataset path vs. token-budget bucketing vs. sequence packing.
+
+    python scripts/bench_packing.py --examples 512 --max-batch-tokens 1024
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import torch
+from torch.utils.data import DataLoader
+from peft import LoraConfig, get_peft_model
+
+from bench_utils import Timer, synthetic_records, tiny_llama, tiny_tokenizer, write_jsonl
+from dataset_shards import TokenizedShardDataset, make_pad_collator, prepare_dataset
+from packing import PackedDataset, TokenBudgetBatchSampler, make_packed_collator
+
+
+class SimpleDataset(torch.utils.data.Dataset):
+    """The original train_lora.py dataset: tokenize on every access, pad to max_length."""
+
+    def __init__(self, data, tokenizer, max_length):
+        self.data = data
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        item = self.data[idx]
+        text = item["instruction"] + " " + item["output"]
+        encoding = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=self.max_length, padding="max_length")
+        encoding = {k: v.squeeze(0) for k, v in encoding.items()}
+        encoding["labels"] = encoding["input_ids"].masked_fill(encoding["attention_mask"] == 0, -100)
+        return encoding
+
+
+def run(name, model, dataloader, pad_token_id):
+    """One pass over the data; returns tokens/sec counting only real tokens."""
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=2e-4)
+    model.train()
+    real_tokens = total_tokens = steps = 0
+    with Timer() as t:
+        for batch in dataloader:
+            loss = model(**batch).loss
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            total_tokens += batch["input_ids"].numel()
+            real_tokens += int((batch["input_ids"] != pad_token_id).sum())
+            steps += 1
+    result = {
+        "mode": name,
+        "steps": steps,
+        "seconds": round(t.seconds, 3),
+        "real_tokens": real_tokens,
+        "padding_ratio": round(1 - real_tokens / max(total_tokens, 1), 4),
+        "effective_tokens_per_sec": round(real_tokens / t.seconds, 1),
+    }
+    print(f"{name:>10}: {steps:5d} steps {t.seconds:7.2f}s  pad {result['padding_ratio']:.1%}  "
+          f"{result['effective_tokens_per_sec']:9.1f} real tok/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--examples", type=int, default=512)
+    parser.add_argument("--max-length", type=int, default=128)
+    parser.add_argument("--max-batch-tokens", type=int, default=1024)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    tokenizer = tiny_tokenizer()
+    pad_token_id = tokenizer.pad_token_id
+    records = list(synthetic_records(args.examples))
+    lora_config = LoraConfig(r=8, lora_alpha=32, target_modules=["q_proj", "v_proj"], lora_dropout=0.1, bias="none")
+
+    def fresh_model():
+        return get_peft_model(tiny_llama(max_positions=args.max_length), lora_config)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = write_jsonl(os.path.join(tmp, "train.jsonl"), records)
+        shards = TokenizedShardDataset(prepare_dataset([data_path], tokenizer, args.max_length, cache_dir=os.path.join(tmp, "cache")))
+
+        results = [run("simple", fresh_model(), DataLoader(SimpleDataset(records, tokenizer, args.max_length), batch_size=1), pad_token_id)]
+
+        sampler = TokenBudgetBatchSampler(shards.lengths(), args.max_batch_tokens)
+        results.append(run("bucketed", fresh_model(), DataLoader(shards, batch_sampler=sampler, collate_fn=make_pad_collator(pad_token_id)), pad_token_id))
+
+        packed = PackedDataset(shards, args.max_length)
+        sampler = TokenBudgetBatchSampler(packed.lengths(), args.max_batch_tokens)
+        results.append(run("packed", fresh_model(), DataLoader(packed, batch_sampler=sampler, collate_fn=make_packed_collator(pad_token_id)), pad_token_id))
+
+    baseline = results[0]["effective_tokens_per_sec"]
+    for r in results:
+        r["speedup_vs_simple"] = round(r["effective_tokens_per_sec"] / baseline, 2)
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
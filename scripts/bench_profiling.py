@@ -0,0 +1,63 @@
+"""CPU benchmark: cost of leaving the step profiler on. Trains the same tiny run with
+profiling off, sampled every 10th step (the default) and on every step, and prints
+where a step's time goes according to the profile.
+
+    python scripts/bench_profiling.py --steps 60 --hidden-size 256
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import torch
+
+from bench_utils import Timer, synthetic_records, tiny_llama, tiny_tokenizer, write_jsonl
+import train_lora
+
+
+def run(name, config):
+    with Timer() as t:
+        train_lora.train(config)
+    result = {"mode": name, "total_seconds": round(t.seconds, 2)}
+    path = os.path.join(config["output_dir"], "profile.jsonl")
+    if config["profile_every"] and os.path.exists(path):
+        with open(path, "r") as f:
+            records = [json.loads(line) for line in f]
+        sampled = [r for r in records if r["sampled"]][1:]  # step 1 includes warm-up
+        result["records"] = len(records)
+        result["avg_phase_ms"] = {p: round(sum(r["phases"][p] for r in sampled) / len(sampled) * 1000, 2)
+                                  for p in sampled[0]["phases"]}
+        result["tokens_per_second"] = round(records[-1]["tokens_per_second"])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=60)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "model")
+        tiny_llama(hidden_size=args.hidden_size, layers=args.layers).save_pretrained(model_dir)
+        tiny_tokenizer().save_pretrained(model_dir)
+        data = write_jsonl(os.path.join(tmp, "data.jsonl"), synthetic_records(args.steps * 4, mean_words=10))
+        config = {
+            "model_name_or_path": model_dir, "data_files": [data], "cache_dir": os.path.join(tmp, "cache"),
+            "pack_length": 256, "max_length": 256, "max_batch_tokens": 256, "num_workers": 0,
+            "save_steps": 25, "logging_steps": 1000, "resume_from_checkpoint": None,
+        }
+        run("warmup", {**config, "profile_every": 0, "output_dir": os.path.join(tmp, "warmup")})
+        results = [run(name, {**config, "profile_every": every, "output_dir": os.path.join(tmp, name)})
+                   for name, every in (("off", 0), ("every10", 10), ("every1", 1))]
+    for r in results:
+        r["overhead_pct"] = round((r["total_seconds"] / results[0]["total_seconds"] - 1) * 100, 1)
+        print(f"{r['mode']:>8}: {r['total_seconds']:6.2f}s ({r['overhead_pct']:+.1f}%)  {r.get('avg_phase_ms', '')}")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
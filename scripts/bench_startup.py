@@ -0,0 +1,137 @@
+"""Worker startup on one host: several serving workers each load the same model, the
+way uvicorn --workers N does. Compares the old load (AutoTokenizer + from_pretrained
+at backend creation), with serving.load_backend (memory-mapped weights, tokenizer
+on first use) and with serve.py (workers forked from a parent that preloaded the
+model). Reports per-worker time to a loaded model and to the first forward pass,
+the time until every worker is ready, the startup breakdown, and memory once every
+worker is up: RSS counts shared pages in full in every worker that touched them, PSS
+splits them between the workers.
+
+    python scripts/bench_startup.py --workers 3 --hidden-size 1024 --layers 12
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench_utils import REPO_ROOT, tiny_llama, tiny_tokenizer
+from model_loading import StartupTimer
+
+WORKER = r"""
+import json, os, sys, time
+sys.path.insert(0, {repo!r})
+mode, model_dir = {mode!r}, {model_dir!r}
+
+
+def worker(start):
+    import main  # what a uvicorn worker imports
+    imported = time.perf_counter() - start
+    if mode == "from_pretrained":
+        from model_loading import StartupTimer
+        timer = StartupTimer()
+        with timer.phase("imports"):
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+        with timer.phase("tokenizer"):
+            tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        with timer.phase("weights"):
+            model = AutoModelForCausalLM.from_pretrained(model_dir, device_map="auto")
+    else:
+        from serving import load_backend
+        backend = load_backend(model_dir, adapter_dir="", adapter_root=model_dir + "/no-adapters")
+        model, tokenizer, timer = backend.model, backend.tokenizer, backend.startup
+    loaded = time.perf_counter() - start
+    import torch
+    with torch.inference_mode():
+        model(input_ids=torch.tensor([tokenizer("What is spiritual awakening?")["input_ids"]]))
+    first = time.perf_counter() - start
+    result = {{"pid": os.getpid(), "import_main_seconds": round(imported, 2), "loaded_seconds": round(loaded, 2),
+              "first_forward_seconds": round(first, 2), "phases": timer.report()["phases"]}}
+    sys.stdout.flush()
+    os.write(1, (json.dumps(result) + "\n").encode())  # one write: forked workers share the pipe
+    sys.stdin.read()  # stay up until every worker has been measured
+
+
+if mode == "prefork":  # serve.py: preload once, then fork the workers
+    start = time.perf_counter()
+    import serving
+    serving.preload_model(model_dir, "")
+    print(json.dumps({{"preload_seconds": round(time.perf_counter() - start, 2)}}), flush=True)
+    for _ in range({workers}):
+        if os.fork() == 0:
+            worker(time.perf_counter())
+            os._exit(0)
+    for _ in range({workers}):
+        os.wait()
+else:
+    worker(time.perf_counter())
+"""
+
+
+def process_memory(pid):
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        fields = {line.split(":")[0]: int(line.split()[1]) for line in f.read().splitlines()[1:]}
+    return {"rss_mb": fields["Rss"] // 1024, "pss_mb": fields["Pss"] // 1024,
+            "private_mb": (fields["Private_Clean"] + fields["Private_Dirty"]) // 1024}
+
+
+def run_workers(mode, model_dir, n):
+    """Starts n workers at once; returns (preload seconds, one result per worker measured while all are up)."""
+    env = {**os.environ, "AKASHA_PREFIX_CACHE_MB": "0", "TRANSFORMERS_VERBOSITY": "error"}
+    code = WORKER.format(repo=REPO_ROOT, mode=mode, model_dir=model_dir, workers=n)
+    launches = 1 if mode == "prefork" else n
+    processes = [subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL, text=True, cwd=tempfile.gettempdir(), env=env)
+                 for _ in range(launches)]
+    lines = []
+    for process in processes:
+        for _ in range(n + 1 if mode == "prefork" else 1):  # prefork: the preload line, then one per worker
+            lines.append(json.loads(next(line for line in process.stdout if line.startswith("{"))))
+    preload = lines.pop(0)["preload_seconds"] if mode == "prefork" else 0.0
+    for result in lines:
+        result.update(process_memory(result["pid"]))
+    for process in processes:
+        process.communicate("")
+    return preload, lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--hidden-size", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=12)
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "model")
+        tiny_llama(hidden_size=args.hidden_size, layers=args.layers, vocab_size=args.vocab_size).save_pretrained(model_dir)
+        tiny_tokenizer().save_pretrained(model_dir)
+        weights_mb = os.path.getsize(os.path.join(model_dir, "model.safetensors")) / 2**20
+        run_workers("mmap", model_dir, 1)  # warm the page cache and the import caches
+        summary = {}
+        for mode in ("from_pretrained", "mmap", "prefork"):
+            preload, results = run_workers(mode, model_dir, args.workers)
+            summary[mode] = {key: round(sum(r[key] for r in results) / len(results), 2)
+                             for key in ("import_main_seconds", "loaded_seconds", "first_forward_seconds",
+                                         "rss_mb", "pss_mb", "private_mb")}
+            summary[mode]["total_pss_mb"] = sum(r["pss_mb"] for r in results)
+            summary[mode]["preload_seconds"] = preload
+            summary[mode]["all_ready_seconds"] = round(preload + max(r["loaded_seconds"] for r in results), 2)
+            summary[mode]["phases"] = results[0]["phases"]
+
+    print(f"{args.workers} workers, {weights_mb:.0f} MiB of weights each:")
+    for mode, s in summary.items():
+        timer = StartupTimer()
+        timer.phases = s["phases"]
+        preload = f"preload {s['preload_seconds']:.2f}s once, then " if s["preload_seconds"] else ""
+        print(f"{mode:>16}: {preload}loaded after {s['loaded_seconds']:.2f}s (import main {s['import_main_seconds']:.2f}s, "
+              f"model {timer.summary()}), first forward at {s['first_forward_seconds']:.2f}s; "
+              f"per worker RSS {s['rss_mb']:.0f} MiB, PSS {s['pss_mb']:.0f} MiB, private {s['private_mb']:.0f} MiB; "
+              f"all workers ready after {s['all_ready_seconds']:.2f}s with PSS {s['total_pss_mb']} MiB")
+    print(json.dumps({"workers": args.workers, "weights_mb": round(weights_mb), **summary}))
+
+
+if __name__ == "__main__":
+    main()
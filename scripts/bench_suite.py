@@ -0,0 +1,368 @@
+"""End-to-end CPU benchmark of the upload -> preprocess -> train -> serve pipeline, plus the
+Vast launcher against the local stub (scripts/vast_stub.py).
+
+Every stage runs on synthetic instruction data (--records of it) and a tiny random
+Llama, so the whole suite takes a few minutes on a laptop and needs no network:
+- upload: the FastAPI app in main.py (one file, resumable chunks, a bulk .tar.gz), dedup included;
+- preprocess: tokenizing into shards, then a full pass of the training DataLoader;
+- train: scripts/train_lora.py, steps and tokens per second from its step profile;
+- serve: load_backend on the trained adapter, then one request at a time and concurrent load;
+- launcher: launch_vast_instance.main() end to end against the stub.
+
+Short measurements are repeated (--repeat) and the best one is kept: on a shared
+machine noise only ever makes a run slower. The report is one JSON object; every
+metric has a unit, and units per second are better higher, all others lower. It is
+compared metric by metric with a stored baseline (scripts/bench_baseline.json): a
+metric worse by more than --tolerance (or its own tolerance, stored in the baseline
+for the noisiest metrics), and by more than the absolute slack for its unit, is a
+regression, and any regression makes the exit status 1.
+
+    python scripts/bench_suite.py                          # compare with the stored baseline
+    python scripts/bench_suite.py --stages upload serve    # a subset (only those metrics are compared)
+    python scripts/bench_suite.py --update-baseline        # after an intended change, on the reference machine
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tarfile
+import tempfile
+import time
+
+import torch
+
+from bench_utils import INSTRUCTIONS, REPO_ROOT, Timer, synthetic_records, tiny_llama, tiny_tokenizer, write_jsonl
+
+STAGES = ["upload", "preprocess", "train", "serve", "launcher"]
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "scripts", "bench_baseline.json")
+CHUNK = 1024 * 1024
+MIN_SECONDS = 1.0  # measurements shorter than this are repeated within one timing
+# Changes smaller than this never count as regressions: a 10ms load taking 16ms is noise.
+ABSOLUTE_SLACK = {"s": 0.05, "ms": 5.0}
+# Wider tolerances, written into the baseline with the values. Millisecond-scale CPU work
+# swings by a third between runs on a shared 1-CPU machine, whatever the code does.
+METRIC_TOLERANCE = {"upload_bulk_records_per_second": 0.5, "tokenize_tokens_per_second": 0.5,
+                    "dataloader_batches_per_second": 0.5, "dataloader_tokens_per_second": 0.5}
+LOAD_ROUNDS = 7  # dataloader timings; the median is kept
+
+
+class Suite:
+    """Shared state of one run: config, scratch directory, and the metrics collected so far."""
+
+    def __init__(self, args, tmp):
+        self.args = args
+        self.tmp = tmp
+        self.metrics = {}
+        self.model_dir = os.path.join(tmp, "model")
+        self.adapter_dir = os.path.join(tmp, "adapter")
+        self.tokenizer = tiny_tokenizer()
+
+    def record(self, name, value, unit):
+        self.metrics[name] = {"value": round(value, 4), "unit": unit}
+        if name in METRIC_TOLERANCE:
+            self.metrics[name]["tolerance"] = METRIC_TOLERANCE[name]
+
+    def path(self, *parts):
+        return os.path.join(self.tmp, *parts)
+
+    def base_model(self):
+        if not os.path.exists(self.model_dir):
+            tiny_llama(hidden_size=self.args.hidden_size, layers=self.args.layers).save_pretrained(self.model_dir)
+            self.tokenizer.save_pretrained(self.model_dir)
+        return self.model_dir
+
+
+def higher_is_better(unit):
+    return unit.endswith("/s")
+
+
+def best_of(repeat, run):
+    """The shortest of `repeat` timings; run(i) does the i-th repetition and returns its seconds."""
+    return min(run(i) for i in range(repeat))
+
+
+def stage_upload(suite):
+    api_dir = suite.path("api")
+    os.makedirs(api_dir)
+    cwd = os.getcwd()
+    os.chdir(api_dir)  # main.py keeps uploads, the dedup index and jobs under ./data
+    try:
+        _upload_benchmarks(suite)
+    finally:  # restored even when a benchmark fails, so later stages run where they started
+        os.chdir(cwd)
+
+
+def _upload_benchmarks(suite):
+    n = suite.args.records
+    from fastapi.testclient import TestClient
+    import main
+
+    client = TestClient(main.app)
+    client.post("/upload-training-data", files={"file": ("warmup.jsonl", b"")}).raise_for_status()
+    sizes = {}
+
+    def single(i):
+        path = write_jsonl(suite.path(f"single-{i}.jsonl"), synthetic_records(n, seed=100 + i))
+        sizes["single"] = os.path.getsize(path)
+        with Timer() as t, open(path, "rb") as f:
+            client.post("/upload-training-data", files={"file": (os.path.basename(path), f)}).raise_for_status()
+        return t.seconds
+
+    def resumable(i):
+        path = write_jsonl(suite.path(f"resumable-{i}.jsonl"), synthetic_records(n, seed=200 + i))
+        size = sizes["resumable"] = os.path.getsize(path)
+        with Timer() as t, open(path, "rb") as f:
+            upload = client.post("/uploads", json={"filename": os.path.basename(path), "total_size": size}).json()
+            offset = 0
+            while chunk := f.read(CHUNK):
+                response = client.put(f"/uploads/{upload['upload_id']}?offset={offset}", content=chunk)
+                response.raise_for_status()
+                offset = response.json()["offset"]
+            client.post(f"/uploads/{upload['upload_id']}/complete").raise_for_status()
+        return t.seconds
+
+    def bulk(i):
+        records = list(synthetic_records(n, seed=300 + i))
+        archive = suite.path(f"bulk-{i}.tar.gz")
+        with tarfile.open(archive, "w:gz") as tar:  # many small .json files, the way users upload them
+            for j in range(0, n, 10):
+                data = json.dumps(records[j:j + 10]).encode()
+                info = tarfile.TarInfo(f"part-{j // 10:05d}.json")
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        with Timer() as t, open(archive, "rb") as f:
+            response = client.post(f"/upload-training-archive?name=bulk-{i}", files=[("files", ("bulk.tar.gz", f))])
+            response.raise_for_status()
+        assert response.json()["records_out"] == n, response.json()
+        return t.seconds
+
+    seconds = best_of(suite.args.repeat, single)
+    suite.record("upload_single_mb_per_second", sizes["single"] / 2**20 / seconds, "MiB/s")
+    suite.record("upload_single_records_per_second", n / seconds, "records/s")
+    seconds = best_of(suite.args.repeat, resumable)
+    suite.record("upload_resumable_mb_per_second", sizes["resumable"] / 2**20 / seconds, "MiB/s")
+    suite.record("upload_bulk_records_per_second", n / best_of(suite.args.repeat, bulk), "records/s")
+
+
+def stage_preprocess(suite):
+    import train_lora
+    from packing import TokenBudgetBatchSampler
+    from torch.utils.data import DataLoader
+
+    data = write_jsonl(suite.path("preprocess.jsonl"), synthetic_records(suite.args.records, seed=4))
+    config = {**train_lora.DEFAULT_CONFIG, "data_files": [data], "max_length": 512, "pack_length": 512}
+
+    def tokenize(i):
+        with Timer() as t:
+            train_lora.build_dataset({**config, "cache_dir": suite.path(f"tokenized-{i}")}, suite.tokenizer)
+        return t.seconds
+
+    seconds = best_of(suite.args.repeat, tokenize)
+    config["cache_dir"] = suite.path("tokenized-0")
+    dataset, collator = train_lora.build_dataset(config, suite.tokenizer)
+    suite.record("tokenize_tokens_per_second", int(dataset.lengths().sum()) / seconds, "tokens/s")
+
+    def cached(i):
+        with Timer() as t:
+            train_lora.build_dataset(config, suite.tokenizer)
+        return t.seconds
+
+    suite.record("tokenize_cached_seconds", best_of(suite.args.repeat, cached), "s")
+
+    sampler = TokenBudgetBatchSampler(dataset.lengths(), suite.args.max_batch_tokens, seed=0)
+    loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collator, num_workers=0)
+
+    epoch = {"batches": 0, "tokens": 0}
+    for batch in loader:
+        epoch["batches"] += 1
+        epoch["tokens"] += batch["input_ids"].numel()
+
+    def load(i):  # seconds per epoch, over whole epochs for at least MIN_SECONDS: one takes a few milliseconds
+        epochs = 0
+        with Timer() as t:
+            while time.perf_counter() - t.start < MIN_SECONDS:
+                for _ in loader:
+                    pass
+                epochs += 1
+        return t.seconds / epochs
+
+    # The median of several rounds: a slow spell of the machine lasts longer than one round, so best-of would
+    # just report whether the run happened to catch a quiet second.
+    seconds = statistics.median(load(i) for i in range(max(LOAD_ROUNDS, suite.args.repeat)))
+    suite.record("dataloader_batches_per_second", epoch["batches"] / seconds, "batches/s")
+    suite.record("dataloader_tokens_per_second", epoch["tokens"] / seconds, "tokens/s")
+
+
+def stage_train(suite):
+    import batch_tuner
+    import train_lora
+
+    batch_tuner.TUNING_CACHE_FILE = suite.path("batch_tuning.json")
+    data = write_jsonl(suite.path("train.jsonl"), synthetic_records(suite.args.train_records, seed=5, mean_words=30))
+    config = {"model_name_or_path": suite.base_model(), "data_files": [data], "output_dir": suite.adapter_dir,
+              "cache_dir": suite.path("tokenized"), "max_length": 512, "pack_length": 512, "num_workers": 0,
+              "max_batch_tokens": suite.args.max_batch_tokens, "num_train_epochs": 1, "save_steps": 10**6,
+              "logging_steps": 10**6, "profile_every": 1, "resume_from_checkpoint": None}
+    with Timer() as t:
+        train_lora.train(config)
+    with open(os.path.join(suite.adapter_dir, "profile.jsonl"), "r") as f:
+        windows = [json.loads(line) for line in f][1:]  # step 1 (warm-up) is its own window
+    seconds = sum(r["window_seconds"] for r in windows)
+    suite.record("train_steps_per_second", sum(r["window_steps"] for r in windows) / seconds, "steps/s")
+    suite.record("train_tokens_per_second", sum(r["window_tokens"] for r in windows) / seconds, "tokens/s")
+    suite.record("train_wall_seconds", t.seconds, "s")
+
+
+def stage_serve(suite):
+    from bench_generate import load_test, percentile
+    from serving import BatchScheduler, collect, load_backend
+
+    if not os.path.exists(os.path.join(suite.adapter_dir, "adapter_config.json")):
+        stage_train(suite)  # serve what the train stage produced
+    with Timer() as t:
+        backend = load_backend(suite.base_model(), adapter_dir=suite.adapter_dir, adapter_root=suite.path("adapters"),
+                               cpu_model_dir="")
+    suite.record("serve_load_seconds", t.seconds, "s")  # once: a second load would find the files in the page cache
+    rng = random.Random(0)
+    prompts = [f"{rng.choice(INSTRUCTIONS)} ({i})" for i in range(suite.args.requests)]
+    new_tokens = suite.args.max_new_tokens
+
+    async def run():
+        scheduler = BatchScheduler(lambda: backend)
+        await collect(await scheduler.submit("warmup", max_new_tokens=2))
+        latencies = []
+        for prompt in prompts[:16]:
+            with Timer() as request:
+                await collect(await scheduler.submit(prompt + " (single)", max_new_tokens=new_tokens))
+            latencies.append(request.seconds)
+        loads = []
+        for i in range(suite.args.repeat):  # fresh prompts each round, like new traffic
+            loads.append(await load_test(scheduler, [f"{p} [{i}]" for p in prompts], suite.args.concurrency, new_tokens))
+        scheduler.executor.shutdown()
+        return latencies, loads
+
+    latencies, loads = asyncio.run(run())
+    suite.record("generate_single_p50_ms", percentile(latencies, 50) * 1000, "ms")
+    suite.record("generate_concurrent_tokens_per_second", max(r["tokens_per_sec"] for r in loads), "tokens/s")
+    suite.record("generate_concurrent_p50_ms", min(r["p50_latency_ms"] for r in loads), "ms")
+
+
+def stage_launcher(suite):
+    import bootstrap
+    import launch_vast_instance as launcher
+    from offer_selection import OfferCache
+    from vast_client import VastClient
+    from vast_stub import VastStub
+
+    with VastStub(boot_seconds=suite.args.boot_seconds, health_delay=suite.args.health_delay,
+                  filler_instances=20) as stub:
+        launcher.VAST_API_KEY = "bench"
+        launcher.VastClient = functools.partial(VastClient, base_url=stub.api_url)
+        launcher.OfferCache = functools.partial(OfferCache, path=None)
+        # The source bundle is built for real; the wheelhouse would need PyPI.
+        launcher.build_bundle = functools.partial(bootstrap.build_bundle, out_dir=suite.path("bundles"), wheelhouse=False)
+        with Timer() as t, contextlib.redirect_stdout(io.StringIO()) as output:
+            instance_id = asyncio.run(launcher.main())
+        if instance_id is None:
+            raise RuntimeError("launcher did not get a ready instance:\n" + output.getvalue())
+        suite.record("launcher_seconds_to_ready", t.seconds, "s")
+        suite.record("launcher_api_requests", stub.stats["requests"], "requests")
+
+
+def compare(metrics, baseline, tolerance):
+    """One row per metric: (name, baseline value, value, change, status); status REGRESSION fails the run."""
+    rows = []
+    for name, m in metrics.items():
+        base = baseline["metrics"].get(name)
+        if base is None:
+            rows.append((name, None, m["value"], None, "new"))
+            continue
+        change = m["value"] / base["value"] - 1 if base["value"] else 0.0
+        worse = -change if higher_is_better(m["unit"]) else change
+        if abs(m["value"] - base["value"]) <= ABSOLUTE_SLACK.get(m["unit"], 0.0):
+            worse = 0.0
+        allowed = base.get("tolerance", tolerance)
+        status = "REGRESSION" if worse > allowed else "improved" if worse < -allowed else "ok"
+        rows.append((name, base["value"], m["value"], change, status))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end CPU benchmark with a stored baseline.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--records", type=int, default=5000, help="records per upload and for preprocessing")
+    parser.add_argument("--train-records", type=int, default=300)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--max-batch-tokens", type=int, default=2048)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--boot-seconds", type=float, default=2.0)
+    parser.add_argument("--health-delay", type=float, default=1.0)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of each short measurement; the best is kept")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative change for the worse")
+    parser.add_argument("--update-baseline", action="store_true", help="write this run as the new baseline")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+    os.environ.setdefault("TRANSFORMERS_VERBOSITY", "error")
+
+    config = {k: v for k, v in vars(args).items()
+              if k not in ("stages", "baseline", "tolerance", "update_baseline", "output")}
+    report = {"config": config, "machine": {"python": platform.python_version(), "torch": torch.__version__,
+                                            "cpus": os.cpu_count(), "platform": platform.platform()}}
+    with tempfile.TemporaryDirectory() as tmp:
+        suite = Suite(args, tmp)
+        for stage in STAGES:
+            if stage in args.stages:
+                with Timer() as t:
+                    globals()[f"stage_{stage}"](suite)
+                print(f"stage {stage} done in {t.seconds:.1f}s", file=sys.stderr, flush=True)
+    report["metrics"] = suite.metrics
+
+    status = 0
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Wrote baseline {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            changed = sorted(k for k in config if baseline["config"].get(k) != config[k])
+            print(f"Config differs from the baseline in {changed}; not comparing (use --update-baseline).")
+            status = 2
+        else:
+            rows = compare(report["metrics"], baseline, args.tolerance)
+            report["comparison"] = [dict(zip(("metric", "baseline", "value", "change", "status"), r)) for r in rows]
+            for name, base, value, change, row_status in rows:
+                delta = f"{change:+7.1%}" if change is not None else "    new"
+                print(f"{name:>40}: {value:12.2f} {report['metrics'][name]['unit']:<10} "
+                      f"baseline {base if base is not None else '-':>12}  {delta}  {row_status}")
+            regressions = [r[0] for r in rows if r[4] == "REGRESSION"]
+            if regressions:
+                print(f"\nREGRESSION: {len(regressions)} metric(s) worse than the baseline by more than "
+                      f"their tolerance (default {args.tolerance:.0%}): {', '.join(regressions)}")
+                status = 1
+    else:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to store one.")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report))
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
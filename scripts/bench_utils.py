@@ -0,0 +1,84 @@
+"""Helpers shared by the CPU benchmarks: a tiny random Llama, a tokenizer that needs
+no downloads, and synthetic instruction data shaped like data/sample_training_data.json."""
+import json
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+INSTRUCTIONS = [
+    "What is spiritual awakening?",
+    "How can I find my life purpose?",
+    "What does it mean to be present?",
+    "How do I quiet an anxious mind?",
+    "Why do old patterns keep repeating?",
+    "What is the role of intuition?",
+]
+WORDS = ("awareness soul purpose ego desire presence breath heart light remember "
+         "alignment energy trust silence journey truth healing growth").split()
+
+
+def tiny_tokenizer():
+    """Character-level fast tokenizer (printable ASCII); good enough to exercise the data path."""
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2, "<pad>": 3}
+    vocab.update({chr(i): i for i in range(32, 127)})
+    tok = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tok.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tok.post_processor = processors.TemplateProcessing(single="<s> $A", special_tokens=[("<s>", 1)])
+    return PreTrainedTokenizerFast(tokenizer_object=tok, bos_token="<s>", eos_token="</s>",
+                                   unk_token="<unk>", pad_token="<pad>", name_or_path="tiny-char")
+
+
+def tiny_llama_config(vocab_size=128,  # covers every id tiny_tokenizer() emits
+                       hidden_size=64, layers=2, heads=4, max_positions=2048):
+    from transformers import LlamaConfig
+
+    return LlamaConfig(vocab_size=vocab_size, hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+                       num_hidden_layers=layers, num_attention_heads=heads, num_key_value_heads=heads,
+                       max_position_embeddings=max_positions, pad_token_id=3, bos_token_id=1, eos_token_id=2)
+
+
+def tiny_llama(seed=0, **config_kwargs):
+    """Randomly initialized LlamaForCausalLM small enough to train on a laptop CPU."""
+    import torch
+    from transformers import LlamaForCausalLM
+
+    torch.manual_seed(seed)
+    return LlamaForCausalLM(tiny_llama_config(**config_kwargs))
+
+
+def synthetic_records(n, seed=0, mean_words=40):
+    """Instruction/input/output records with a long-tailed output length, like real chat data."""
+    rng = random.Random(seed)
+    for i in range(n):
+        words = max(1, int(rng.expovariate(1.0 / mean_words)))
+        yield {
+            "instruction": f"{rng.choice(INSTRUCTIONS)} ({i})",
+            "input": "",
+            "output": " ".join(rng.choice(WORDS) for _ in range(words)) + ".",
+        }
+
+
+def write_jsonl(path, records):
+    with open(path, "w") as f:
+        for r in records:
+            f.write(json.dumps(r) + "\n")
+    return path
+
+
+class Timer:
+    """with Timer() as t: ...; t.seconds"""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
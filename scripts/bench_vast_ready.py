@@ -0,0 +1,81 @@
+"""Time-to-ready against the local Vast stub: the original launcher's polling (fresh
+connection per call, full instance list, 15s initial sleep, 20s polls, 30s health
+retries) vs. VastClient.wait_until_ready.
+
+    python scripts/bench_vast_ready.py --boot-seconds 5 --health-delay 3 --fail-rate 0.1
+"""
+import argparse
+import asyncio
+import json
+
+import requests
+
+from bench_utils import Timer
+from vast_client import VastClient, get_health_check_url
+from vast_stub import VastStub
+
+PAYLOAD = {"client_id": "me", "image": "pytorch/pytorch:latest", "disk": 50}
+
+
+def legacy_wait(stub, instance_id, initial_delay=15, poll_interval=20, health_interval=30):
+    """The Step 3 loop of the original launch_vast_instance.py, against the stub."""
+    import time
+
+    time.sleep(initial_delay)
+    next_health_check = time.time()
+    while True:
+        instances = requests.get(f"{stub.api_url}/instances?api_key=x", timeout=20).json()["instances"]
+        details = next((i for i in instances if i["id"] == instance_id), None)
+        if details and details.get("actual_status") == "running":
+            url = get_health_check_url(details, 8888)
+            if url and time.time() >= next_health_check:
+                if requests.get(url, timeout=10).status_code == 200:
+                    return
+                next_health_check = time.time() + health_interval
+        time.sleep(poll_interval)
+
+
+def run_legacy(args):
+    with VastStub(boot_seconds=args.boot_seconds, health_delay=args.health_delay,
+                  filler_instances=args.filler_instances) as stub:
+        instance_id = requests.put(f"{stub.api_url}/asks/1001/?api_key=x", json=PAYLOAD, timeout=45).json()["new_contract"]
+        with Timer() as t:
+            legacy_wait(stub, instance_id)
+        return {"mode": "legacy", "seconds_to_ready": round(t.seconds, 2), **summary(stub)}
+
+
+def run_client(args):
+    async def main(stub):
+        async with VastClient("x", base_url=stub.api_url, backoff_base=0.1) as vast:
+            instance_id = await vast.create_instance(1001, PAYLOAD)
+            result = await vast.wait_until_ready(instance_id, health_port=8888, timeout=120)
+            assert result["ready"], result
+            return result, vast.stats["retries"]
+
+    with VastStub(boot_seconds=args.boot_seconds, health_delay=args.health_delay, fail_rate=args.fail_rate,
+                  filler_instances=args.filler_instances) as stub:
+        result, retries = asyncio.run(main(stub))
+        return {"mode": "client", "seconds_to_ready": round(result["seconds"], 2), "client_retries": retries, **summary(stub)}
+
+
+def summary(stub):
+    return {"requests": stub.stats["requests"], "connections": stub.stats["connections"],
+            "bytes_received": stub.stats["bytes_sent"], "failures_injected": stub.stats["failures_injected"]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--boot-seconds", type=float, default=5.0, help="time until the stub instance is 'running'")
+    parser.add_argument("--health-delay", type=float, default=3.0, help="further time until the health port answers")
+    parser.add_argument("--fail-rate", type=float, default=0.1, help="fraction of API calls the stub fails (client run only)")
+    parser.add_argument("--filler-instances", type=int, default=50, help="other instances on the account")
+    args = parser.parse_args()
+    results = [run_legacy(args), run_client(args)]
+    for r in results:
+        print(f"{r['mode']:>6}: ready after {r['seconds_to_ready']:6.2f}s, {r['requests']} requests over "
+              f"{r['connections']} connection(s), {r['bytes_received'] / 1024:.1f} KiB received")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
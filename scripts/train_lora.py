@@ -1,79 +1,398 @@
+import contextlib
+import dataclasses
 import json
+import os
+import sys
 import torch
-from transformers import LlamaTokenizer, LlamaForCausalLM, Trainer, TrainingArguments
-from peft import LoraConfig, get_peft_model
-
-# Define your model path.
-# This should be the directory of the base DeepSeek model.
-model_name_or_path = "deepseek-ai/DeepSeek-V3-Base"
-
-# Load tokenizer and base model.
-tokenizer = LlamaTokenizer.from_pretrained(model_name_or_path, trust_remote_code=True)
-model = LlamaForCausalLM.from_pretrained(model_name_or_path, device_map="auto", trust_remote_code=True)
-
-
-# Set up the LoRA configuration.
-lora_config = LoraConfig(
-    r=8,                     # Rank of LoRA
-    lora_alpha=32,           # Scaling factor
-    target_modules=["q_proj", "v_proj"],  # Example target modules; adjust if needed
-    lora_dropout=0.1,        # Dropout rate
-    bias="none",
-)
-
-# Apply LoRA to the model.
-model = get_peft_model(model, lora_config)
-
-# Load training data from a JSON file.
-# Make sure the file 'sample_training_data.json' exists in the same directory.
-with open("sample_training_data.json", "r") as f:
-    training_data = json.load(f)
-
-# Create a simple dataset.
-class SimpleDataset(torch.utils.data.Dataset):
-    def __init__(self, data, tokenizer):
-        self.data = data
-        self.tokenizer = tokenizer
-
-    def __len__(self):
-        return len(self.data)
-
-    def __getitem__(self, idx):
-        item = self.data[idx]
-        # Concatenate instruction and output as an example.
-        text = item["instruction"] + " " + item["output"]
-        encoding = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=128, padding="max_length")
-        # Remove batch dimension.
-        encoding = {k: v.squeeze(0) for k, v in encoding.items()}
-        return encoding
-
-dataset = SimpleDataset(training_data, tokenizer)
-
-# Set up training arguments.
-training_args = TrainingArguments(
-    output_dir="./lora_adapter",   # Directory to save adapter weights.
-    num_train_epochs=1,            # One epoch for testing.
-    per_device_train_batch_size=1, # Small batch size.
-    logging_steps=1,
-    save_steps=100,
-    save_total_limit=1,
-    prediction_loss_only=True,
-    learning_rate=2e-4,
-    fp16=True,                     # Enable if your GPU supports it.
-)
-
-# Initialize the Trainer.
-trainer = Trainer(
-    model=model,
-    args=training_args,
-    train_dataset=dataset,
-)
-
-# Start training.
-print("Starting LoRA training...")
-trainer.train()
-print("Training complete.")
-
-# Save the LoRA adapter.
-model.save_pretrained("./lora_adapter")
-print("LoRA adapter saved in ./lora_adapter")
+from torch.utils.data import DataLoader
+from transformers import AutoTokenizer, Trainer, TrainingArguments, set_seed
+from transformers.trainer_callback import ExportableState
+from peft import LoraConfig, get_peft_model, get_peft_model_state_dict
+from safetensors.torch import load_file
+
+# Shared modules live at the repo root, next to main.py.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from batch_tuner import default_memory_budget, gradient_accumulation_for, tune_batch_tokens
+from checkpointing import (AsyncCheckpointer, OPTIMIZER_WEIGHTS, RNG_WEIGHTS, find_latest_checkpoint,
+                           load_checkpoint_file, restore_rng_state, unflatten_optimizer_state)
+from dataset_shards import find_data_files, prepare_dataset, TokenizedShardDataset, make_pad_collator
+from evaluation import (EVAL_RESULTS_NAME, EarlyStoppingCallback, EvalLog, InlineEvalCallback, kill_eval_process,
+                        load_eval_dataset, start_eval_process, stop_eval_process)
+from gpu_throughput import record_throughput
+from model_loading import StartupTimer, load_causal_lm
+from packing import PackedDataset, TokenBudgetBatchSampler, make_packed_collator
+from profiling import ProfilingCallback, StepProfiler
+from streaming_dataset import StreamingJsonlDataset, StreamPositionCallback, load_stream_position
+
+# Every setting of a training run. Override any of them by passing a dict to
+# train(), or a JSON file to `python scripts/train_lora.py config.json`.
+DEFAULT_CONFIG = {
+    # This should be the directory (or hub id) of the base DeepSeek model.
+    "model_name_or_path": "deepseek-ai/DeepSeek-V3-Base",
+    "data_files": None,            # None = every .json/.jsonl file in data/
+    "output_dir": "./lora_adapter",  # Directory to save adapter weights.
+    "cache_dir": os.path.join(REPO_ROOT, "data", ".cache", "tokenized"),
+
+    # LoRA
+    "lora_r": 8,                   # Rank of LoRA
+    "lora_alpha": 32,              # Scaling factor
+    "target_modules": ["q_proj", "v_proj"],  # Example target modules; adjust if needed
+    "lora_dropout": 0.1,           # Dropout rate
+
+    # Data. Files are pre-tokenized into memory-mapped shards keyed by file
+    # contents + tokenizer + max_length, so reruns and other jobs on the same
+    # data skip tokenization entirely.
+    "max_length": 1024,            # per-example truncation limit
+    "pack_sequences": True,        # concatenate several examples into one sequence
+    "pack_length": 1024,           # tokens per packed sequence
+    "mask_prompt": False,          # True: only train on the output, not the instruction
+    # Batches are built against a token budget, not an example count. "auto" probes the
+    # largest budget whose training step fits memory_budget_mb (once per GPU/model/LoRA
+    # setup, then cached in data/.cache/batch_tuning.json).
+    "max_batch_tokens": "auto",
+    "memory_budget_mb": None,      # None = 90% of free GPU memory; on CPU "auto" needs it (else 4096 tokens)
+    "target_tokens_per_step": None,  # accumulate gradients up to ~this many tokens per optimizer step; None = no accumulation
+
+    # Streaming mode: for corpora bigger than host memory. Reads .jsonl files lazily,
+    # split across DataLoader workers and ranks, and resumes mid-epoch from a checkpoint.
+    "streaming": False,
+    "streaming_batch_size": 8,
+    "streaming_max_steps": 1000,   # a stream has no length, so the run is bounded by steps
+    "shuffle_buffer": 10_000,
+    "num_workers": 4,
+
+    # Checkpoints hold only the LoRA weights, optimizer/scheduler/RNG state and the
+    # data position. "auto" resumes from the newest complete checkpoint in
+    # output_dir (e.g. after a preempted instance restarts the job); None starts fresh.
+    "resume_from_checkpoint": "auto",  # or a path, e.g. "./lora_adapter/checkpoint-500"
+    "async_checkpoints": True,     # snapshot to host memory, write to disk in a background thread
+
+    # Profiling: every profile_every-th step is timed phase by phase (data wait, forward,
+    # backward, optimizer, checkpoint) into a JSONL file; 0 turns it off.
+    "profile_every": 10,
+    "profile_file": None,          # None = profile.jsonl in output_dir
+
+    # Evaluation on held-out files, on every checkpoint, without stopping training (see
+    # evaluation.py). "process" scores checkpoints in a separate low-priority process
+    # with its own copy of the base model; "inline" scores the training model after
+    # each save, for when a second copy doesn't fit. Either way evaluation takes at
+    # most eval_duty_cycle of the wall time; results go to eval.jsonl and /metrics.
+    "eval_files": None,            # None = no evaluation
+    "eval_mode": "process",
+    "eval_max_batch_tokens": 16384,  # eval batches are length-sorted and padded to this many tokens
+    "eval_duty_cycle": 0.1,
+    "eval_results_file": None,     # None = eval.jsonl in output_dir
+    "early_stopping_patience": None,  # stop after this many evaluations without a lower eval loss
+    "early_stopping_min_delta": 0.0,
+
+    # Optimization
+    "num_train_epochs": 1,         # One epoch for testing.
+    "learning_rate": 2e-4,
+    "logging_steps": 1,
+    "save_steps": 100,
+    "save_total_limit": 1,
+    "fp16": True,                  # Used only if a GPU is available.
+    "seed": 42,
+}
+
+
+# Trainer that groups similar-length sequences into token-budgeted batches.
+class TokenBudgetTrainer(Trainer):
+    def __init__(self, *args, max_batch_tokens=4096, streaming=False, checkpointer=None, profiler=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_batch_tokens = max_batch_tokens
+        self.streaming = streaming
+        self.checkpointer = checkpointer
+        self.profiler = profiler
+        self._adapter_state = None
+
+    def get_train_dataloader(self):
+        if self.streaming:
+            # The dataset already splits itself across ranks and workers, so it
+            # must not go through accelerate's own sharding/dispatching.
+            return DataLoader(self.train_dataset, batch_size=self.args.per_device_train_batch_size,
+                              collate_fn=self.data_collator, num_workers=self.args.dataloader_num_workers,
+                              pin_memory=self.args.dataloader_pin_memory)
+        batch_sampler = TokenBudgetBatchSampler(self.train_dataset.lengths(), self.max_batch_tokens, seed=self.args.seed)
+        dataloader = DataLoader(self.train_dataset, batch_sampler=batch_sampler, collate_fn=self.data_collator,
+                                num_workers=self.args.dataloader_num_workers, pin_memory=self.args.dataloader_pin_memory)
+        return self.accelerator.prepare(dataloader)
+
+    # Profiler hooks: data wait, forward and backward are timed here; the optimizer
+    # step in ProfilingCallback.
+    def _phase(self, name, always=False):
+        return self.profiler.phase(name, always) if self.profiler is not None else contextlib.nullcontext()
+
+    def get_batch_samples(self, epoch_iterator, num_batches, device):
+        if self.profiler is not None:
+            self.profiler.begin_step(self.state.global_step)
+        with self._phase("data_wait"):
+            batch_samples, num_items_in_batch = super().get_batch_samples(epoch_iterator, num_batches, device)
+        for batch in batch_samples:
+            if self.streaming:  # where each worker's stream is, for the checkpoint (not a model input)
+                self.train_dataset.consumed(batch.pop("stream_slot"), batch.pop("stream_offset"))
+            if self.profiler is not None:
+                self.profiler.count_tokens(batch)
+        return batch_samples, num_items_in_batch
+
+    def compute_loss(self, model, inputs, *args, **kwargs):
+        with self._phase("forward"):
+            return super().compute_loss(model, inputs, *args, **kwargs)
+
+    def training_step(self, model, inputs, num_items_in_batch=None):
+        if self.profiler is None:
+            return super().training_step(model, inputs, num_items_in_batch)
+        forward_before = self.profiler.phases["forward"]
+        with self.profiler.phase("backward"):
+            loss = super().training_step(model, inputs, num_items_in_batch)
+        # The whole step was timed as "backward"; take out the forward pass timed inside it.
+        self.profiler.phases["backward"] -= self.profiler.phases["forward"] - forward_before
+        return loss
+
+    def _checkpoint_files(self):
+        """Extra JSON files from callbacks (e.g. the stream position)."""
+        files = {}
+        for callback in self.callback_handler.callbacks:
+            if hasattr(callback, "checkpoint_files"):
+                files.update(callback.checkpoint_files(self.args))
+        return files
+
+    def _save_checkpoint(self, model, trial):
+        with self._phase("checkpoint", always=True):
+            self._write_checkpoint(model, trial)
+
+    def _write_checkpoint(self, model, trial):
+        checkpoint_dir = os.path.join(self.args.output_dir, f"checkpoint-{self.state.global_step}")
+        if self.checkpointer is None:
+            super()._save_checkpoint(model, trial)
+            for name, value in self._checkpoint_files().items():
+                with open(os.path.join(checkpoint_dir, name), "w") as f:
+                    json.dump(value, f)
+            return
+        self.store_flos()
+        for callback in self.callback_handler.callbacks + [self.control]:
+            if isinstance(callback, ExportableState):
+                self.state.stateful_callbacks[callback.__class__.__name__] = callback.state()
+        files = self._checkpoint_files()
+        files["trainer_state.json"] = dataclasses.asdict(self.state)
+        files["scheduler.json"] = self.lr_scheduler.state_dict()
+        if getattr(self.accelerator, "scaler", None) is not None:
+            files["scaler.json"] = self.accelerator.scaler.state_dict()
+        peft_model = self.accelerator.unwrap_model(self.model)
+        if self._adapter_state is None:
+            # Views of the live LoRA parameters (the optimizer updates them in place), so build the mapping once.
+            self._adapter_state = get_peft_model_state_dict(peft_model, save_embedding_layers=False)
+        self.checkpointer.save(checkpoint_dir, self._adapter_state, peft_model.peft_config[peft_model.active_adapter],
+                               self.optimizer, files)
+
+    def _load_optimizer_and_scheduler(self, checkpoint):
+        if checkpoint is None or not os.path.exists(os.path.join(checkpoint, OPTIMIZER_WEIGHTS)):
+            return super()._load_optimizer_and_scheduler(checkpoint)
+        tensors = load_file(os.path.join(checkpoint, OPTIMIZER_WEIGHTS))
+        self.optimizer.load_state_dict(unflatten_optimizer_state(tensors, load_checkpoint_file(checkpoint, "optimizer.json")))
+        self.lr_scheduler.load_state_dict(load_checkpoint_file(checkpoint, "scheduler.json"))
+
+    def _load_scaler(self, checkpoint):
+        if checkpoint is None or not os.path.exists(os.path.join(checkpoint, "scaler.json")):
+            return super()._load_scaler(checkpoint)
+        self.accelerator.scaler.load_state_dict(load_checkpoint_file(checkpoint, "scaler.json"))
+
+    def _load_rng_state(self, checkpoint):
+        if checkpoint is None or not os.path.exists(os.path.join(checkpoint, RNG_WEIGHTS)):
+            return super()._load_rng_state(checkpoint)
+        restore_rng_state(load_file(os.path.join(checkpoint, RNG_WEIGHTS)), load_checkpoint_file(checkpoint, "rng_state.json"))
+
+
+def build_dataset(config, tokenizer):
+    """Returns (dataset, data_collator) for the configured data mode."""
+    data_files = config["data_files"] or find_data_files(os.path.join(REPO_ROOT, "data"))
+    if not data_files:
+        raise ValueError("No training data files found.")
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    if config["streaming"]:
+        dataset = StreamingJsonlDataset(data_files, tokenizer, config["max_length"],
+                                        shuffle_buffer=config["shuffle_buffer"], seed=config["seed"])
+        checkpoint = config["resume_from_checkpoint"]
+        if checkpoint and load_stream_position(dataset, checkpoint, config["num_workers"]):
+            print(f"Resuming stream at epoch {dataset.epoch} from {checkpoint}")
+        return dataset, dataset.collator(make_pad_collator(pad_token_id, mask_prompt=config["mask_prompt"]))
+    shard_dir = prepare_dataset(data_files, tokenizer, config["max_length"], cache_dir=config["cache_dir"])
+    dataset = TokenizedShardDataset(shard_dir)
+    if config["pack_sequences"]:
+        return PackedDataset(dataset, config["pack_length"], mask_prompt=config["mask_prompt"]), make_packed_collator(pad_token_id)
+    return dataset, make_pad_collator(pad_token_id, mask_prompt=config["mask_prompt"])
+
+
+def resolve_batch_size(config, model, lora_config, dataset):
+    """(max_batch_tokens, rows per streaming batch, gradient_accumulation_steps), tuned where set to "auto".
+
+    A resumed run keeps the sizes it started with (batch_size.json in
+    output_dir), so its batches line up with the checkpoint even on other hardware.
+    """
+    saved = os.path.join(config["output_dir"], "batch_size.json")
+    if config["resume_from_checkpoint"] and os.path.exists(saved):
+        with open(saved, "r") as f:
+            sizes = json.load(f)
+        print(f"Batch size from the run being resumed: {sizes}", flush=True)
+        return sizes["max_batch_tokens"], sizes["streaming_batch_size"], sizes["gradient_accumulation_steps"]
+
+    streaming = config["streaming"]
+    max_batch_tokens, rows = config["max_batch_tokens"], config["streaming_batch_size"]
+    sequence_length = config["max_length"] if streaming else \
+        config["pack_length"] if config["pack_sequences"] else int(min(dataset.lengths().max(), config["max_length"]))
+    if max_batch_tokens == "auto":
+        budget = config["memory_budget_mb"] * 2**20 if config["memory_budget_mb"] else default_memory_budget()
+        if budget is None:
+            print("max_batch_tokens='auto' needs memory_budget_mb on CPU; using 4096.", flush=True)
+            max_batch_tokens = 4096
+        else:
+            use_fp16 = config["fp16"] and torch.cuda.is_available()
+            result = tune_batch_tokens(model, lora_config, sequence_length, budget,
+                                       model.get_input_embeddings().num_embeddings,
+                                       packed=config["pack_sequences"] and not streaming,
+                                       autocast_dtype=torch.float16 if use_fp16 else None)
+            max_batch_tokens = result["max_batch_tokens"]
+            how = "cached" if result["cached"] else f"probed in {result['probe_seconds']:.1f}s"
+            print(f"Batch budget: {max_batch_tokens} tokens ({max_batch_tokens // sequence_length} x {sequence_length}) "
+                  f"fits {budget / 2**20:.0f} MiB ({how})", flush=True)
+            if streaming:
+                rows = max(1, max_batch_tokens // sequence_length)
+    if streaming:
+        target = config["target_tokens_per_step"]
+        accumulation = max(1, round(target / (rows * sequence_length))) if target else 1
+    else:
+        accumulation = gradient_accumulation_for(dataset.lengths(), max_batch_tokens, config["target_tokens_per_step"],
+                                                 seed=config["seed"])
+    os.makedirs(config["output_dir"], exist_ok=True)
+    with open(saved, "w") as f:
+        json.dump({"max_batch_tokens": max_batch_tokens, "streaming_batch_size": rows,
+                   "gradient_accumulation_steps": accumulation}, f)
+    return max_batch_tokens, rows, accumulation
+
+
+def train(config=None):
+    """Runs one LoRA training job and saves the adapter to config["output_dir"]."""
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown config keys: {sorted(unknown)}")
+
+    if config["resume_from_checkpoint"] == "auto":
+        config["resume_from_checkpoint"] = find_latest_checkpoint(config["output_dir"])
+        if config["resume_from_checkpoint"]:
+            print(f"Resuming from {config['resume_from_checkpoint']}", flush=True)
+
+    # Load tokenizer and base model (memory-mapped on CPU, see model_loading.py).
+    model_name_or_path = config["model_name_or_path"]
+    timer = StartupTimer()
+    with timer.phase("tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(model_name_or_path, trust_remote_code=True)
+    model = load_causal_lm(model_name_or_path, device_map="auto", timer=timer)
+    print(f"Loaded {model_name_or_path} in {timer.summary()}; weights: {timer.notes['weights']}", flush=True)
+
+    # Apply LoRA to the model. Seeded so a fresh run and a resumed one start from the same init.
+    set_seed(config["seed"])
+    lora_config = LoraConfig(
+        r=config["lora_r"],
+        lora_alpha=config["lora_alpha"],
+        target_modules=config["target_modules"],
+        lora_dropout=config["lora_dropout"],
+        bias="none",
+    )
+    model = get_peft_model(model, lora_config)
+
+    dataset, data_collator = build_dataset(config, tokenizer)
+    streaming = config["streaming"]
+    max_batch_tokens, streaming_batch_size, accumulation = resolve_batch_size(config, model, lora_config, dataset)
+    checkpointer = AsyncCheckpointer(config["save_total_limit"]) if config["async_checkpoints"] else None
+    profiler = None
+    callbacks = [StreamPositionCallback(dataset)] if streaming else []
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    if config["profile_every"]:
+        profiler = StepProfiler(config["profile_file"] or os.path.join(config["output_dir"], "profile.jsonl"),
+                                every=config["profile_every"], pad_token_id=pad_token_id)
+        callbacks.append(ProfilingCallback(profiler))
+    eval_process = None
+    try:
+        if config["eval_files"]:
+            results_file = config["eval_results_file"] or os.path.join(config["output_dir"], EVAL_RESULTS_NAME)
+            if config["eval_mode"] == "inline":
+                eval_dataset = load_eval_dataset(config["eval_files"], tokenizer, config["max_length"], config["cache_dir"])
+                callbacks.append(InlineEvalCallback(eval_dataset, EvalLog(results_file, config["early_stopping_min_delta"]),
+                                                    config["eval_max_batch_tokens"], pad_token_id, config["eval_duty_cycle"]))
+            else:
+                eval_process = start_eval_process(config, results_file)
+            if config["early_stopping_patience"]:
+                callbacks.append(EarlyStoppingCallback(results_file, config["early_stopping_patience"]))
+
+        # Set up training arguments.
+        training_args = TrainingArguments(
+            output_dir=config["output_dir"],
+            num_train_epochs=config["num_train_epochs"],
+            max_steps=config["streaming_max_steps"] if streaming else -1,
+            per_device_train_batch_size=streaming_batch_size if streaming else 1, # Otherwise batches come from TokenBudgetBatchSampler.
+            gradient_accumulation_steps=accumulation,
+            dataloader_num_workers=config["num_workers"],
+            ignore_data_skip=streaming,    # the stream skips consumed samples itself, without re-reading batches
+            logging_steps=config["logging_steps"],
+            save_steps=config["save_steps"],
+            save_total_limit=config["save_total_limit"],
+            prediction_loss_only=True,
+            learning_rate=config["learning_rate"],
+            fp16=config["fp16"] and torch.cuda.is_available(),
+            include_num_input_tokens_seen="non_padding",  # logs train_tokens_per_second, recorded per GPU model below
+            seed=config["seed"],
+        )
+
+        # Initialize the Trainer.
+        trainer = TokenBudgetTrainer(
+            model=model,
+            args=training_args,
+            train_dataset=dataset,
+            data_collator=data_collator,
+            processing_class=tokenizer,    # lets the token counter tell padding from real tokens
+            callbacks=callbacks,
+            max_batch_tokens=max_batch_tokens,
+            streaming=streaming,
+            checkpointer=checkpointer,
+            profiler=profiler,
+        )
+
+        # Start training.
+        print("Starting LoRA training...", flush=True)
+        trainer.train(resume_from_checkpoint=config["resume_from_checkpoint"])
+        if checkpointer is not None:
+            checkpointer.wait()
+            report = checkpointer.report()
+            print(f"Checkpoints: {report['saves']} saved, training stalled {report['stall_seconds'] * 1000:.1f}ms in total "
+                  f"({report['avg_stall_seconds'] * 1000:.1f}ms per save), {report['write_seconds']:.2f}s written in the background",
+                  flush=True)
+        print("Training complete.", flush=True)
+        if profiler is not None:
+            print(f"Step profile written to {profiler.path}", flush=True)
+
+        # Feed the launcher's offer ranking (cost per training token) with what this GPU actually did.
+        speeds = [e["train_tokens_per_second"] for e in trainer.state.log_history if "train_tokens_per_second" in e]
+        if torch.cuda.is_available() and speeds:
+            entry = record_throughput(torch.cuda.get_device_name(), speeds[-1] / torch.cuda.device_count())
+            print(f"Recorded {speeds[-1]:.0f} tokens/sec on {entry['gpu_name']} ({entry['runs']} run(s) so far)", flush=True)
+
+        # Save the LoRA adapter.
+        model.save_pretrained(config["output_dir"])
+        print(f"LoRA adapter saved in {config['output_dir']}", flush=True)
+        if eval_process is not None:
+            print("Waiting for the evaluator to score the final adapter...", flush=True)
+            stop_eval_process(eval_process, trainer.state.global_step)
+        return config["output_dir"]
+    finally:
+        if eval_process is not None:
+            kill_eval_process(eval_process)  # training failed: no-op after stop_eval_process scored the final adapter
+
+
+if __name__ == "__main__":
+    overrides = {}
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            overrides = json.load(f)
+    train(overrides)
@@ -0,0 +1,231 @@
+"""Local stand-in for the Vast.ai REST API, for exercising the launcher without renting anything.
+
+Serves /api/v0/bundles, /api/v0/instances, /api/v0/instances/<id> (GET, DELETE),
+/api/v0/asks/<offer> and /api/v0/instances/<id>/start, and answers GET / as the
+instances' health check port (plus /bootstrap_timings.json). New instances go "created" -> "loading" -> "running" on a timer and start
+answering health checks health_delay seconds later.
+
+    python scripts/vast_stub.py --port 8700     # then VAST_API_URL=http://127.0.0.1:8700/api/v0
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_OFFERS = [
+    {"id": 1001, "gpu_name": "RTX 6000Ada", "num_gpus": 1, "dph_total": 0.95, "total_flops": 91.1, "disk_space": 200},
+    {"id": 1002, "gpu_name": "RTX 6000Ada", "num_gpus": 1, "dph_total": 0.78, "total_flops": 91.1, "disk_space": 100},
+    {"id": 1003, "gpu_name": "RTX 4090", "num_gpus": 1, "dph_total": 0.42, "total_flops": 82.6, "disk_space": 100},
+    {"id": 1004, "gpu_name": "RTX 4090", "num_gpus": 1, "dph_total": 0.38, "total_flops": 82.6, "disk_space": 60},
+    {"id": 1005, "gpu_name": "A100 SXM4", "num_gpus": 1, "dph_total": 1.25, "total_flops": 19.5, "disk_space": 500},
+    {"id": 1006, "gpu_name": "L40S", "num_gpus": 1, "dph_total": 0.85, "total_flops": 91.6, "disk_space": 200},
+    {"id": 1007, "gpu_name": "A100 SXM4", "num_gpus": 1, "dph_total": 0.90, "total_flops": 19.5, "disk_space": 300,
+     "verified": False},
+]
+
+# What a new instance's on-start script (bootstrap.py) reports, served next to the health check.
+BOOTSTRAP_TIMINGS = {"env": "stub", "src": "stub", "ok": True, "total_seconds": 41.2, "phases": {
+    "fetch_source": {"seconds": 0.4, "result": "downloaded"}, "source": {"seconds": 0.1, "result": "extracted"},
+    "fetch_env": {"seconds": 18.3, "result": "downloaded"}, "deps": {"seconds": 22.4, "result": "installed offline"}}}
+
+
+def matches(offer, query):
+    """Applies the subset of Vast's query operators the launcher uses (eq, gte, lte, in)."""
+    for field, ops in query.items():
+        if field == "type" or not isinstance(ops, dict):
+            continue  # "type" (on-demand/bid) picks the search mode rather than filtering a field
+        value = offer.get(field)
+        for op, target in ops.items():
+            if op == "eq" and value != target:
+                return False
+            if op == "gte" and (value is None or value < target):
+                return False
+            if op == "lte" and (value is None or value > target):
+                return False
+            if op == "in" and value not in target:
+                return False
+    return True
+
+
+class VastStub:
+    """In-process fake Vast API. Thread-safe; counts requests and connections for benchmarks."""
+
+    def __init__(self, offers=None, boot_seconds=2.0, health_delay=1.0, fail_rate=0.0, search_latency=0.0,
+                 create_latency=0.0, conflict_offers=(), filler_instances=0, seed=0, host="127.0.0.1", port=0):
+        self.offers = {o["id"]: {"verified": True, "rentable": True, **o}
+                       for o in (offers if offers is not None else DEFAULT_OFFERS)}
+        self.boot_seconds = boot_seconds
+        self.health_delay = health_delay
+        self.fail_rate = fail_rate              # fraction of API calls answered with 503
+        self.search_latency = search_latency    # seconds each /bundles call takes
+        self.create_latency = create_latency    # seconds each /asks call takes
+        self.conflict_offers = set(conflict_offers)  # offers that answer "GPU conflict" when rented
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.instances = {}
+        self.next_id = 5000
+        self.stats = {"requests": 0, "connections": 0, "bytes_sent": 0, "failures_injected": 0, "by_path": {}}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        for _ in range(filler_instances):  # other machines on the account, to make full list fetches realistic
+            self._add_instance("stopped", {"gpu_name": "RTX 3090", "num_gpus": 1, "disk_space": 50})
+        self.thread = None
+
+    @property
+    def api_url(self):
+        return f"http://{self.host}:{self.port}/api/v0"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _add_instance(self, status, fields, offer_id=None):
+        with self.lock:
+            instance_id = self.next_id
+            self.next_id += 1
+            self.instances[instance_id] = {"id": instance_id, "offer_id": offer_id, "created_at": time.monotonic(),
+                                           "fixed_status": status, **fields}
+        return instance_id
+
+    def _view(self, instance):
+        """Instance details as the API shows them right now."""
+        view = {k: v for k, v in instance.items() if k not in ("created_at", "fixed_status", "offer_id")}
+        age = time.monotonic() - instance["created_at"]
+        if instance["fixed_status"]:
+            view["actual_status"] = instance["fixed_status"]
+        elif age < self.boot_seconds / 2:
+            view["actual_status"] = "created"
+        elif age < self.boot_seconds:
+            view["actual_status"] = "loading"
+        else:
+            view["actual_status"] = "running"
+            view["public_ipaddr"] = self.host
+            view["ports"] = {"8888/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(self.port)}]}
+        return view
+
+    def healthy(self):
+        now = time.monotonic()
+        return any(not i["fixed_status"] and now - i["created_at"] >= self.boot_seconds + self.health_delay
+                   for i in self.instances.values())
+
+    def handle(self, method, path, query, body):
+        """Returns (status, payload) for one API call."""
+        if path == "/" and method == "GET":
+            return (200, {"ok": True}) if self.healthy() else (503, {"ok": False})
+        if path == "/bootstrap_timings.json" and method == "GET" and self.healthy():
+            return 200, BOOTSTRAP_TIMINGS
+        if self.fail_rate and self.rng.random() < self.fail_rate:
+            self.stats["failures_injected"] += 1
+            return 503, {"error": "injected failure"}
+        route = path[len("/api/v0"):].rstrip("/") if path.startswith("/api/v0") else None
+        if route == "/bundles" and method == "GET":
+            if self.search_latency:
+                time.sleep(self.search_latency)
+            q = json.loads(query.get("q", ["{}"])[0])
+            return 200, {"offers": [o for o in self.offers.values() if matches(o, q)]}
+        if route == "/instances" and method == "GET":
+            return 200, {"instances": [self._view(i) for i in self.instances.values()]}
+        m = re.fullmatch(r"/instances/(\d+)(/start)?", route or "")
+        if m:
+            instance = self.instances.get(int(m.group(1)))
+            if instance is None:
+                return 404, {"error": "no such instance"}
+            if m.group(2) and method == "PUT":
+                with self.lock:
+                    instance["fixed_status"] = None
+                    instance["created_at"] = time.monotonic()
+                return 200, {"success": True}
+            if method == "GET":
+                return 200, {"instances": self._view(instance)}
+            if method == "DELETE":
+                with self.lock:
+                    self.instances.pop(instance["id"], None)
+                    if instance["offer_id"] in self.offers:
+                        self.offers[instance["offer_id"]]["rentable"] = True
+                return 200, {"success": True}
+        m = re.fullmatch(r"/asks/(\d+)", route or "")
+        if m and method == "PUT":
+            if self.create_latency:
+                time.sleep(self.create_latency)
+            offer_id = int(m.group(1))
+            with self.lock:
+                offer = self.offers.get(offer_id)
+                if offer is None or offer_id in self.conflict_offers or not offer["rentable"]:
+                    return 400, {"success": False, "error": "invalid_args", "msg": "GPU conflict: already rented"}
+                offer["rentable"] = False
+            instance_id = self._add_instance(None, {"gpu_name": offer["gpu_name"], "num_gpus": offer["num_gpus"],
+                                                    "disk_space": body.get("disk", 0), "dph_total": offer["dph_total"]},
+                                             offer_id=offer_id)
+            return 200, {"success": True, "new_contract": instance_id}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is visible in stats
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.stats["connections"] += 1
+
+            def _serve(self):
+                parsed = urllib.parse.urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else {}
+                status, payload = stub.handle(self.command, parsed.path, urllib.parse.parse_qs(parsed.query), body)
+                data = json.dumps(payload).encode()
+                with stub.lock:
+                    stub.stats["requests"] += 1
+                    stub.stats["bytes_sent"] += len(data)
+                    key = f"{self.command} {re.sub(r'/[0-9]+', '/<id>', parsed.path)}"
+                    stub.stats["by_path"][key] = stub.stats["by_path"].get(key, 0) + 1
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_PUT = do_DELETE = _serve
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--boot-seconds", type=float, default=5.0)
+    parser.add_argument("--health-delay", type=float, default=3.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    stub = VastStub(boot_seconds=args.boot_seconds, health_delay=args.health_delay, fail_rate=args.fail_rate,
+                    port=args.port)
+    print(f"Vast stub listening on {stub.api_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Multi-worker API server that imports torch and loads the model once per host, not once per worker.
+
+    python serve.py --workers 4 --port 8000
+
+uvicorn --workers N starts every worker as a fresh interpreter, so each one imports
+torch and transformers and loads the model by itself, all at once on the same CPUs.
+serve.py does both once in the parent (serving.preload_model), binds the port and
+forks the workers, which inherit the imported modules and the memory-mapped weights
+copy-on-write. Each worker then imports main, with its own SQLite connections,
+scheduler and caches, and serves on the shared socket.
+"""
+import argparse
+import os
+import signal
+import sys
+import time
+
+
+def run_worker(sock, host, port):
+    import uvicorn
+
+    config = uvicorn.Config("main:app", host=host, port=port, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve main:app with workers forked from a preloaded model.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("AKASHA_WORKERS", 2)))
+    parser.add_argument("--no-preload", action="store_true", help="fork first; each worker loads the model itself")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    start = time.perf_counter()
+    if not args.no_preload:
+        import serving
+
+        serving.preload_model()
+    sock = uvicorn.Config("main:app", host=args.host, port=args.port).bind_socket()
+    workers = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock, args.host, args.port)
+            finally:
+                os._exit(0)
+        workers.append(pid)
+    print(f"Started {args.workers} workers {workers} on {args.host}:{args.port} "
+          f"{time.perf_counter() - start:.1f}s after launch", flush=True)
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    status = 0
+    for _ in workers:
+        pid, code = os.wait()
+        if code and not stopping:  # workers stopped by us exit through the signal
+            print(f"Worker {pid} exited with status {code}", flush=True)
+            status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
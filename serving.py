@@ -0,0 +1,479 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import time
+
+# torch / transformers / peft are imported lazily so the upload API keeps working
+# on hosts that only have FastAPI installed.
+
+BASE_MODEL = os.environ.get("AKASHA_BASE_MODEL", "deepseek-ai/DeepSeek-V3-Base")
+ADAPTER_DIR = os.environ.get("AKASHA_ADAPTER_DIR", "./lora_adapter")
+MAX_BATCH_SIZE = int(os.environ.get("AKASHA_MAX_BATCH_SIZE", 8))
+MAX_BATCH_TOKENS = int(os.environ.get("AKASHA_MAX_BATCH_TOKENS", 4096))
+MAX_WAIT_MS = float(os.environ.get("AKASHA_MAX_WAIT_MS", 10))
+ADAPTER_ROOT = os.environ.get("AKASHA_ADAPTER_ROOT", "./adapters")  # one sub-directory per adapter
+ADAPTER_MEMORY_MB = float(os.environ.get("AKASHA_ADAPTER_MEMORY_MB", 2048))
+# A merged int8 export from cpu_export.py; when set, it is served instead of base model + adapters.
+CPU_MODEL_DIR = os.environ.get("AKASHA_CPU_MODEL_DIR", "")
+# After a failed model load, requests fail fast with the same error for this long before the next attempt.
+LOAD_RETRY_SECONDS = float(os.environ.get("AKASHA_LOAD_RETRY_SECONDS", 30))
+
+
+class GenerationRequest:
+    """One /generate call. The worker thread pushes events into `events` on the event loop."""
+
+    def __init__(self, prompt, prompt_ids, max_new_tokens=128, temperature=0.0, top_p=1.0, adapter=None):
+        self.prompt = prompt
+        self.adapter = adapter
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+        self.result = None     # final "done" payload, set by the model thread
+        self.cache_key = None  # ResponseCache key, if this request may be cached
+
+    @property
+    def cost(self):
+        """Tokens this request can occupy in a batch (prompt + everything it may generate)."""
+        return len(self.prompt_ids) + self.max_new_tokens
+
+    def emit(self, kind, value):
+        """Thread-safe: called from the model worker."""
+        self.loop.call_soon_threadsafe(self.events.put_nowait, (kind, value))
+
+
+class HFGenerationBackend:
+    """Runs micro-batches through a (PEFT) causal LM with a KV cache, streaming tokens per row.
+
+    With an AdapterRegistry, every row may name a different LoRA adapter; PEFT
+    applies each row's adapter inside the same forward pass. With a
+    PrefixKVCache, prompt prefixes seen before skip their share of the prefill.
+    """
+
+    def __init__(self, model, tokenizer, registry=None, prefix_cache=None):
+        import torch
+
+        self.torch = torch
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.registry = registry
+        self.prefix_cache = prefix_cache
+        self.device = next(model.parameters()).device
+        self.startup = None  # StartupTimer of load_backend
+
+    @property
+    def pad_token_id(self):  # a property, so a LazyTokenizer isn't loaded before the first request
+        tokenizer = self.tokenizer
+        return tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+    def encode(self, prompt):
+        return self.tokenizer(prompt)["input_ids"]
+
+    def _sample(self, logits, requests):
+        torch = self.torch
+        next_tokens = logits.argmax(dim=-1)
+        for i, r in enumerate(requests):
+            if r.temperature <= 0:
+                continue
+            probs = torch.softmax(logits[i].float() / r.temperature, dim=-1)
+            if r.top_p < 1.0:
+                sorted_probs, sorted_idx = probs.sort(descending=True)
+                keep = sorted_probs.cumsum(-1) - sorted_probs < r.top_p
+                probs = torch.zeros_like(probs).scatter(0, sorted_idx[keep], sorted_probs[keep])
+            next_tokens[i] = torch.multinomial(probs, 1)[0]
+        return next_tokens
+
+    def _prepare_adapters(self, requests):
+        """Loads the batch's adapters; fails (only) the rows whose adapter is gone (submit checked it existed)."""
+        if self.registry is None:
+            return requests, {}
+        missing = [r for r in requests if not self.registry.exists(r.adapter)]
+        for r in missing:
+            r.emit("error", f"Unknown adapter: {r.adapter}")
+        requests = [r for r in requests if r not in missing]
+        if not requests:
+            return requests, {}
+        adapter_names = self.registry.prepare([r.adapter for r in requests])
+        self.model = self.registry.model
+        if not hasattr(self.model, "peft_config"):
+            return requests, {}  # nothing loaded yet: every row is the base model
+        return requests, {"adapter_names": adapter_names}
+
+    def _prefill_batched(self, requests, forward_kwargs):
+        """Runs all prompts in one left-padded forward pass.
+
+        Returns (last-token logits, KV cache, attention mask, last position ids).
+        """
+        torch = self.torch
+        batch_size = len(requests)
+        longest = max(len(r.prompt_ids) for r in requests)
+        # Left padding keeps every row's last prompt token in the final column.
+        input_ids = torch.full((batch_size, longest), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((batch_size, longest), dtype=torch.long)
+        for i, r in enumerate(requests):
+            input_ids[i, longest - len(r.prompt_ids):] = torch.tensor(r.prompt_ids)
+            attention_mask[i, longest - len(r.prompt_ids):] = 1
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        input_ids, attention_mask, position_ids = (t.to(self.device) for t in (input_ids, attention_mask, position_ids))
+        out = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                         use_cache=True, **forward_kwargs)
+        return out.logits[:, -1, :], out.past_key_values, attention_mask, position_ids[:, -1:]
+
+    def _prefill_with_prefix_cache(self, requests, forward_kwargs):
+        """Like _prefill_batched, but rows whose prompt prefix is cached only run their suffix.
+
+        Rows with no cached prefix still share one batched forward pass. Every
+        row's prompt KV is then stored in the prefix cache and the rows are
+        stitched back into one left-padded cache for batched decoding.
+        """
+        from transformers import DynamicCache
+        from adapter_registry import BASE_ADAPTER
+        from generation_cache import cache_layers
+
+        torch = self.torch
+        adapter_names = forward_kwargs.get("adapter_names") or [BASE_ADAPTER] * len(requests)
+        cache_keys = [self.registry.cache_key(n) for n in adapter_names] if self.registry else adapter_names
+        rows = [None] * len(requests)  # (last-token logits, [(k, v)] per layer), k: (1, heads, n, dim)
+        misses = []
+        for i, r in enumerate(requests):
+            cached_length, layers = self.prefix_cache.lookup(cache_keys[i], r.prompt_ids)
+            if not cached_length:
+                misses.append(i)
+                continue
+            past = DynamicCache()
+            for layer_idx, (k, v) in enumerate(layers):
+                past.update(k, v, layer_idx)
+            suffix = r.prompt_ids[cached_length:]
+            row_kwargs = {"adapter_names": [adapter_names[i]]} if "adapter_names" in forward_kwargs else {}
+            out = self.model(input_ids=torch.tensor([suffix], device=self.device),
+                             position_ids=torch.arange(cached_length, len(r.prompt_ids), device=self.device)[None],
+                             past_key_values=past, use_cache=True, **row_kwargs)
+            self.prefix_cache.stats["tokens_computed"] += len(suffix)
+            rows[i] = (out.logits[0, -1, :], cache_layers(out.past_key_values))
+        if misses:
+            miss_kwargs = {"adapter_names": [adapter_names[i] for i in misses]} if "adapter_names" in forward_kwargs else {}
+            logits, past, _, _ = self._prefill_batched([requests[i] for i in misses], miss_kwargs)
+            longest = max(len(requests[i].prompt_ids) for i in misses)
+            layers = cache_layers(past)
+            for j, i in enumerate(misses):
+                n = len(requests[i].prompt_ids)
+                self.prefix_cache.stats["tokens_computed"] += n
+                rows[i] = (logits[j], [(k[j:j + 1, :, longest - n:], v[j:j + 1, :, longest - n:]) for k, v in layers])
+
+        for i, r in enumerate(requests):
+            self.prefix_cache.insert(cache_keys[i], r.prompt_ids, rows[i][1])
+
+        longest = max(len(r.prompt_ids) for r in requests)
+        attention_mask = torch.zeros((len(requests), longest), dtype=torch.long, device=self.device)
+        past = DynamicCache()
+        for layer_idx in range(len(rows[0][1])):
+            k0 = rows[0][1][layer_idx][0]
+            keys = k0.new_zeros((len(requests), k0.shape[1], longest, k0.shape[3]))
+            values = torch.zeros_like(keys)
+            for i, r in enumerate(requests):
+                n = len(r.prompt_ids)
+                keys[i, :, longest - n:] = rows[i][1][layer_idx][0][0]
+                values[i, :, longest - n:] = rows[i][1][layer_idx][1][0]
+                attention_mask[i, longest - n:] = 1
+            past.update(keys, values, layer_idx)
+        position_ids = torch.tensor([[len(r.prompt_ids) - 1] for r in requests], device=self.device)
+        return torch.stack([row[0] for row in rows]), past, attention_mask, position_ids
+
+    def generate_batch(self, requests):
+        """Generates for every request in the batch; runs on the dedicated model thread."""
+        torch = self.torch
+        requests, forward_kwargs = self._prepare_adapters(requests)
+        if not requests:
+            return
+        batch_size = len(requests)
+        generated = [[] for _ in requests]
+        texts = ["" for _ in requests]
+        done = [r.cancelled for r in requests]
+
+        def finish(i, r):
+            result = {"text": texts[i], "completion_tokens": len(generated[i]),
+                      "prompt_tokens": len(r.prompt_ids), "batch_size": batch_size}
+            r.result = result
+            r.emit("done", result)
+
+        with torch.inference_mode():
+            if self.prefix_cache is None:
+                logits, past_key_values, attention_mask, position_ids = self._prefill_batched(requests, forward_kwargs)
+            else:
+                prefill_start = time.perf_counter()
+                logits, past_key_values, attention_mask, position_ids = self._prefill_with_prefix_cache(requests, forward_kwargs)
+                self.prefix_cache.stats["prefill_seconds"] += time.perf_counter() - prefill_start
+            for step in range(max(r.max_new_tokens for r in requests)):
+                next_tokens = self._sample(logits, requests).tolist()
+                for i, r in enumerate(requests):
+                    if done[i]:
+                        continue
+                    if r.cancelled:
+                        done[i] = True
+                        continue
+                    token = next_tokens[i]
+                    if token == self.tokenizer.eos_token_id:
+                        done[i] = True
+                    else:
+                        generated[i].append(token)
+                        # Decode the whole continuation so multi-token characters come out whole.
+                        text = self.tokenizer.decode(generated[i], skip_special_tokens=True)
+                        if not text.endswith("\ufffd") and len(text) > len(texts[i]):
+                            r.emit("token", text[len(texts[i]):])
+                            texts[i] = text
+                        if len(generated[i]) >= r.max_new_tokens:
+                            done[i] = True
+                    if done[i]:
+                        finish(i, r)
+                if all(done):
+                    break
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones((batch_size, 1))], dim=-1)
+                position_ids = position_ids + 1
+                out = self.model(input_ids=torch.tensor(next_tokens, device=self.device)[:, None],
+                                 attention_mask=attention_mask, position_ids=position_ids,
+                                 past_key_values=past_key_values, use_cache=True, **forward_kwargs)
+                past_key_values = out.past_key_values
+                logits = out.logits[:, -1, :]
+        for i, r in enumerate(requests):
+            if not done[i]:
+                finish(i, r)
+
+
+_preloaded = None  # (base_model, cpu_model_dir, model, tokenizer, timer) from preload_model
+
+
+def _load_model(base_model, cpu_model_dir, timer):
+    from model_loading import LazyTokenizer, load_causal_lm
+
+    if cpu_model_dir:
+        from cpu_export import load_int8_model
+
+        model, tokenizer, _ = load_int8_model(cpu_model_dir, timer)
+        return model, tokenizer
+    return load_causal_lm(base_model, device_map="auto", timer=timer), LazyTokenizer(base_model, timer)
+
+
+def preload_model(base_model=BASE_MODEL, cpu_model_dir=CPU_MODEL_DIR):
+    """Loads the model before any request, for serve.py to do once before it forks its workers.
+
+    Nothing here starts a thread or runs a forward pass, so the forked workers
+    inherit the imported modules and the mapped weights in a usable state. An
+    int8 export is packed here too, on this thread: packed in each worker, the
+    copies would be private to it, and memory would grow with the worker count.
+    """
+    global _preloaded
+    from model_loading import StartupTimer
+
+    timer = StartupTimer()
+    model, tokenizer = _load_model(base_model, cpu_model_dir, timer)
+    if cpu_model_dir:
+        from cpu_export import pack_layers
+
+        with timer.phase("pack"):
+            pack_layers(model)
+    timer.notes["preloaded_pid"] = os.getpid()
+    _preloaded = (base_model, cpu_model_dir, model, tokenizer, timer)
+    print(f"Preloaded {cpu_model_dir or base_model} in {timer.summary()}; weights: {timer.notes['weights']}")
+
+
+def load_backend(base_model=BASE_MODEL, adapter_dir=ADAPTER_DIR, adapter_root=ADAPTER_ROOT,
+                 adapter_memory_mb=ADAPTER_MEMORY_MB, cpu_model_dir=CPU_MODEL_DIR):
+    """Loads the base model once; adapters are loaded per request through an AdapterRegistry.
+
+    The adapter saved by scripts/train_lora.py (adapter_dir) is registered as
+    "default" and used when a request doesn't name an adapter. With
+    cpu_model_dir, the merged int8 export there is served instead; its adapter
+    is baked in, so requests can't pick another one. The weights are
+    memory-mapped where possible (model_loading.py), the tokenizer is loaded on
+    first use, and a model preload_model already loaded is reused.
+    backend.startup has the time each phase took.
+    """
+    from model_loading import StartupTimer
+
+    if _preloaded is not None and _preloaded[:2] == (base_model, cpu_model_dir):
+        model, tokenizer, timer = _preloaded[2:]
+    else:
+        timer = StartupTimer()
+        print(f"Loading {cpu_model_dir or base_model} ...")
+        model, tokenizer = _load_model(base_model, cpu_model_dir, timer)
+        print(f"Loaded {cpu_model_dir or base_model} in {timer.summary()}; weights: {timer.notes['weights']}")
+    with timer.phase("imports"):
+        from adapter_registry import AdapterRegistry
+        from generation_cache import PREFIX_CACHE_MB, PrefixKVCache
+    prefix_cache = PrefixKVCache() if PREFIX_CACHE_MB > 0 else None
+
+    if cpu_model_dir:
+        from cpu_export import pack_in_background
+
+        pack_in_background(model)  # nothing left to pack if preload_model did it
+        backend = HFGenerationBackend(model, tokenizer, None, prefix_cache)
+    else:
+        has_default = bool(adapter_dir) and os.path.exists(os.path.join(adapter_dir, "adapter_config.json"))
+        registry = AdapterRegistry(model, adapter_root, int(adapter_memory_mb * 1024 * 1024),
+                                   extra_paths={"default": adapter_dir} if has_default else None,
+                                   default_adapter="default" if has_default else None)
+        backend = HFGenerationBackend(model, tokenizer, registry, prefix_cache)
+    backend.startup = timer
+    return backend
+
+
+class BackendUnavailable(Exception):
+    """Raised by BatchScheduler.submit when the model couldn't be loaded (the message is the load error)."""
+
+
+class BatchScheduler:
+    """Collects concurrent requests into micro-batches and runs them on one model thread.
+
+    A batch closes when it has max_batch_size requests, when adding the next request
+    would exceed max_batch_tokens, or max_wait_ms after its first request arrived.
+    Requests that arrive while a batch is generating simply wait in the queue and
+    form the next batch, so the event loop itself never runs model code. If the
+    model fails to load, submit raises BackendUnavailable, and keeps doing so without
+    retrying for LOAD_RETRY_SECONDS, so a broken setup isn't reloaded on every request.
+    """
+
+    def __init__(self, backend_factory, max_batch_size=MAX_BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS,
+                 max_wait_ms=MAX_WAIT_MS, response_cache=None):
+        self.backend_factory = backend_factory
+        self.response_cache = response_cache
+        self.backend = None
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000
+        # One thread owns the model: forward passes never overlap and never block the loop.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="akasha-model")
+        self.queue = None
+        self.task = None
+        self.start_lock = asyncio.Lock()
+        self.held = None  # request that didn't fit the previous batch; starts the next one
+        self.load_error = None  # (message, monotonic time of the failure) of the last failed load
+
+    async def _ensure_started(self):
+        async with self.start_lock:
+            if self.task is not None:
+                return
+            if self.load_error and time.monotonic() - self.load_error[1] < LOAD_RETRY_SECONDS:
+                raise BackendUnavailable(self.load_error[0])
+            loop = asyncio.get_running_loop()
+            try:
+                # The model is loaded on first use, on the model thread.
+                self.backend = await loop.run_in_executor(self.executor, self.backend_factory)
+            except Exception as e:
+                message = f"Model failed to load: {type(e).__name__}: {e}"
+                print(f"{message} (next attempt in {LOAD_RETRY_SECONDS:.0f}s)")
+                self.load_error = (message, time.monotonic())
+                raise BackendUnavailable(message) from e
+            self.load_error = None
+            self.queue = asyncio.Queue()
+            self.task = loop.create_task(self._run())
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        first, self.held = (self.held, None) if self.held else (await self.queue.get(), None)
+        batch, tokens = [first], first.cost
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                else:
+                    request = self.queue.get_nowait()
+            except asyncio.TimeoutError:
+                break
+            if request.cancelled:
+                continue
+            if tokens + request.cost > self.max_batch_tokens:
+                self.held = request
+                break
+            batch.append(request)
+            tokens += request.cost
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            batch = [r for r in batch if not r.cancelled]
+            if not batch:
+                continue
+            try:
+                await loop.run_in_executor(self.executor, self.backend.generate_batch, batch)
+            except Exception as e:
+                print(f"Generation batch failed: {type(e).__name__}: {e}")
+                for r in batch:
+                    r.emit("error", f"{type(e).__name__}: {e}")
+                continue
+            if self.response_cache is not None:
+                for r in batch:
+                    if r.cache_key is not None and r.result is not None:
+                        self.response_cache.put(r.cache_key, r.result, time.perf_counter() - r.submitted_at)
+
+    async def submit(self, prompt, max_new_tokens=128, temperature=0.0, top_p=1.0, adapter=None):
+        """Queues a prompt; returns a GenerationRequest whose events stream the output.
+
+        Raises AdapterNotFound (adapter_registry) for an adapter that isn't on disk.
+        """
+        await self._ensure_started()  # nothing is cached before the model is loaded
+        registry = getattr(self.backend, "registry", None)
+        if registry is not None and not registry.exists(adapter):
+            from adapter_registry import AdapterNotFound
+            raise AdapterNotFound(adapter)
+        cache_key = None
+        if self.response_cache is not None:
+            version = registry.version(adapter) if registry is not None else None  # a stat: the weights on disk now
+            cache_key = self.response_cache.key(adapter, prompt, max_new_tokens, temperature, top_p, version)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                request = GenerationRequest(prompt, [], max_new_tokens, temperature, top_p, adapter)
+                request.emit("token", cached["text"])
+                request.emit("done", {**cached, "cached": True})
+                return request
+        loop = asyncio.get_running_loop()
+        # Tokenize on the default pool, not the model thread or the event loop.
+        prompt_ids = await loop.run_in_executor(None, self.backend.encode, prompt)
+        request = GenerationRequest(prompt, prompt_ids, max_new_tokens, temperature, top_p, adapter)
+        request.cache_key = cache_key
+        await self.queue.put(request)
+        return request
+
+
+async def iter_events(request):
+    """Yields (kind, value) events until the request finishes or fails."""
+    try:
+        while True:
+            kind, value = await request.events.get()
+            yield kind, value
+            if kind in ("done", "error"):
+                return
+    finally:
+        # Client went away (or we finished): stop spending compute on this row.
+        request.cancelled = True
+
+
+async def collect(request):
+    """Waits for the whole completion; raises RuntimeError if generation failed."""
+    async for kind, value in iter_events(request):
+        if kind == "error":
+            raise RuntimeError(value)
+        if kind == "done":
+            return value
+
+
+async def sse_stream(request):
+    """Server-sent events: one `data:` line per text delta, then the final summary and [DONE]."""
+    async for kind, value in iter_events(request):
+        if kind == "token":
+            yield f"data: {json.dumps({'token': value})}\n\n"
+        elif kind == "done":
+            yield f"data: {json.dumps(value)}\n\n"
+        else:
+            yield f"data: {json.dumps({'error': value})}\n\n"
+    yield "data: [DONE]\n\n"
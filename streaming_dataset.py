@@ -0,0 +1,232 @@
+import json
+import os
+import random
+
+import torch
+from transformers import TrainerCallback
+
+from dataset_shards import format_example, format_prompt, iter_records
+
+
+def _distributed_rank_and_world():
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return int(os.environ.get("RANK", 0)), int(os.environ.get("WORLD_SIZE", 1))
+
+
+def _rng_for(seed, epoch, slot, n):
+    # One small deterministic RNG per draw, so a resumed run replays the exact
+    # same shuffle without having to persist Mersenne Twister state.
+    return random.Random(((seed * 1_000_003 + epoch) * 1_000_003 + slot) * 1_000_003 + n)
+
+
+def _read_lines(path, start=0, end=None):
+    """Non-blank lines of a JSONL file that start at a byte offset in [start, end)."""
+    with open(path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()  # the line running into `start` belongs to the previous range
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield line
+
+
+def _file_lines(path):
+    """A whole training file as JSON lines; a .json list is streamed item by item."""
+    if path.endswith(".jsonl"):
+        yield from _read_lines(path)
+    else:
+        for item in iter_records(path):
+            yield json.dumps(item).encode()
+
+
+class StreamingJsonlDataset(torch.utils.data.IterableDataset):
+    """Reads JSONL shards lazily and tokenizes on the fly, never holding the corpus in memory.
+
+    Every (rank, DataLoader worker) pair is a "slot". With at least as many files
+    as slots, each slot owns whole files; otherwise each slot reads its own byte
+    range of the .jsonl files (cut at line boundaries), so no line is read twice.
+    A .json list can't be cut and goes whole to one slot. A shuffle buffer of raw
+    lines gives approximate global shuffling; draws from it are seeded by (seed,
+    epoch, slot, draw number), so the order is reproducible and a run can resume
+    mid-epoch by skipping the lines each slot already produced (without parsing
+    or tokenizing them).
+
+    Every batch carries the slot it came from and how many samples that slot has
+    produced so far (stream_slot / stream_offset, see collator()). The trainer
+    reports them back with consumed(), so the saved position is what each slot
+    really delivered, even when some slots run dry before others.
+    """
+
+    def __init__(self, paths, tokenizer, max_length, shuffle_buffer=10_000, seed=0, rank=None, world_size=None,
+                 tokenize_batch=64):
+        self.paths = list(paths)
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        if rank is None or world_size is None:
+            rank, world_size = _distributed_rank_and_world()
+        self.rank = rank
+        self.world_size = world_size
+        self.tokenize_batch = tokenize_batch
+        self.epoch = 0
+        self.skip = {}  # slot -> samples already consumed this epoch (set by load_state_dict)
+        self.offsets = {}  # slot -> samples consumed by the trainer since then (see consumed())
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self.skip = {}
+            self.offsets = {}
+        self.epoch = epoch
+
+    def _slot_lines(self, slot, num_slots):
+        """Raw JSONL lines belonging to this slot, in file order."""
+        if len(self.paths) >= num_slots:
+            for path in self.paths[slot::num_slots]:
+                yield from _file_lines(path)
+            return
+        jsonl = [p for p in self.paths if p.endswith(".jsonl")]
+        for i, path in enumerate(p for p in self.paths if not p.endswith(".jsonl")):
+            if i % num_slots == slot:
+                yield from _file_lines(path)
+        # The .jsonl files read as one run of bytes; this slot takes lines starting in [low, high).
+        sizes = [os.path.getsize(p) for p in jsonl]
+        total = sum(sizes)
+        low, high = total * slot // num_slots, total * (slot + 1) // num_slots
+        start = 0
+        for path, size in zip(jsonl, sizes):
+            if start < high and low < start + size:
+                yield from _read_lines(path, max(low - start, 0), min(high - start, size))
+            start += size
+
+    def _shuffled(self, lines, slot):
+        if self.shuffle_buffer <= 1:
+            yield from lines
+            return
+        buffer = []
+        drawn = 0
+        for line in lines:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(line)
+                continue
+            i = _rng_for(self.seed, self.epoch, slot, drawn).randrange(len(buffer))
+            drawn += 1
+            yield buffer[i]
+            buffer[i] = line
+        while buffer:
+            i = _rng_for(self.seed, self.epoch, slot, drawn).randrange(len(buffer))
+            drawn += 1
+            buffer[i], buffer[-1] = buffer[-1], buffer[i]
+            yield buffer.pop()
+
+    def _tokenize(self, lines, slot, offset):
+        """Tokenized examples; `offset` is how many samples the slot produced before these lines."""
+        items = [json.loads(line) for line in lines]
+        encoded = self.tokenizer([format_example(i) for i in items], truncation=True, max_length=self.max_length)["input_ids"]
+        prompts = self.tokenizer([format_prompt(i) for i in items], truncation=True, max_length=self.max_length)["input_ids"]
+        for n, (ids, prompt_ids) in enumerate(zip(encoded, prompts), offset + 1):
+            ids = torch.tensor(ids, dtype=torch.long)
+            yield {"input_ids": ids, "attention_mask": torch.ones_like(ids), "prompt_length": min(len(prompt_ids), len(ids)),
+                   "stream_slot": slot, "stream_offset": n}
+
+    def slots(self, num_workers):
+        """Global slot ids owned by this rank when loaded with num_workers DataLoader workers."""
+        workers = max(num_workers, 1)
+        return [self.rank * workers + w for w in range(workers)]
+
+    def __iter__(self):
+        info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info else (0, 1)
+        slot = self.rank * num_workers + worker_id
+        num_slots = self.world_size * num_workers
+
+        stream = self._shuffled(self._slot_lines(slot, num_slots), slot)
+        offset = self.skip.get(slot, 0)
+        for _ in range(offset):
+            if next(stream, None) is None:
+                return
+        pending = []
+        for line in stream:
+            pending.append(line)
+            if len(pending) >= self.tokenize_batch:
+                yield from self._tokenize(pending, slot, offset)
+                offset += len(pending)
+                pending = []
+        if pending:
+            yield from self._tokenize(pending, slot, offset)
+
+    @staticmethod
+    def collator(collate):
+        """Wraps a collator so each batch keeps its slot and that slot's offset (a batch comes from one worker)."""
+
+        def collate_stream(batch):
+            out = collate(batch)
+            out["stream_slot"], out["stream_offset"] = batch[-1]["stream_slot"], batch[-1]["stream_offset"]
+            return out
+
+        return collate_stream
+
+    def consumed(self, slot, offset):
+        """Called by the trainer for each batch it takes: slot has now produced `offset` samples this epoch."""
+        self.offsets[slot] = offset
+
+    def state_dict(self, num_workers):
+        """Position to resume from: the samples each of this rank's slots has handed to the trainer."""
+        skip = {str(slot): self.offsets.get(slot, self.skip.get(slot, 0)) for slot in self.slots(num_workers)}
+        return {"epoch": self.epoch, "num_slots": self.world_size * max(num_workers, 1), "skip": skip}
+
+    def load_state_dict(self, state, num_workers):
+        num_slots = self.world_size * max(num_workers, 1)
+        if state["num_slots"] != num_slots:
+            raise ValueError(f"Stream position was saved with {state['num_slots']} slots; now {num_slots}. "
+                             "Resume with the same world size and dataloader_num_workers.")
+        self.epoch = state["epoch"]
+        self.skip = {int(slot): n for slot, n in state["skip"].items()}
+        self.offsets = {}
+
+
+STREAM_POSITION_FILE = "stream_position.json"
+
+
+def stream_position_file(rank):
+    return f"rank{rank}-{STREAM_POSITION_FILE}"
+
+
+def save_stream_position(dataset, checkpoint_dir, num_workers):
+    """Writes this rank's stream position next to a Trainer checkpoint."""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, stream_position_file(dataset.rank))
+    with open(path, "w") as f:
+        json.dump(dataset.state_dict(num_workers), f)
+
+
+def load_stream_position(dataset, checkpoint_dir, num_workers):
+    """Restores the position saved by save_stream_position; returns False if there is none."""
+    path = os.path.join(checkpoint_dir, stream_position_file(dataset.rank))
+    if not os.path.exists(path):
+        return False
+    with open(path, "r") as f:
+        dataset.load_state_dict(json.load(f), num_workers)
+    return True
+
+
+class StreamPositionCallback(TrainerCallback):
+    """Saves the stream position into every Trainer checkpoint so training resumes mid-epoch."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.started = False
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        # The first epoch is whatever load_state_dict restored; later ones reshuffle.
+        if self.started:
+            self.dataset.set_epoch(self.dataset.epoch + 1)
+        self.started = True
+
+    def checkpoint_files(self, args):
+        """Files the trainer adds to each checkpoint (name -> JSON-able object)."""
+        return {stream_position_file(self.dataset.rank): self.dataset.state_dict(args.dataloader_num_workers)}
@@ -0,0 +1,206 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+# Size of each write handed to the worker thread. Memory per upload stays at
+# roughly one chunk no matter how big the file is.
+CHUNK_SIZE = 1024 * 1024
+
+
+def safe_filename(filename):
+    """Strips any directory parts so uploads can't escape the upload dir."""
+    name = os.path.basename(filename or "")
+    if name in ("", ".", ".."):
+        raise ValueError(f"Invalid filename: {filename!r}")
+    return name
+
+
+def _write_chunk(f, hasher, chunk):
+    """Runs in a worker thread: write + hash, both off the event loop."""
+    f.write(chunk)
+    hasher.update(chunk)
+
+
+def hash_file(path, hasher=None):
+    """Hashes an existing file in CHUNK_SIZE pieces (used to rebuild resume state)."""
+    hasher = hasher or hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher
+
+
+async def stream_upload_to_disk(upload, dest_path):
+    """Copies a FastAPI UploadFile to dest_path chunk by chunk. Returns (size, sha256)."""
+    # Unique per call: two uploads of the same filename must not write into one partial file.
+    part_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    hasher = hashlib.sha256()
+    size = 0
+    f = await run_in_threadpool(open, part_path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            await run_in_threadpool(_write_chunk, f, hasher, chunk)
+            size += len(chunk)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(os.remove, part_path)
+        raise
+    await run_in_threadpool(f.close)
+    # Only the finished file ever appears under its real name.
+    await run_in_threadpool(os.replace, part_path, dest_path)
+    return size, hasher.hexdigest()
+
+
+class OffsetMismatch(Exception):
+    """Raised when a chunk doesn't start where the partial file currently ends."""
+
+    def __init__(self, expected):
+        super().__init__(f"Expected offset {expected}")
+        self.expected = expected
+
+
+class ResumableUploads:
+    """Offset-addressed chunk uploads that survive dropped connections and restarts.
+
+    State lives next to the partial file in <upload_dir>/.uploads/<id>.json, so an
+    interrupted transfer can ask for the current offset and continue from there.
+    Nothing else is shared between processes: the server may run several
+    workers (serve.py), so each session is locked with flock on its partial file,
+    and a worker's running sha256 is only trusted if it covers the whole file.
+    """
+
+    def __init__(self, upload_dir):
+        self.upload_dir = upload_dir
+        self.session_dir = os.path.join(upload_dir, ".uploads")
+        os.makedirs(self.session_dir, exist_ok=True)
+        self._hashers = {}  # upload_id -> (bytes hashed, running sha256), rebuilt from disk when stale
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.session_dir, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.session_dir, f"{upload_id}.part")
+
+    @contextlib.asynccontextmanager
+    async def _lock(self, upload_id):
+        """Exclusive hold on one session, across threads and worker processes."""
+        if not upload_id.isalnum():
+            raise KeyError(upload_id)
+        try:
+            fd = os.open(self._part_path(upload_id), os.O_RDONLY)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+        try:
+            await run_in_threadpool(fcntl.flock, fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # releases the lock
+
+    def _load_meta(self, upload_id):
+        # Upload ids are uuid hex; anything else can't be a session of ours.
+        if not upload_id.isalnum():
+            raise KeyError(upload_id)
+        try:
+            with open(self._meta_path(upload_id), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+
+    def _save_meta(self, meta):
+        path = self._meta_path(meta["upload_id"])
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def create(self, filename, total_size=None):
+        """Starts a new upload session and returns its metadata."""
+        meta = {
+            "upload_id": uuid.uuid4().hex,
+            "filename": safe_filename(filename),
+            "total_size": total_size,
+            "offset": 0,
+        }
+        open(self._part_path(meta["upload_id"]), "wb").close()
+        self._save_meta(meta)
+        self._hashers[meta["upload_id"]] = (0, hashlib.sha256())
+        return meta
+
+    def status(self, upload_id):
+        """Returns session metadata; 'offset' is where the next chunk must start."""
+        meta = self._load_meta(upload_id)
+        # The partial file is the source of truth if we crashed between write and save.
+        meta["offset"] = os.path.getsize(self._part_path(upload_id))
+        return meta
+
+    def _hasher(self, upload_id, size):
+        """Running sha256 of the partial file, which is `size` bytes long.
+
+        Another worker may have appended since this one last hashed, so a cached
+        hasher covering a different length is rebuilt from the file.
+        """
+        hashed, hasher = self._hashers.get(upload_id, (None, None))
+        if hashed != size:
+            hasher = hash_file(self._part_path(upload_id))
+        return hasher
+
+    async def write_chunks(self, upload_id, offset, chunks):
+        """Appends an async iterable of bytes at `offset`. Returns the new offset."""
+        async with self._lock(upload_id):
+            meta = await run_in_threadpool(self.status, upload_id)
+            if offset != meta["offset"]:
+                raise OffsetMismatch(meta["offset"])
+            hasher = await run_in_threadpool(self._hasher, upload_id, offset)
+            f = await run_in_threadpool(open, self._part_path(upload_id), "ab")
+
+            async def write(data):
+                # Checked before writing: bytes past total_size would leave the session unfinishable.
+                if meta["total_size"] is not None and meta["offset"] + len(data) > meta["total_size"]:
+                    raise ValueError(f"Upload exceeds declared size {meta['total_size']}")
+                await run_in_threadpool(_write_chunk, f, hasher, data)
+                meta["offset"] += len(data)
+
+            try:
+                buffer = bytearray()
+                async for piece in chunks:
+                    buffer += piece
+                    if len(buffer) >= CHUNK_SIZE:
+                        await write(bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await write(bytes(buffer))
+            except BaseException:
+                # Whatever reached the disk is kept; the hasher may be ahead of or
+                # behind it, so drop it and rebuild from the file on the next chunk.
+                self._hashers.pop(upload_id, None)
+                raise
+            finally:
+                await run_in_threadpool(f.close)
+            self._hashers[upload_id] = (meta["offset"], hasher)
+            await run_in_threadpool(self._save_meta, meta)
+            return meta["offset"]
+
+    async def complete(self, upload_id, expected_sha256=None, dest_dir=None):
+        """Verifies size/checksum and moves the finished file into dest_dir (default: the upload dir)."""
+        async with self._lock(upload_id):
+            meta = await run_in_threadpool(self.status, upload_id)
+            if meta["total_size"] is not None and meta["offset"] != meta["total_size"]:
+                raise ValueError(f"Upload incomplete: {meta['offset']}/{meta['total_size']} bytes")
+            digest = (await run_in_threadpool(self._hasher, upload_id, meta["offset"])).hexdigest()
+            if expected_sha256 and expected_sha256.lower() != digest:
+                raise ValueError(f"Checksum mismatch: got {digest}")
+            dest_path = os.path.join(dest_dir or self.upload_dir, meta["filename"])
+            await run_in_threadpool(os.replace, self._part_path(upload_id), dest_path)
+            await run_in_threadpool(os.remove, self._meta_path(upload_id))
+            self._hashers.pop(upload_id, None)
+            return {"filename": meta["filename"], "size": meta["offset"], "sha256": digest}
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+import httpx
+
+VAST_API_URL = os.environ.get("VAST_API_URL", "https://console.vast.ai/api/v0")
+TERMINAL_STATUSES = ("stopped", "error", "offline", "exited", "inactive")
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class VastAPIError(Exception):
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+def get_health_check_url(instance_details, internal_port):
+    """Public URL for an instance's internal port, from the 'ports' map in its details."""
+    ip = instance_details.get("public_ipaddr")
+    ports = instance_details.get("ports")
+    if not ip or not isinstance(ports, dict):
+        return None
+    try:
+        host_port = int(ports[f"{internal_port}/tcp"][0]["HostPort"])
+    except (TypeError, KeyError, IndexError, ValueError):
+        return None
+    return f"http://{ip}:{host_port}"
+
+
+class VastClient:
+    """Async Vast.ai API client over one pooled keep-alive connection set.
+
+    The API key goes in the Authorization header, never in URLs, and only to the
+    Vast API: instances are probed through a separate client without it. Requests that
+    fail with a connection error, 429 or 5xx are retried with full-jitter
+    exponential backoff (honouring Retry-After). Non-idempotent calls (instance
+    creation) are only retried when the request never reached the server.
+
+        async with VastClient(api_key) as vast:
+            instance = await vast.wait_until_ready(instance_id, health_port=8888)
+    """
+
+    def __init__(self, api_key, base_url=VAST_API_URL, timeout=30.0, max_connections=10, max_retries=4,
+                 backoff_base=0.5, backoff_max=8.0):
+        self.http = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers={"Authorization": f"Bearer {api_key}", "Accept": "application/json"},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        # Health checks go over plain http to the instance's public IP: no API key there.
+        self.instances = httpx.AsyncClient(timeout=timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {"requests": 0, "retries": 0, "errors": 0}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self.http.aclose()
+        await self.instances.aclose()
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def request(self, method, path, idempotent=True, **kwargs):
+        """Sends one API call with retries; returns the decoded JSON body."""
+        for attempt in range(self.max_retries + 1):
+            last_try = attempt == self.max_retries
+            self.stats["requests"] += 1
+            try:
+                response = await self.http.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # Never reached the server, so even a create is safe to resend.
+                if last_try:
+                    self.stats["errors"] += 1
+                    raise VastAPIError(f"{method} {path}: {e}") from e
+                self.stats["retries"] += 1
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except httpx.TransportError as e:
+                if last_try or not idempotent:
+                    self.stats["errors"] += 1
+                    raise VastAPIError(f"{method} {path}: {e}") from e
+                self.stats["retries"] += 1
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            if response.status_code in RETRY_STATUS_CODES and not last_try and (idempotent or response.status_code == 429):
+                self.stats["retries"] += 1
+                await asyncio.sleep(self._backoff(attempt, response.headers.get("Retry-After")))
+                continue
+            if response.is_error:
+                self.stats["errors"] += 1
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = response.text
+                raise VastAPIError(f"{method} {path}: HTTP {response.status_code}", response.status_code, body)
+            return response.json() if response.content else {}
+
+    async def search_offers(self, query):
+        """GET /bundles with a Vast search query dict; returns the offers list."""
+        data = await self.request("GET", "/bundles/", params={"q": json.dumps(query)})
+        return data.get("offers", [])
+
+    async def list_instances(self):
+        data = await self.request("GET", "/instances/")
+        return data.get("instances", [])
+
+    async def get_instance(self, instance_id):
+        """Details of one instance (not the whole instance list), or None if it doesn't exist yet."""
+        try:
+            data = await self.request("GET", f"/instances/{instance_id}/")
+        except VastAPIError as e:
+            if e.status_code == 404:
+                return None
+            raise
+        instance = data.get("instances", data)
+        return instance or None
+
+    async def start_instance(self, instance_id):
+        data = await self.request("PUT", f"/instances/{instance_id}/start/")
+        return data.get("success", True)
+
+    async def create_instance(self, offer_id, payload):
+        """Rents an offer; returns the new instance id."""
+        data = await self.request("PUT", f"/asks/{offer_id}/", idempotent=False, json=payload)
+        if not data.get("success"):
+            raise VastAPIError(f"Create from offer {offer_id} failed: {data}", body=data)
+        return data.get("new_contract")
+
+    async def destroy_instance(self, instance_id):
+        data = await self.request("DELETE", f"/instances/{instance_id}/")
+        return data.get("success", True)
+
+    async def check_health(self, url, timeout=5.0):
+        try:
+            response = await self.instances.get(url, timeout=timeout)
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    async def wait_until_ready(self, instance_id, health_port=None, timeout=900.0, min_interval=1.0,
+                               max_interval=15.0, health_interval=1.0):
+        """Polls an instance until it is running and (if health_port is set) its health URL answers 200.
+
+        Status polls start every min_interval seconds and back off by 1.5x up to
+        max_interval while nothing changes, snapping back whenever the status
+        does. Health checks run concurrently from the first moment a health URL
+        is known instead of waiting for the next status poll. Returns
+        {"ready", "status", "instance", "seconds", "polls", "health_checks"}.
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        state = {"status": None, "instance": None, "polls": 0, "health_checks": 0, "health_url": None}
+        url_known = asyncio.Event()
+
+        async def poll_status():
+            interval, last_status = min_interval, None
+            while time.monotonic() < deadline:
+                details = await self.get_instance(instance_id)
+                state["polls"] += 1
+                status = (details or {}).get("actual_status") or "unknown"
+                if status != last_status:
+                    print(f"  [{time.monotonic() - start:.1f}s] Instance {instance_id} status: {status}")
+                    last_status, interval = status, min_interval
+                else:
+                    interval = min(max_interval, interval * 1.5)
+                state["status"], state["instance"] = status, details
+                if status in TERMINAL_STATUSES:
+                    return False
+                if status == "running":
+                    if health_port is None:
+                        return True
+                    url = get_health_check_url(details, health_port)
+                    if url and url != state["health_url"]:
+                        state["health_url"] = url
+                        url_known.set()
+                await asyncio.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+            return False
+
+        async def poll_health():
+            await url_known.wait()
+            while time.monotonic() < deadline:
+                state["health_checks"] += 1
+                if await self.check_health(state["health_url"]):
+                    print(f"  [{time.monotonic() - start:.1f}s] Health check OK at {state['health_url']}")
+                    return True
+                await asyncio.sleep(health_interval)
+            return False
+
+        tasks = [asyncio.create_task(poll_status())]
+        if health_port is not None:
+            tasks.append(asyncio.create_task(poll_health()))
+        ready = False
+        try:
+            pending = set(tasks)
+            while pending and not ready:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break  # deadline
+                for task in done:
+                    result = task.result()
+                    if task is tasks[-1] and result:
+                        ready = True  # health (or, without health_port, the status poll) succeeded
+                    elif not result:
+                        pending = set()  # terminal status or timeout
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return {"ready": ready, "status": state["status"], "instance": state["instance"],
+                "seconds": time.monotonic() - start, "polls": state["polls"], "health_checks": state["health_checks"]}